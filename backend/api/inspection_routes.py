@@ -2,17 +2,34 @@
 巡检数据管理 API 路由
 """
 
+import io
 import json
+import shutil
+import tempfile
 from functools import wraps
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from services.inspection_service import InspectionService
 from services.project_service import ProjectService
+from services.screenshot_notifier import notify_screenshot_tasks
+from services.screenshot_service import ScreenshotService
+from services.screenshot_task_service import ScreenshotTaskService
 from models.database import get_db_connection
-from config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from utils.image_optimizer import mimetype_for_path
+from utils.json_stream import CHUNK_SIZE, load_skipping, iter_items
+from config import (
+    PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, BULK_INGEST_MAX_ITEMS, INGEST_STREAM_THRESHOLD_MB,
+    INGEST_STREAM_BATCH_SIZE, INGEST_STREAM_BATCH_MB, SCREENSHOTS_DIR
+)
 from utils.logger import get_logger
 
 logger = get_logger('api.inspection')
 
+# 流式解析时请求体先写入临时文件，超过该大小后落盘
+_SPOOL_MAX_MEMORY = 1024 * 1024
+
+# 流式解析时逐条读取并写入的路径
+_COMMANDS_PATH = ('data', 'commands')
+
 inspection_bp = Blueprint('inspections', __name__)
 
 
@@ -31,54 +48,88 @@ def handle_api_error(func):
     return wrapper
 
 
-@inspection_bp.route('/inspections', methods=['POST'])
-@handle_api_error
-def create_inspection():
-    """提交巡检数据"""
+def _parse_json_body():
+    """解析 JSON 请求体，格式错误时抛出 ValueError"""
     # 先尝试正常解析 JSON
     try:
-        body = request.get_json()
+        return request.get_json()
     except Exception:
         # 如果失败（如包含控制字符），读取原始数据使用 strict=False 解析
         raw_data = request.get_data(as_text=True)
         try:
-            body = json.loads(raw_data, strict=False)
+            return json.loads(raw_data, strict=False)
         except json.JSONDecodeError as e:
             logger.warning(f"JSON 解析失败: {e}")
-            return jsonify({
-                'success': False,
-                'error': f'JSON 格式错误: {str(e)}'
-            }), 400
+            raise ValueError(f'JSON 格式错误: {str(e)}')
+
+
+def _validate_inspection(body, resolve_project):
+    """
+    校验一条巡检数据
+
+    Args:
+        body: 请求体（包含 data、metadata、options）
+        resolve_project: 项目标识符 -> (project_id, project_code)
+
+    Returns:
+        tuple: (data, metadata, options)，metadata.project_id 已替换为项目代码
 
+    Raises:
+        ValueError: 校验失败
+    """
     if not body:
-        return jsonify({'success': False, 'error': '请求体不能为空'}), 400
+        raise ValueError('请求体不能为空')
+    if not isinstance(body, dict):
+        raise ValueError('巡检数据必须是 JSON 对象')
 
     data = body.get('data', {})
     metadata = body.get('metadata', {})
     options = body.get('options', {})
+    if not isinstance(data, dict) or not isinstance(metadata, dict) or not isinstance(options, dict):
+        raise ValueError('data、metadata、options 必须是 JSON 对象')
+    # 流式解析时 data.commands 尚未读取（为 None），由逐条解析时校验
+    commands = data.get('commands')
+    if commands is not None and not isinstance(commands, dict):
+        raise ValueError('data.commands 必须是 JSON 对象')
 
     # 验证必需字段
     if not metadata.get('hostname'):
-        return jsonify({'success': False, 'error': '缺少必需字段: metadata.hostname'}), 400
+        raise ValueError('缺少必需字段: metadata.hostname')
 
     if not metadata.get('timestamp'):
-        return jsonify({'success': False, 'error': '缺少必需字段: metadata.timestamp'}), 400
+        raise ValueError('缺少必需字段: metadata.timestamp')
 
     # 验证项目ID是否存在
     project_id = metadata.get('project_id')
     if project_id:
-        resolved_id, resolved_code = ProjectService.resolve_project_id(project_id)
+        resolved_id, resolved_code = resolve_project(project_id)
 
         if not resolved_id:
-            return jsonify({
-                'success': False,
-                'error': f'项目不存在: {project_id}。请先创建项目或检查项目标识是否正确。'
-            }), 400
+            raise ValueError(f'项目不存在: {project_id}。请先创建项目或检查项目标识是否正确。')
 
         metadata['project_id'] = resolved_code
 
-    # 创建记录
-    result = InspectionService.create_inspection(data, metadata, options)
+    return data, metadata, options
+
+
+@inspection_bp.route('/inspections', methods=['POST'])
+@handle_api_error
+def create_inspection():
+    """
+    提交巡检数据
+
+    请求体超过 INGEST_STREAM_THRESHOLD_MB（或长度未知）时流式解析：
+    先读取 metadata、options 和 data.env 并校验，再逐条解析 data.commands 并写入，
+    内存占用取决于最大的单条命令输出，而不是整个请求体。
+    """
+    length = request.content_length
+    if length is None or length > INGEST_STREAM_THRESHOLD_MB * 1024 * 1024:
+        result, metadata = _create_inspection_streaming()
+    else:
+        data, metadata, options = _validate_inspection(_parse_json_body(), ProjectService.resolve_project_id)
+
+        # 创建记录
+        result = InspectionService.create_inspection(data, metadata, options)
 
     logger.info(f"创建巡检记录成功: id={result['id']}, hostname={metadata.get('hostname')}")
     return jsonify({
@@ -88,6 +139,176 @@ def create_inspection():
     }), 201
 
 
+def _create_inspection_streaming():
+    """流式解析请求体并创建巡检记录，返回 (创建结果, metadata)"""
+    # 请求体需要读取两遍（先校验头部字段，再逐条写入命令），先复制到临时文件
+    with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_MEMORY) as spool:
+        shutil.copyfileobj(request.stream, spool, CHUNK_SIZE)
+        if not spool.tell():
+            raise ValueError('请求体不能为空')
+        logger.debug(f"流式解析巡检数据: {spool.tell()} 字节")
+
+        spool.seek(0)
+        body = load_skipping(spool, [_COMMANDS_PATH])
+        data, metadata, options = _validate_inspection(body, ProjectService.resolve_project_id)
+
+        spool.seek(0)
+        result = InspectionService.create_inspection(
+            data, metadata, options, commands=iter_items(spool, _COMMANDS_PATH)
+        )
+    return result, metadata
+
+
+@inspection_bp.route('/inspections/bulk', methods=['POST'])
+@handle_api_error
+def create_inspections_bulk():
+    """
+    批量提交多台主机的巡检数据
+
+    请求体为巡检数据数组（或 {"items": [...]}），每项格式与 POST /inspections 相同。
+    项目标识符每个只解析一次，所有记录在一个事务中写入。
+    返回每项的结果：全部成功 201，部分失败 207，全部失败 400。
+    """
+    body = _parse_json_body()
+    items = body.get('items') if isinstance(body, dict) else body
+    if not isinstance(items, list) or not items:
+        raise ValueError('请求体必须是非空的巡检数据数组')
+    if len(items) > BULK_INGEST_MAX_ITEMS:
+        raise ValueError(f'单次最多提交 {BULK_INGEST_MAX_ITEMS} 条巡检数据，实际 {len(items)} 条')
+
+    # 每个不同的项目标识符只查询一次
+    resolved_projects = ProjectService.resolve_project_ids(
+        item['metadata']['project_id'] for item in items
+        if isinstance(item, dict) and isinstance(item.get('metadata'), dict)
+        and isinstance(item['metadata'].get('project_id'), (str, int))
+    )
+
+    def resolve_project(project_id):
+        if not isinstance(project_id, (str, int)):
+            return None, None
+        return resolved_projects[project_id]
+
+    results = [None] * len(items)
+    valid_indexes, valid_items = [], []
+    for index, item in enumerate(items):
+        try:
+            valid_items.append(_validate_inspection(item, resolve_project))
+            valid_indexes.append(index)
+        except ValueError as e:
+            results[index] = {'index': index, 'success': False, 'error': str(e)}
+
+    if valid_items:
+        for index, result in zip(valid_indexes, InspectionService.create_inspections_bulk(valid_items)):
+            if isinstance(result, Exception):
+                logger.error(f"批量写入巡检记录失败 [index={index}]: {result}")
+                results[index] = {'index': index, 'success': False, 'error': str(result)}
+            else:
+                results[index] = {'index': index, 'success': True, 'data': result}
+
+    succeeded = sum(result['success'] for result in results)
+    failed = len(results) - succeeded
+    logger.info(f"批量创建巡检记录: 成功 {succeeded} 条，失败 {failed} 条")
+    status_code = 201 if not failed else 207 if succeeded else 400
+    return jsonify({
+        'success': failed == 0,
+        'data': {
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': failed,
+            'results': results
+        },
+        'message': f'成功 {succeeded} 条，失败 {failed} 条'
+    }), status_code
+
+
+@inspection_bp.route('/inspections:stream', methods=['POST'])
+def create_inspections_stream():
+    """
+    流式提交巡检数据（NDJSON）
+
+    每行一条巡检数据，格式与 POST /inspections 相同，空行忽略。
+    每 INGEST_STREAM_BATCH_SIZE 条（或累计 INGEST_STREAM_BATCH_MB）在一个事务中写入，
+    提交后立即返回这一批每行的确认：{"line", "success", "data"|"error"}，最后一行为汇总。
+    收到确认的行均已提交；读取请求体出错时未提交的行被丢弃，客户端可从最后确认的行之后重发。
+    """
+    batch_size = max(1, INGEST_STREAM_BATCH_SIZE)
+    batch_bytes = INGEST_STREAM_BATCH_MB * 1024 * 1024
+    stream = io.BufferedReader(request.stream, CHUNK_SIZE)
+    counts = {'total': 0, 'succeeded': 0, 'failed': 0}
+
+    # 同一连接中的项目标识符只查询一次
+    projects = {}
+
+    def resolve_project(project_id):
+        if not isinstance(project_id, (str, int)):
+            return None, None
+        if project_id not in projects:
+            projects[project_id] = ProjectService.resolve_project_id(project_id)
+        return projects[project_id]
+
+    def ack(payload):
+        return json.dumps(payload, ensure_ascii=False) + '\n'
+
+    def flush(batch):
+        """写入一批记录，按行号顺序返回每行的确认（整批一次输出）"""
+        valid = [(line_no, item) for line_no, item in batch if not isinstance(item, Exception)]
+        written = {}
+        if valid:
+            try:
+                results = InspectionService.create_inspections_bulk([item for _, item in valid])
+            except Exception as e:
+                logger.exception(f"流式写入巡检记录失败: {e}")
+                results = [e] * len(valid)
+            written = dict(zip((line_no for line_no, _ in valid), results))
+
+        acks = []
+        for line_no, item in batch:
+            result = written.get(line_no, item)
+            counts['total'] += 1
+            if isinstance(result, Exception):
+                counts['failed'] += 1
+                acks.append(ack({'line': line_no, 'success': False, 'error': str(result)}))
+            else:
+                counts['succeeded'] += 1
+                acks.append(ack({'line': line_no, 'success': True, 'data': result}))
+        if acks:
+            yield ''.join(acks)
+
+    def generate():
+        batch, pending_bytes, line_no, error = [], 0, 0, None
+        try:
+            for line_no, line in enumerate(iter(stream.readline, b''), 1):
+                if not line.strip():
+                    continue
+                try:
+                    body = json.loads(line, strict=False)
+                except ValueError as e:
+                    item = ValueError(f'JSON 格式错误: {e}')
+                else:
+                    try:
+                        item = _validate_inspection(body, resolve_project)
+                    except ValueError as e:
+                        item = e
+                batch.append((line_no, item))
+                pending_bytes += len(line)
+                if len(batch) >= batch_size or pending_bytes >= batch_bytes:
+                    yield from flush(batch)
+                    batch, pending_bytes = [], 0
+            yield from flush(batch)
+        except Exception as e:
+            # 请求体读取失败（连接中断、解压错误等）：未提交的行不写入
+            logger.warning(f"流式提交中断于第 {line_no} 行: {e}")
+            error = f"读取第 {line_no} 行时出错，未确认的行未写入: {e}"
+
+        logger.info(f"流式提交巡检数据: 成功 {counts['succeeded']} 条，失败 {counts['failed']} 条")
+        summary = {'done': error is None, **counts}
+        if error:
+            summary['error'] = error
+        yield ack(summary)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @inspection_bp.route('/inspections', methods=['GET'])
 @handle_api_error
 def get_inspections():
@@ -157,21 +378,69 @@ def get_screenshot_status(record_id):
         status = {row['screenshot_status']: row['count'] for row in cursor.fetchall()}
 
     # 统一构建所有状态
-    all_statuses = ['pending', 'processing', 'completed', 'failed', 'skipped']
+    all_statuses = ['pending', 'processing', 'completed', 'failed', 'dead', 'skipped']
     status_data = {s: status.get(s, 0) for s in all_statuses}
 
     return jsonify({'success': True, 'data': status_data}), 200
 
 
+@inspection_bp.route('/commands/<int:command_id>/screenshot', methods=['GET'])
+@handle_api_error
+def get_command_screenshot(command_id):
+    """
+    获取命令截图（第 part 张分片，默认第 0 张）
+
+    截图仍在排队时立即按需渲染，最多等待 SCREENSHOT_LAZY_WAIT_SECONDS 秒；
+    超时返回 202 和 Retry-After，客户端稍后重试即可（渲染在后台继续）。
+    """
+    part = int(request.args.get('part', 0))
+    state = ScreenshotTaskService.render_on_demand(command_id)
+    if state is None:
+        return jsonify({'success': False, 'error': '命令不存在'}), 404
+
+    status = state['screenshot_status']
+    if status in ('pending', 'processing'):
+        response = jsonify({'success': False, 'error': '截图生成中，请稍后重试', 'data': {'status': status}})
+        response.headers['Retry-After'] = '2'
+        return response, 202
+    if status != 'completed':
+        return jsonify({
+            'success': False,
+            'error': f'截图不可用: {status}',
+            'data': {'status': status, 'last_error': state['last_error']}
+        }), 404
+
+    parts = ScreenshotService.parse_screenshot_parts(state['screenshot_path'], state['screenshot_parts'])
+    if not 0 <= part < len(parts):
+        return jsonify({'success': False, 'error': f'分片不存在: {part}（共 {len(parts)} 张）'}), 404
+    file_path = SCREENSHOTS_DIR / parts[part]
+    if not file_path.exists():
+        return jsonify({'success': False, 'error': '截图不存在'}), 404
+    return send_file(file_path, mimetype=mimetype_for_path(file_path), download_name=file_path.name)
+
+
 @inspection_bp.route('/inspections/<int:record_id>/regenerate-screenshots', methods=['POST'])
 @handle_api_error
 def regenerate_screenshots(record_id):
     """重新生成截图（将状态改为 pending）"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
+
+        # 释放原有截图引用
+        cursor.execute('''
+            SELECT screenshot_path, screenshot_parts FROM command_executions
+            WHERE record_id = ? AND screenshot_path IS NOT NULL
+        ''', (record_id,))
+        ScreenshotService.release_screenshots([
+            path for row in cursor.fetchall()
+            for path in ScreenshotService.parse_screenshot_parts(row[0], row[1])
+        ], conn)
+
         cursor.execute('''
             UPDATE command_executions
-            SET screenshot_status = 'pending', screenshot_path = NULL
+            SET screenshot_status = 'pending', screenshot_path = NULL, screenshot_parts = NULL,
+                screenshot_format = NULL, screenshot_size = NULL, screenshot_scale = NULL,
+                claimed_by = NULL, lease_expires_at = NULL, attempts = 0, last_error = NULL
             WHERE record_id = ?
         ''', (record_id,))
         updated = cursor.rowcount
@@ -179,6 +448,7 @@ def regenerate_screenshots(record_id):
     if updated == 0:
         return jsonify({'success': False, 'error': '记录不存在或无命令'}), 404
 
+    notify_screenshot_tasks()
     logger.info(f"重置截图状态: record_id={record_id}, count={updated}")
     return jsonify({
         'success': True,
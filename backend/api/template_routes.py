@@ -27,7 +27,8 @@ def create_template():
             "include_screenshots": true,
             "title_format": "巡检报告 - {project_id}",
             "section_organization": "by_host",
-            "custom_fields": []
+            "custom_fields": [],
+            "screenshot_format": "jpeg"  // 可选，报告中截图的格式（png 或 jpeg），默认沿用存储格式（WebP 转为 PNG）
         }
     }
     """
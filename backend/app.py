@@ -12,13 +12,16 @@ import os
 import signal
 import atexit
 import threading
-import time
 from pathlib import Path
 
 # 添加当前目录到 Python 路径
 sys.path.insert(0, str(Path(__file__).parent))
 
 from utils.screenshot_generator import generate_screenshot_bytes
+from utils.image_optimizer import mimetype_for_path
+from utils.request_decompression import DecompressionMiddleware, supported_encodings
+from utils.browser_pool import shutdown_browser_pool, get_browser_stats
+from utils.async_browser_pool import shutdown_async_browser_pool
 from utils.logger import setup_logging, get_logger
 from models.database import init_database, get_db_connection
 from api.inspection_routes import inspection_bp
@@ -26,8 +29,17 @@ from api.report_routes import report_bp
 from api.template_routes import template_bp
 from api.project_routes import project_bp
 from services.template_service import TemplateService
+from services.output_store import OutputStore
+from services.screenshot_service import ScreenshotService
 from services.screenshot_task_service import ScreenshotTaskService
-from config import SCREENSHOTS_DIR, DATA_DIR, REPORTS_DIR, DATABASE_PATH
+from services.screenshot_worker_pool import ScreenshotWorkerPool
+from services import screenshot_notifier
+from config import (
+    SCREENSHOTS_DIR, DATA_DIR, REPORTS_DIR, DATABASE_PATH,
+    DEFAULT_FONT_FILE, DEFAULT_SCALE_FACTOR,
+    SCREENSHOT_WORKER_PROCESSES, SCREENSHOT_WORKER_BATCH_SIZE, SCREENSHOT_WORKER_POLL_INTERVAL,
+    SCREENSHOT_EMBEDDED_WORKER
+)
 
 # 初始化日志
 setup_logging()
@@ -35,6 +47,7 @@ logger = get_logger('app')
 
 app = Flask(__name__)
 CORS(app)  # 启用跨域支持
+app.wsgi_app = DecompressionMiddleware(app.wsgi_app)  # 解压 gzip/zstd 压缩的请求体
 
 # 初始化数据库
 logger.info("正在初始化数据库...")
@@ -48,22 +61,36 @@ logger.info("默认模板初始化完成")
 
 # 后台截图处理线程
 _screenshot_worker_running = True
+_screenshot_wakeup = screenshot_notifier.subscribe()
+_worker_pool = None
 
 def screenshot_worker():
-    """后台截图处理线程"""
+    """后台截图处理线程（新任务入队时被唤醒，超时兜底轮询）"""
     while _screenshot_worker_running:
+        _screenshot_wakeup.clear()
         try:
-            processed = ScreenshotTaskService.process_all_pending()
+            processed = ScreenshotTaskService.process_all_pending(
+                batch_size=SCREENSHOT_WORKER_BATCH_SIZE,
+                should_stop=lambda: not _screenshot_worker_running
+            )
             if processed > 0:
                 logger.info(f"后台处理了 {processed} 个截图任务")
         except Exception as e:
             logger.exception(f"截图处理错误: {e}")
-        time.sleep(5)  # 每 5 秒检查一次
-
-# 启动后台线程
-_worker_thread = threading.Thread(target=screenshot_worker, daemon=True, name="ScreenshotWorker")
-_worker_thread.start()
-logger.info("截图后台处理线程已启动")
+        _screenshot_wakeup.wait(SCREENSHOT_WORKER_POLL_INTERVAL)
+
+if not SCREENSHOT_EMBEDDED_WORKER:
+    # 截图任务由独立的 worker.py 进程处理，入队时通过 screenshot_notifier 唤醒
+    logger.info("未启动内置截图工作者（SCREENSHOT_EMBEDDED_WORKER=0），请单独运行 worker.py")
+elif SCREENSHOT_WORKER_PROCESSES > 0:
+    # 启动截图工作进程池（需在其他线程启动前 fork）
+    _worker_pool = ScreenshotWorkerPool()
+    _worker_pool.start()
+else:
+    # 启动后台线程
+    _worker_thread = threading.Thread(target=screenshot_worker, daemon=True, name="ScreenshotWorker")
+    _worker_thread.start()
+    logger.info("截图后台处理线程已启动")
 
 # 注册蓝图
 app.register_blueprint(inspection_bp, url_prefix='/api/v1')
@@ -75,8 +102,9 @@ app.register_blueprint(project_bp, url_prefix='/api/v1')
 # ========== 健康检查 ==========
 @app.route('/health', methods=['GET'])
 def health():
-    """健康检查端点"""
-    return jsonify({"status": "ok"}), 200
+    """健康检查端点（Accept-Encoding 响应头声明支持的请求体压缩格式，采集脚本据此压缩上传数据）"""
+    encodings = supported_encodings()
+    return jsonify({"status": "ok", "accept_encoding": encodings}), 200, {'Accept-Encoding': ', '.join(encodings)}
 
 
 # ========== 静态脚本下载 ==========
@@ -89,6 +117,15 @@ def serve_script():
     return send_file(script_path, mimetype='text/plain', as_attachment=True)
 
 
+def _browser_event_stats():
+    """汇总本进程和截图工作进程的浏览器事件统计（超时、回收次数）"""
+    stats = get_browser_stats()
+    if _worker_pool:
+        for key, count in _worker_pool.get_browser_stats().items():
+            stats[key] += count
+    return stats
+
+
 @app.route('/api/v1/stats', methods=['GET'])
 def stats():
     """系统统计信息"""
@@ -123,7 +160,11 @@ def stats():
                     'total_commands': total_commands,
                     'total_reports': total_reports,
                     'total_projects': total_projects,
-                    'total_hosts': total_hosts
+                    'total_hosts': total_hosts,
+                    'screenshot_workers': _worker_pool.get_stats() if _worker_pool else [],
+                    'screenshot_cache': ScreenshotService.get_cache_stats(),
+                    'output_store': OutputStore.get_stats(),
+                    'browser_events': _browser_event_stats()
                 }
             }), 200
 
@@ -153,10 +194,10 @@ def get_screenshot(screenshot_path):
         except ValueError:
             return jsonify({'success': False, 'error': '无效的文件路径'}), 403
         
-        # 返回图片文件
+        # 返回图片文件（按扩展名返回 PNG/WebP/JPEG 类型）
         return send_file(
             file_path,
-            mimetype='image/png',
+            mimetype=mimetype_for_path(file_path),
             as_attachment=False,
             download_name=file_path.name
         )
@@ -185,7 +226,7 @@ def generate():
             "return_code": 0
         },
         "font_file": "OperatorMono-Medium.otf",  // 可选
-        "scale_factor": 3  // 可选，默认 3
+        "scale_factor": 3  // 可选，默认 3；"auto" 表示按像素预算和打印 DPI 自适应选择
     }
 
     响应: PNG 图片（Content-Type: image/png）
@@ -269,6 +310,13 @@ if __name__ == '__main__':
     def signal_handler(signum, frame):
         """处理终止信号"""
         logger.info(f"收到信号 {signum}，正在关闭服务器...")
+        global _screenshot_worker_running
+        _screenshot_worker_running = False
+        _screenshot_wakeup.set()
+        if _worker_pool:
+            _worker_pool.stop()
+        shutdown_browser_pool()
+        shutdown_async_browser_pool()
         cleanup()
         sys.exit(0)
     
@@ -16,18 +16,60 @@ REPORTS_DIR = DATA_DIR / 'reports'
 
 # 数据库配置
 DATABASE_PATH = DATA_DIR / 'inspections.db'
+DATABASE_BUSY_TIMEOUT = float(os.environ.get('DATABASE_BUSY_TIMEOUT', 30))  # 等待其他连接释放 SQLite 写锁的最长时间（秒），所有连接（写入、领取任务、续租）共用
 
 # 字体配置
 DEFAULT_FONT_FILE = 'OperatorMono-Medium.otf'
 DEFAULT_SCALE_FACTOR = 3
+SCREENSHOT_SCALE_MODE = os.environ.get('SCREENSHOT_SCALE_MODE', 'fixed')  # 设备像素比: fixed（固定为 DEFAULT_SCALE_FACTOR）或 adaptive（按像素预算和打印 DPI 自动选择）
+SCREENSHOT_MIN_SCALE_FACTOR = float(os.environ.get('SCREENSHOT_MIN_SCALE_FACTOR', 1))  # adaptive 模式下的最小设备像素比
+SCREENSHOT_MAX_MEGAPIXELS = float(os.environ.get('SCREENSHOT_MAX_MEGAPIXELS', 24))  # adaptive 模式下单个命令所有截图的像素总数上限（百万像素）
+REPORT_TARGET_DPI = int(os.environ.get('REPORT_TARGET_DPI', 300))  # adaptive 模式下截图按报告宽度打印的目标 DPI，超过即不再放大
 
 # 截图配置
 SCREENSHOT_MAX_LINE_LENGTH = 160  # 每行最大字符数，超长自动换行
+SCREENSHOT_ENGINE = os.environ.get('SCREENSHOT_ENGINE', 'playwright')  # 截图引擎: playwright（Chromium 浏览器池）、playwright_async（Chromium 多页面并行，需显式开启）或 pillow（无需浏览器）
+SCREENSHOT_RECORD_WAIT_TIME = os.environ.get('SCREENSHOT_RECORD_WAIT_TIME', '0').lower() in ('1', 'true', 'yes')  # 记录每次渲染等待就绪的耗时
+SCREENSHOT_TILE_MAX_LINES = int(os.environ.get('SCREENSHOT_TILE_MAX_LINES', 200))  # 单张截图最大行数，超长输出按顺序切分为多张
+SCREENSHOT_TILE_MAX_PIXELS = int(os.environ.get('SCREENSHOT_TILE_MAX_PIXELS', 16_000_000))  # 单张截图最大像素数（按设备像素计）
+SCREENSHOT_PAGE_MAX_PIXELS = int(os.environ.get('SCREENSHOT_PAGE_MAX_PIXELS', 64_000_000))  # 单个渲染页面内所有截图的像素总数上限
+SCREENSHOT_IMAGE_FORMAT = os.environ.get('SCREENSHOT_IMAGE_FORMAT', 'png')  # 截图存储格式: png、webp（无损）或 jpeg
+SCREENSHOT_PNG_QUANTIZE = os.environ.get('SCREENSHOT_PNG_QUANTIZE', '1').lower() in ('1', 'true', 'yes')  # PNG 颜色不超过 256 种时无损转为调色板图像
+SCREENSHOT_PNG_COMPRESS_LEVEL = int(os.environ.get('SCREENSHOT_PNG_COMPRESS_LEVEL', 6))  # PNG zlib 压缩级别（0-9，9 比 6 慢约十倍，体积只小约一成）
+SCREENSHOT_JPEG_QUALITY = int(os.environ.get('SCREENSHOT_JPEG_QUALITY', 92))  # JPEG 质量（存储格式或报告模板选择 jpeg 时使用）
+
+# 浏览器池配置
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', 1))  # 常驻浏览器数量
+BROWSER_MAX_RENDERS = int(os.environ.get('BROWSER_MAX_RENDERS', 500))  # 单个浏览器渲染次数上限，超过后重启
+BROWSER_MAX_RSS_MB = int(os.environ.get('BROWSER_MAX_RSS_MB', 1024))  # 单个浏览器进程树的内存上限（MB），超过后重启，0 表示不限制
+SCREENSHOT_RENDER_TIMEOUT = int(os.environ.get('SCREENSHOT_RENDER_TIMEOUT', 60))  # 单次渲染期限（秒），超过后强制结束并重启浏览器
+ASYNC_BROWSER_MAX_PAGES = int(os.environ.get('ASYNC_BROWSER_MAX_PAGES', 4))  # playwright_async 引擎同时渲染的页面数
+
+# 截图后台任务配置
+SCREENSHOT_EMBEDDED_WORKER = os.environ.get('SCREENSHOT_EMBEDDED_WORKER', '1').lower() in ('1', 'true', 'yes')  # 是否在 API 进程内启动截图工作者，独立运行 worker.py 时设为 0
+SCREENSHOT_NOTIFY_DIR = DATA_DIR / 'notify'  # 独立截图工作者的通知套接字目录
+SCREENSHOT_WORKER_PROCESSES = int(os.environ.get('SCREENSHOT_WORKER_PROCESSES', 0))  # 截图工作进程数，0 表示使用进程内单线程；大于 0 时启动工作进程池（需显式开启）
+SCREENSHOT_WORKER_BATCH_SIZE = int(os.environ.get('SCREENSHOT_WORKER_BATCH_SIZE', 20))  # 每次拉取的任务数
+SCREENSHOT_WORKER_POLL_INTERVAL = float(os.environ.get('SCREENSHOT_WORKER_POLL_INTERVAL', 30))  # 兜底轮询间隔（秒），新任务入队时会立即唤醒
+SCREENSHOT_WORKER_STATS_INTERVAL = float(os.environ.get('SCREENSHOT_WORKER_STATS_INTERVAL', 60))  # 吞吐量日志间隔（秒）
+SCREENSHOT_TASK_LEASE_SECONDS = int(os.environ.get('SCREENSHOT_TASK_LEASE_SECONDS', 300))  # 任务租约时长（秒），超时未完成会被重新放回队列
+SCREENSHOT_BATCH_RENDER = os.environ.get('SCREENSHOT_BATCH_RENDER', '1').lower() in ('1', 'true', 'yes')  # 按巡检记录在单个页面中批量渲染
+SCREENSHOT_TASK_MAX_ATTEMPTS = int(os.environ.get('SCREENSHOT_TASK_MAX_ATTEMPTS', 3))  # 最大尝试次数，超过后进入 dead 状态
+SCREENSHOT_LAZY_RENDER = os.environ.get('SCREENSHOT_LAZY_RENDER', '1').lower() in ('1', 'true', 'yes')  # 请求尚未生成的截图时在 API 进程中立即渲染
+SCREENSHOT_LAZY_RENDER_THREADS = int(os.environ.get('SCREENSHOT_LAZY_RENDER_THREADS', 2))  # API 进程中按需渲染的线程数
+SCREENSHOT_LAZY_WAIT_SECONDS = float(os.environ.get('SCREENSHOT_LAZY_WAIT_SECONDS', 10))  # 请求截图时等待渲染完成的最长时间（秒）
 
 # API 配置
 API_VERSION = 'v1'
 PAGE_SIZE_DEFAULT = 20
 PAGE_SIZE_MAX = 100
+BULK_INGEST_MAX_ITEMS = int(os.environ.get('BULK_INGEST_MAX_ITEMS', 500))  # 批量提交接口单次最多的巡检数据条数
+REQUEST_MAX_DECOMPRESSED_MB = int(os.environ.get('REQUEST_MAX_DECOMPRESSED_MB', 64))  # 压缩请求体解压后的大小上限（MB）
+REQUEST_MAX_DECOMPRESSION_RATIO = int(os.environ.get('REQUEST_MAX_DECOMPRESSION_RATIO', 100))  # 压缩请求体解压后超过 1 MB 时允许的最大压缩比
+INGEST_STREAM_THRESHOLD_MB = float(os.environ.get('INGEST_STREAM_THRESHOLD_MB', 4))  # POST /inspections 请求体超过该大小（或长度未知）时流式解析，逐条写入命令
+INGEST_STREAM_BATCH_SIZE = int(os.environ.get('INGEST_STREAM_BATCH_SIZE', 200))  # NDJSON 流式提交接口每个事务写入的最多记录数
+INGEST_STREAM_BATCH_MB = float(os.environ.get('INGEST_STREAM_BATCH_MB', 16))  # NDJSON 流式提交接口每批累计的数据量达到该值（MB）时提前提交
+OUTPUT_BLOB_CODEC = os.environ.get('OUTPUT_BLOB_CODEC', 'zlib').lower()  # 命令输出压缩算法：zlib 或 zstd（需安装 zstandard，读取这些输出的所有进程也需要安装）
 
 # 报告配置
 REPORT_TITLE_DEFAULT = '服务器巡检报告'
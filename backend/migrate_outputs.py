@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+命令输出迁移
+把旧数据中直接保存在 command_executions.output 的输出迁移到 output_blobs
+（按内容哈希去重并压缩），完成后报告压缩比和去重比。
+
+用法:
+    python -m backend.migrate_outputs          # 在仓库根目录
+    python migrate_outputs.py --vacuum         # 在 backend 目录，迁移后回收数据库文件空间
+可重复执行，中断后再次运行只处理剩余的行；迁移期间 API 服务和截图工作者可以继续运行。
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from models.database import init_database, get_db_connection
+from services.output_store import OutputStore
+from utils.logger import setup_logging
+from config import DATABASE_PATH
+
+
+def _format_bytes(size):
+    if size < 1024:
+        return f"{size} B"
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+
+
+def _database_size():
+    """数据库文件及 WAL 文件的总大小"""
+    return sum(
+        os.path.getsize(path) for path in (DATABASE_PATH, Path(f"{DATABASE_PATH}-wal"))
+        if os.path.exists(path)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='迁移命令输出到去重压缩存储')
+    parser.add_argument('--batch-size', type=int, default=500, help='每个事务迁移的行数')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='迁移后执行 VACUUM 回收空间（期间数据库不可写，需要与数据库大小相当的临时磁盘空间）')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    init_database()
+    size_before = _database_size()
+    started = time.monotonic()
+    print(f"数据库: {DATABASE_PATH.resolve()} ({_format_bytes(size_before)})")
+
+    def on_batch(stats):
+        print(f"\r已迁移 {stats['rows']} 行，{_format_bytes(stats['raw_bytes'])}", end='', flush=True)
+
+    stats = OutputStore.migrate_inline_outputs(max(1, args.batch_size), on_batch)
+    if not stats['rows']:
+        print("没有需要迁移的行")
+    else:
+        print()
+        print(f"本次迁移 {stats['rows']} 行，用时 {time.monotonic() - started:.1f}s")
+        print(f"  输出原始大小: {_format_bytes(stats['raw_bytes'])}")
+        print(f"  去重后: {stats['new_blobs']} 个新输出，{_format_bytes(stats['unique_bytes'])}"
+              f"（去重比 {OutputStore.ratio(stats['raw_bytes'], stats['unique_bytes'])}:1）")
+        print(f"  压缩后: {_format_bytes(stats['stored_bytes'])}"
+              f"（压缩比 {OutputStore.ratio(stats['unique_bytes'], stats['stored_bytes'])}:1）")
+
+    if args.vacuum:
+        print("正在执行 VACUUM...")
+        with get_db_connection() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        with get_db_connection() as conn:
+            conn.isolation_level = None
+            conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        print(f"数据库文件: {_format_bytes(size_before)} -> {_format_bytes(_database_size())}")
+    elif stats['rows']:
+        print("释放的页面会被之后的写入复用；如需缩小数据库文件，使用 --vacuum 重新运行")
+
+    total = OutputStore.get_stats()
+    print(f"输出存储合计: {total['refs']} 条命令引用 {total['blobs']} 个输出，"
+          f"{_format_bytes(total['logical_bytes'])} -> {_format_bytes(total['unique_bytes'])}"
+          f"（去重比 {total['dedup_ratio']}:1）-> {_format_bytes(total['stored_bytes'])}"
+          f"（压缩比 {total['compression_ratio']}:1，总计 {total['total_ratio']}:1）")
+    if total['inline_rows']:
+        print(f"仍有 {total['inline_rows']} 行未迁移（迁移期间新写入的旧格式数据），可再次运行")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
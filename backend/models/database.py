@@ -4,14 +4,17 @@
 
 import sqlite3
 from contextlib import contextmanager
-from config import DATABASE_PATH
+from config import DATABASE_PATH, DATABASE_BUSY_TIMEOUT
 
 
 def init_database():
     """初始化数据库表和索引"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(DATABASE_PATH, timeout=DATABASE_BUSY_TIMEOUT)
     cursor = conn.cursor()
 
+    # WAL 模式：多个截图工作进程写入时不阻塞 API 读取
+    cursor.execute('PRAGMA journal_mode=WAL')
+
     # 创建 inspection_records 表（巡检记录）
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS inspection_records (
@@ -73,6 +76,72 @@ def init_database():
         # 旧数据：将 command 复制到 name 作为默认值
         cursor.execute("UPDATE command_executions SET name = command WHERE name IS NULL")
 
+    # 迁移：截图任务领取和租约字段
+    cursor.execute("PRAGMA table_info(command_executions)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'claimed_by' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN claimed_by VARCHAR(100)")
+    if 'lease_expires_at' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN lease_expires_at DATETIME")
+    if 'attempts' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN attempts INTEGER DEFAULT 0")
+    if 'last_error' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN last_error TEXT")
+
+    # 迁移：截图分片（JSON 数组，按顺序排列；screenshot_path 为第一张分片）
+    if 'screenshot_parts' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN screenshot_parts TEXT")
+
+    # 迁移：截图编码格式和所有分片的总字节数
+    if 'screenshot_format' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN screenshot_format VARCHAR(10)")
+    if 'screenshot_size' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN screenshot_size INTEGER")
+
+    # 迁移：截图渲染使用的设备像素比（adaptive 模式下每条命令不同）
+    if 'screenshot_scale' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN screenshot_scale REAL")
+
+    # 迁移：命令输出改为引用 output_blobs（旧数据的输出仍在 output 列中，由 migrate_outputs.py 迁移）
+    if 'output_hash' not in columns:
+        cursor.execute("ALTER TABLE command_executions ADD COLUMN output_hash VARCHAR(64)")
+
+    # 创建 output_blobs 表（内容寻址的命令输出，ref_count 为引用该输出的命令数；
+    # data 放在最后一列，读取统计字段时不需要读取大输出的溢出页）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS output_blobs (
+            hash VARCHAR(64) PRIMARY KEY,
+            codec VARCHAR(10) NOT NULL,
+            raw_size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            ref_count INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data BLOB NOT NULL
+        )
+    ''')
+
+    # 创建 screenshot_cache 表（内容寻址截图缓存，ref_count 为引用该文件的命令数）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS screenshot_cache (
+            cache_key VARCHAR(64) PRIMARY KEY,
+            screenshot_path VARCHAR(500) NOT NULL,
+            ref_count INTEGER DEFAULT 0,
+            hit_count INTEGER DEFAULT 0,
+            file_size INTEGER,
+            raw_size INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_screenshot_cache_path ON screenshot_cache(screenshot_path)')
+
+    # 迁移：优化前的 PNG 字节数（用于统计编码节省的空间）
+    cursor.execute("PRAGMA table_info(screenshot_cache)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'raw_size' not in columns:
+        cursor.execute("ALTER TABLE screenshot_cache ADD COLUMN raw_size INTEGER")
+
     # 创建 report_generations 表（报告生成记录）
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS report_generations (
@@ -133,7 +202,7 @@ def get_db_connection():
             cursor = conn.cursor()
             cursor.execute(...)
     """
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(DATABASE_PATH, timeout=DATABASE_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row  # 返回字典格式
     # 启用外键约束
     conn.execute('PRAGMA foreign_keys = ON')
@@ -5,14 +5,16 @@
 
 import json
 from models.database import get_db_connection
-from config import SCREENSHOTS_DIR
+from services.output_store import OutputStore
+from services.screenshot_notifier import notify_screenshot_tasks
+from services.screenshot_service import ScreenshotService
 
 
 class InspectionService:
     """巡检数据处理服务"""
 
     @staticmethod
-    def create_inspection(data, metadata, options=None):
+    def create_inspection(data, metadata, options=None, commands=None):
         """
         创建巡检记录
 
@@ -20,58 +22,129 @@ class InspectionService:
             data: 包含 env 和 commands 的字典
             metadata: 元数据（hostname, ip, timestamp 等）
             options: 可选配置（generate_screenshots, notes）
+            commands: 可选的 (键, 命令) 迭代器，代替 data['commands']；
+                      流式解析时每解析出一条命令即写入一行，不需要同时持有所有命令
 
         Returns:
             dict: 创建的记录信息
         """
-        options = options or {}
-        generate_screenshots = options.get('generate_screenshots', True)
+        # 命令已全部在内存中时，哈希和压缩在写事务之前完成
+        prepared = OutputStore.prepare(InspectionService._outputs(data)) if commands is None else None
+        with get_db_connection() as conn:
+            result = InspectionService._insert_inspection(conn.cursor(), data, metadata, options, commands, prepared)
+
+        # 事务提交后立即唤醒截图工作者
+        if result['screenshots_pending']:
+            notify_screenshot_tasks()
 
+        return result
+
+    @staticmethod
+    def create_inspections_bulk(items):
+        """
+        批量创建巡检记录（整批一个事务）
+
+        先在事务之外计算所有命令输出的哈希并压缩新输出，再获取写锁，所有记录在同一事务中写入，
+        避免大量主机同时上报时每台主机一个事务争抢 SQLite 写锁。每条记录使用一个保存点，
+        单条写入失败只回滚该条，不影响其他记录。
+
+        Args:
+            items: (data, metadata, options) 列表，已校验且 project_id 已解析
+
+        Returns:
+            list: 与 items 顺序一致，成功为 create_inspection 的返回值，失败为异常对象
+        """
+        results = []
+        prepared = OutputStore.prepare(output for data, _, _ in items for output in InspectionService._outputs(data))
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            for data, metadata, options in items:
+                cursor.execute('SAVEPOINT bulk_item')
+                try:
+                    results.append(InspectionService._insert_inspection(cursor, data, metadata, options,
+                                                                        prepared=prepared))
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO bulk_item')
+                    results.append(e)
+                cursor.execute('RELEASE bulk_item')
+
+        if any(isinstance(result, dict) and result['screenshots_pending'] for result in results):
+            notify_screenshot_tasks()
+        return results
 
-            # 插入主记录
-            cursor.execute('''
-                INSERT INTO inspection_records
-                (project_id, hostname, ip, os, kernel, arch, timestamp, env_data, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                metadata.get('project_id'),
-                metadata.get('hostname'),
-                metadata.get('ip'),
-                metadata.get('os'),
-                metadata.get('kernel'),
-                metadata.get('arch'),
-                metadata.get('timestamp'),
-                json.dumps(data.get('env', {}), ensure_ascii=False),
-                options.get('notes')
-            ))
-
-            record_id = cursor.lastrowid
-
-            # 插入命令执行记录
-            commands = data.get('commands', {})
-            screenshot_status = 'pending' if generate_screenshots else 'skipped'
-
-            for idx, (cmd_key, cmd_data) in enumerate(commands.items(), 1):
-                command = cmd_data.get('command', '')
-                name = cmd_data.get('name', cmd_key)  # 优先用 name，fallback 到 key
-                output = cmd_data.get('output', '')
-                return_code = cmd_data.get('return_code', 0)
-
-                cursor.execute('''
-                    INSERT INTO command_executions
-                    (record_id, command, name, output, return_code, screenshot_path, screenshot_status, execution_order)
-                    VALUES (?, ?, ?, ?, ?, NULL, ?, ?)
-                ''', (record_id, command, name, output, return_code, screenshot_status, idx))
+    @staticmethod
+    def _outputs(data):
+        """data.commands 中的所有命令输出"""
+        commands = data.get('commands') or {}
+        return (cmd.get('output', '') for cmd in commands.values() if isinstance(cmd, dict))
 
-            return {
-                'id': record_id,
-                'hostname': metadata.get('hostname'),
-                'timestamp': metadata.get('timestamp'),
-                'commands_count': len(commands),
-                'screenshots_pending': len(commands) if generate_screenshots else 0
-            }
+    @staticmethod
+    def _insert_inspection(cursor, data, metadata, options=None, commands=None, prepared=None):
+        """
+        在当前事务中插入一条巡检记录及其命令（命令用 executemany 逐条从迭代器读取并写入）
+
+        prepared 为 OutputStore.prepare 的结果，包含的输出不再在事务中计算哈希和压缩。
+        """
+        options = options or {}
+        generate_screenshots = options.get('generate_screenshots', True)
+
+        # 插入主记录
+        cursor.execute('''
+            INSERT INTO inspection_records
+            (project_id, hostname, ip, os, kernel, arch, timestamp, env_data, notes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            metadata.get('project_id'),
+            metadata.get('hostname'),
+            metadata.get('ip'),
+            metadata.get('os'),
+            metadata.get('kernel'),
+            metadata.get('arch'),
+            metadata.get('timestamp'),
+            json.dumps(data.get('env', {}), ensure_ascii=False),
+            options.get('notes')
+        ))
+
+        record_id = cursor.lastrowid
+
+        # 插入命令执行记录
+        if commands is None:
+            commands = (data.get('commands') or {}).items()
+        screenshot_status = 'pending' if generate_screenshots else 'skipped'
+        commands_count = 0
+        # 输出写入 output_blobs 使用单独的游标（executemany 正在迭代 rows）
+        blob_cursor = cursor.connection.cursor()
+
+        def rows():
+            nonlocal commands_count
+            for idx, (cmd_key, cmd_data) in enumerate(commands, 1):
+                if not isinstance(cmd_data, dict):
+                    raise ValueError(f'data.commands.{cmd_key} 必须是 JSON 对象')
+                commands_count = idx
+                yield (
+                    record_id,
+                    cmd_data.get('command', ''),
+                    cmd_data.get('name', cmd_key),  # 优先用 name，fallback 到 key
+                    OutputStore.put(blob_cursor, cmd_data.get('output', ''), prepared),
+                    cmd_data.get('return_code', 0),
+                    screenshot_status,
+                    idx
+                )
+
+        cursor.executemany('''
+            INSERT INTO command_executions
+            (record_id, command, name, output_hash, return_code, screenshot_path, screenshot_status, execution_order)
+            VALUES (?, ?, ?, ?, ?, NULL, ?, ?)
+        ''', rows())
+
+        return {
+            'id': record_id,
+            'hostname': metadata.get('hostname'),
+            'timestamp': metadata.get('timestamp'),
+            'commands_count': commands_count,
+            'screenshots_pending': commands_count if generate_screenshots else 0
+        }
 
     @staticmethod
     def get_inspections(filters=None, page=1, page_size=20, sort_by='timestamp', sort_order='desc'):
@@ -163,7 +236,11 @@ class InspectionService:
                 WHERE record_id = ?
                 ORDER BY execution_order
             ''', (record_id,))
-            commands = [dict(row) for row in cursor.fetchall()]
+            commands = OutputStore.resolve(cursor, [dict(row) for row in cursor.fetchall()])
+            for cmd in commands:
+                cmd['screenshot_parts'] = ScreenshotService.parse_screenshot_parts(
+                    cmd['screenshot_path'], cmd['screenshot_parts']
+                )
 
             result = dict(record)
             result['commands'] = commands
@@ -179,17 +256,20 @@ class InspectionService:
 
             # 获取截图路径
             cursor.execute('''
-                SELECT screenshot_path FROM command_executions
+                SELECT screenshot_path, screenshot_parts FROM command_executions
                 WHERE record_id = ? AND screenshot_path IS NOT NULL
             ''', (record_id,))
 
-            screenshot_paths = [row[0] for row in cursor.fetchall()]
+            screenshot_paths = [
+                path for row in cursor.fetchall()
+                for path in ScreenshotService.parse_screenshot_parts(row[0], row[1])
+            ]
+
+            # 释放截图引用（共享的缓存文件在无其他引用时才删除）
+            ScreenshotService.release_screenshots(screenshot_paths, conn)
 
-            # 删除截图文件
-            for path in screenshot_paths:
-                file_path = SCREENSHOTS_DIR / path
-                if file_path.exists():
-                    file_path.unlink()
+            # 释放命令输出引用
+            OutputStore.release_record(cursor, record_id)
 
             # 删除数据库记录（级联删除命令）
             cursor.execute('DELETE FROM inspection_records WHERE id = ?', (record_id,))
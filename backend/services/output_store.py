@@ -0,0 +1,280 @@
+"""
+命令输出存储
+命令输出按内容哈希去重并压缩保存在 output_blobs 表中，command_executions.output_hash 引用它，
+多次巡检和多台主机之间相同的输出只保存一份
+"""
+
+import hashlib
+import zlib
+from models.database import get_db_connection
+from utils.logger import get_logger
+from config import OUTPUT_BLOB_CODEC
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = get_logger('services.output_store')
+
+# 压缩级别
+_ZLIB_LEVEL = 6
+_ZSTD_LEVEL = 3
+
+# 单条 SQL 中 IN (...) 的最大参数个数
+_MAX_SQL_PARAMS = 500
+
+
+def _encode(output):
+    # surrogatepass：JSON 中可能出现未配对的代理字符
+    return output.encode('utf-8', 'surrogatepass')
+
+
+def _compress(raw):
+    """按配置的算法压缩（未安装 zstandard 时回退到 zlib），压缩后不更小时原样保存"""
+    if OUTPUT_BLOB_CODEC == 'zstd' and zstandard:
+        codec, data = 'zstd', zstandard.ZstdCompressor(level=_ZSTD_LEVEL).compress(raw)
+    else:
+        codec, data = 'zlib', zlib.compress(raw, _ZLIB_LEVEL)
+    if len(data) >= len(raw):
+        return 'raw', raw
+    return codec, data
+
+
+def _decompress(codec, data):
+    if codec == 'raw':
+        return bytes(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        if not zstandard:
+            raise RuntimeError("命令输出使用 zstd 压缩，需要安装 zstandard（pip install zstandard）")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"未知的命令输出压缩算法: {codec}")
+
+
+class OutputStore:
+    """命令输出存储（内容寻址，ref_count 为引用该输出的命令数）"""
+
+    @staticmethod
+    def prepare(outputs):
+        """
+        在写事务之外预先计算一批输出的哈希，并压缩数据库中尚不存在的输出
+
+        写事务中只剩 SQL 语句，持有 SQLite 写锁的时间不包含哈希和压缩。
+
+        Args:
+            outputs: 输出文本迭代器
+
+        Returns:
+            dict: 输出文本 -> (哈希, 原始字节数, 压缩结果)；压缩结果为 (算法, 数据)，
+                  查询时已存在的输出为 None（写入时只增加引用计数）
+        """
+        digests = {}
+        raws = {}
+        for output in outputs:
+            if isinstance(output, str) and output not in digests:
+                raw = _encode(output)
+                digest = hashlib.sha256(raw).hexdigest()
+                digests[output] = digest
+                raws[digest] = raw
+        if not digests:
+            return {}
+
+        existing = set()
+        hashes = sorted(raws)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(hashes), _MAX_SQL_PARAMS):
+                chunk = hashes[start:start + _MAX_SQL_PARAMS]
+                cursor.execute(f'''
+                    SELECT hash FROM output_blobs WHERE hash IN ({','.join('?' * len(chunk))})
+                ''', chunk)
+                existing.update(row[0] for row in cursor.fetchall())
+
+        compressed = {digest: _compress(raw) for digest, raw in raws.items() if digest not in existing}
+        return {
+            output: (digest, len(raws[digest]), compressed.get(digest))
+            for output, digest in digests.items()
+        }
+
+    @staticmethod
+    def put(cursor, output, prepared=None):
+        """
+        在当前事务中保存一条命令输出，已存在相同内容时只增加引用计数
+
+        Args:
+            cursor: 数据库游标
+            output: 输出文本，None 表示没有输出
+            prepared: 可选的 prepare 结果，包含该输出时不再重复计算哈希和压缩
+
+        Returns:
+            str | None: 内容哈希（写入 command_executions.output_hash）
+        """
+        return OutputStore._put(cursor, output, prepared)[0]
+
+    @staticmethod
+    def _put(cursor, output, prepared=None):
+        """保存输出，返回 (哈希, 原始字节数, 新建时的压缩后字节数，去重命中时为 None)"""
+        if output is None:
+            return None, 0, None
+        if not isinstance(output, str):
+            output = str(output)
+        if prepared and output in prepared:
+            digest, raw_size, compressed = prepared[output]
+        else:
+            raw = _encode(output)
+            digest, raw_size, compressed = hashlib.sha256(raw).hexdigest(), len(raw), None
+
+        cursor.execute('UPDATE output_blobs SET ref_count = ref_count + 1 WHERE hash = ?', (digest,))
+        if cursor.rowcount:
+            return digest, raw_size, None
+
+        # 先查后写在同一个写事务中，不会与其他连接同时插入同一哈希；
+        # 预先查询时已存在、之后又被删除的输出在这里压缩
+        codec, data = compressed or _compress(_encode(output))
+        cursor.execute('''
+            INSERT INTO output_blobs (hash, codec, raw_size, stored_size, ref_count, data)
+            VALUES (?, ?, ?, ?, 1, ?)
+        ''', (digest, codec, raw_size, len(data), data))
+        return digest, raw_size, len(data)
+
+    @staticmethod
+    def load(cursor, hashes):
+        """
+        批量读取命令输出
+
+        Args:
+            cursor: 数据库游标
+            hashes: 内容哈希（可包含 None 和重复值）
+
+        Returns:
+            dict: 哈希 -> 输出文本
+        """
+        hashes = sorted({digest for digest in hashes if digest})
+        outputs = {}
+        for start in range(0, len(hashes), _MAX_SQL_PARAMS):
+            chunk = hashes[start:start + _MAX_SQL_PARAMS]
+            cursor.execute(f'''
+                SELECT hash, codec, data FROM output_blobs WHERE hash IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for digest, codec, data in cursor.fetchall():
+                outputs[digest] = _decompress(codec, data).decode('utf-8', 'surrogatepass')
+        return outputs
+
+    @staticmethod
+    def resolve(cursor, rows):
+        """
+        把命令行中的 output_hash 替换为输出文本（未迁移的旧数据输出仍在 output 列中，保持不变）
+
+        Args:
+            cursor: 数据库游标
+            rows: 命令字典列表（包含 output 和 output_hash），原地修改
+
+        Returns:
+            list: rows
+        """
+        outputs = OutputStore.load(cursor, (row.get('output_hash') for row in rows))
+        for row in rows:
+            digest = row.pop('output_hash', None)
+            if digest:
+                if digest not in outputs:
+                    logger.error(f"命令输出不存在: {digest}")
+                row['output'] = outputs.get(digest)
+        return rows
+
+    @staticmethod
+    def release_record(cursor, record_id):
+        """删除巡检记录前释放其命令输出的引用，无引用的输出随即删除"""
+        cursor.execute('''
+            UPDATE output_blobs SET ref_count = ref_count - (
+                SELECT COUNT(*) FROM command_executions
+                WHERE record_id = ? AND output_hash = output_blobs.hash
+            )
+            WHERE hash IN (SELECT output_hash FROM command_executions WHERE record_id = ?)
+        ''', (record_id, record_id))
+        cursor.execute('''
+            DELETE FROM output_blobs
+            WHERE ref_count <= 0
+              AND hash IN (SELECT output_hash FROM command_executions WHERE record_id = ?)
+        ''', (record_id,))
+
+    @staticmethod
+    def migrate_inline_outputs(batch_size=500, on_batch=None):
+        """
+        把旧数据中直接保存在 command_executions.output 的输出迁移到 output_blobs
+
+        可重复执行，只处理尚未迁移的行。每批一个事务，迁移期间 API 和截图工作者可以继续读写。
+
+        Args:
+            batch_size: 每个事务迁移的行数
+            on_batch: 每批提交后调用，参数为截至目前的统计
+
+        Returns:
+            dict: 本次迁移的行数（rows）、输出原始字节数（raw_bytes）、
+                  新建的输出数（new_blobs）及其原始和压缩后字节数（unique_bytes、stored_bytes）
+        """
+        stats = {'rows': 0, 'raw_bytes': 0, 'new_blobs': 0, 'unique_bytes': 0, 'stored_bytes': 0}
+        last_id = 0
+        while True:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    SELECT id, output FROM command_executions
+                    WHERE id > ? AND output_hash IS NULL AND output IS NOT NULL
+                    ORDER BY id LIMIT ?
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+                for command_id, output in rows:
+                    digest, raw_size, stored_size = OutputStore._put(cursor, output)
+                    cursor.execute('''
+                        UPDATE command_executions SET output_hash = ?, output = NULL WHERE id = ?
+                    ''', (digest, command_id))
+                    stats['rows'] += 1
+                    stats['raw_bytes'] += raw_size
+                    if stored_size is not None:
+                        stats['new_blobs'] += 1
+                        stats['unique_bytes'] += raw_size
+                        stats['stored_bytes'] += stored_size
+            if not rows:
+                return stats
+            last_id = rows[-1][0]
+            if on_batch:
+                on_batch(dict(stats))
+
+    @staticmethod
+    def get_stats():
+        """
+        获取命令输出存储统计
+
+        Returns:
+            dict: 输出数（blobs）、引用数（refs）、去重前/去重后/压缩后的字节数
+                  （logical_bytes、unique_bytes、stored_bytes）、压缩比、去重比、总节省比例，
+                  以及尚未迁移的旧数据行数（inline_rows）
+        """
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) AS blobs,
+                       COALESCE(SUM(ref_count), 0) AS refs,
+                       COALESCE(SUM(raw_size * ref_count), 0) AS logical_bytes,
+                       COALESCE(SUM(raw_size), 0) AS unique_bytes,
+                       COALESCE(SUM(stored_size), 0) AS stored_bytes
+                FROM output_blobs
+            ''')
+            stats = dict(cursor.fetchone())
+            cursor.execute('''
+                SELECT COUNT(*) FROM command_executions WHERE output_hash IS NULL AND output IS NOT NULL
+            ''')
+            stats['inline_rows'] = cursor.fetchone()[0]
+
+        stats['compression_ratio'] = OutputStore.ratio(stats['unique_bytes'], stats['stored_bytes'])
+        stats['dedup_ratio'] = OutputStore.ratio(stats['logical_bytes'], stats['unique_bytes'])
+        stats['total_ratio'] = OutputStore.ratio(stats['logical_bytes'], stats['stored_bytes'])
+        return stats
+
+    @staticmethod
+    def ratio(before, after):
+        """前后字节数之比（保留两位小数），after 为 0 时返回 0"""
+        return round(before / after, 2) if after else 0
@@ -213,6 +213,22 @@ class ProjectService:
         
         return None, None
 
+    @staticmethod
+    def resolve_project_ids(project_identifiers):
+        """
+        批量解析项目标识符，每个不同的标识符只查询一次
+
+        Args:
+            project_identifiers: 项目标识符（ID/代码/名称，整数或字符串）的可迭代对象
+
+        Returns:
+            dict: 标识符 -> (project_id, project_code)，不存在的项目为 (None, None)
+        """
+        return {
+            identifier: ProjectService.resolve_project_id(identifier)
+            for identifier in set(project_identifiers)
+        }
+
     @staticmethod
     def update_project(project_id, project_name=None, description=None, status=None):
         """
@@ -13,6 +13,7 @@ from config import REPORTS_DIR, SCREENSHOTS_DIR, REPORT_TITLE_DEFAULT, REPORT_SC
 from models.database import get_db_connection
 from services.inspection_service import InspectionService
 from services.template_service import TemplateService
+from utils.image_optimizer import convert_for_docx
 import json
 
 
@@ -120,6 +121,8 @@ class ReportService:
         include_return_code = template_config.get('include_return_code', True)
         include_output = template_config.get('include_output', True)
         show_command_title = template_config.get('show_command_title', True)
+        # 报告中截图的格式（png 或 jpeg），默认沿用存储格式；python-docx 不支持 WebP，WebP 截图会转为 PNG
+        screenshot_format = template_config.get('screenshot_format')
 
         for host_idx, record in enumerate(host_records, 1):
             # 获取主机详细信息（包含命令）
@@ -197,14 +200,21 @@ class ReportService:
                         run._element.rPr.rFonts.set(qn('w:ascii'), 'Consolas')
                         run.font.size = Pt(9)
 
-                # 插入截图
-                if include_screenshots and cmd.get('screenshot_path'):
-                    screenshot_file = SCREENSHOTS_DIR / cmd['screenshot_path']
-                    if screenshot_file.exists():
+                # 插入截图（超长输出有多张分片，按顺序插入）
+                if include_screenshots:
+                    screenshot_files = [
+                        SCREENSHOTS_DIR / path for path in cmd.get('screenshot_parts') or []
+                        if (SCREENSHOTS_DIR / path).exists()
+                    ]
+                    if screenshot_files:
                         screenshot_label = doc.add_paragraph('终端截图:')
                         ReportService._set_chinese_font(screenshot_label.runs[0])
+                    for screenshot_file in screenshot_files:
                         try:
-                            doc.add_picture(str(screenshot_file), width=Inches(REPORT_SCREENSHOT_WIDTH))
+                            doc.add_picture(
+                                convert_for_docx(screenshot_file, screenshot_format),
+                                width=Inches(REPORT_SCREENSHOT_WIDTH)
+                            )
                         except Exception as e:
                             error_para = doc.add_paragraph(f'[截图加载失败: {e}]')
                             ReportService._set_chinese_font(error_para.runs[0])
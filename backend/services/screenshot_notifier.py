@@ -0,0 +1,122 @@
+"""
+截图任务通知
+新任务入队时立即唤醒截图工作者，轮询仅作为兜底
+
+同一进程（及其 fork 的工作进程）内通过事件唤醒；独立运行的截图工作者（worker.py）
+在 SCREENSHOT_NOTIFY_DIR 下监听各自的 Unix 数据报套接字，API 进程入队时向所有套接字发送通知。
+"""
+
+import os
+import socket
+import threading
+from utils.logger import get_logger
+from config import SCREENSHOT_NOTIFY_DIR
+
+logger = get_logger('services.screenshot_notifier')
+
+# 已注册的唤醒事件（threading.Event 或工作进程池的跨进程唤醒信号）
+_events = []
+_lock = threading.Lock()
+
+# 本进程监听的套接字路径（通知其他进程时跳过自己）
+_listen_path = None
+
+
+def subscribe(event=None):
+    """
+    注册一个唤醒事件
+
+    Args:
+        event: 可选的事件对象，默认新建 threading.Event；
+               工作进程池传入跨进程的唤醒信号（只需提供 set 方法）
+
+    Returns:
+        注册的事件对象
+    """
+    event = event or threading.Event()
+    with _lock:
+        _events.append(event)
+    return event
+
+
+def notify_screenshot_tasks():
+    """通知所有截图工作者有新的待处理任务（本进程的事件和独立工作者进程）"""
+    _notify_local()
+    _notify_remote()
+
+
+def _notify_local():
+    with _lock:
+        events = list(_events)
+    for event in events:
+        event.set()
+
+
+def _notify_remote():
+    """向每个独立工作者的套接字发送一个数据报，已退出的工作者遗留的套接字文件被删除"""
+    try:
+        paths = [entry.path for entry in os.scandir(SCREENSHOT_NOTIFY_DIR) if entry.name.endswith('.sock')]
+    except OSError:
+        return
+    if not paths:
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for path in paths:
+            if path == _listen_path:
+                continue
+            try:
+                sock.sendto(b'1', path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                # 接收缓冲区已满：对方已有未处理的通知，无需重复发送
+                pass
+
+
+def start_listener():
+    """
+    监听其他进程的通知（独立工作者调用），收到后唤醒本进程注册的所有事件
+
+    Returns:
+        socket.socket: 监听套接字，进程退出前调用 stop_listener 关闭
+    """
+    global _listen_path
+    SCREENSHOT_NOTIFY_DIR.mkdir(exist_ok=True, parents=True)
+    path = str(SCREENSHOT_NOTIFY_DIR / f"worker-{os.getpid()}.sock")
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    _listen_path = path
+
+    def receive():
+        while True:
+            try:
+                sock.recv(64)
+            except OSError:
+                break
+            _notify_local()
+
+    threading.Thread(target=receive, daemon=True, name="ScreenshotNotifyListener").start()
+    logger.info(f"截图任务通知监听: {path}")
+    return sock
+
+
+def stop_listener(sock):
+    """关闭监听套接字并删除套接字文件"""
+    global _listen_path
+    path, _listen_path = _listen_path, None
+    sock.close()
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -3,14 +3,25 @@
 封装现有截图生成功能，保存到文件系统
 """
 
+import json
+import threading
 from pathlib import Path
 from datetime import datetime
-from utils.screenshot_generator import generate_screenshot_bytes, sanitize_filename
+from models.database import get_db_connection
+from utils.screenshot_generator import (
+    build_terminal_lines, split_terminal_tiles, choose_scale_factor, iter_tile_bytes,
+    sanitize_filename, screenshot_cache_key
+)
+from utils.image_optimizer import optimize_screenshot, encoding_signature, format_from_path, IMAGE_FORMATS
 from utils.logger import get_logger
-from config import SCREENSHOTS_DIR, DEFAULT_FONT_FILE, DEFAULT_SCALE_FACTOR
+from config import SCREENSHOTS_DIR, DEFAULT_FONT_FILE, DEFAULT_SCALE_FACTOR, SCREENSHOT_SCALE_MODE
 
 logger = get_logger('services.screenshot')
 
+# 本进程的截图编码统计（优化前后的字节数）
+_encoding_stats = {'screenshots': 0, 'raw_bytes': 0, 'encoded_bytes': 0}
+_encoding_stats_lock = threading.Lock()
+
 
 class ScreenshotService:
     """截图生成服务（封装现有功能）"""
@@ -20,6 +31,10 @@ class ScreenshotService:
         """
         生成截图并保存到文件系统
 
+        超长输出按行数和像素预算切分为多张截图（分片）。每个分片按内容寻址：
+        渲染输入完全相同的分片只生成一次，命中缓存时直接引用已有文件，
+        并增加其引用计数。
+
         Args:
             record_id: 巡检记录ID
             env: 环境变量字典
@@ -29,35 +44,269 @@ class ScreenshotService:
             order: 执行顺序
 
         Returns:
-            str: 相对路径（用于存储到数据库）
-        """
-        # 生成截图字节流
-        screenshot_bytes = generate_screenshot_bytes(
-            env=env,
-            command=command,
-            output=output,
-            return_code=return_code,
+            tuple: (按顺序排列的分片相对路径列表, 设备像素比)，用于存储到数据库
+        """
+        return ScreenshotService.generate_and_save_batch(record_id, env, [{
+            'command': command,
+            'output': output,
+            'return_code': return_code,
+            'execution_order': order
+        }])[0]
+
+    @staticmethod
+    def generate_and_save_batch(record_id, env, commands):
+        """
+        批量生成一条巡检记录的多个截图并保存（只渲染未命中缓存的分片）
+
+        Args:
+            record_id: 巡检记录ID
+            env: 环境变量字典
+            commands: 命令列表，每项包含 command、output、return_code、execution_order
+
+        Returns:
+            list: 与 commands 顺序一致，每项是 (该命令的分片相对路径列表, 设备像素比)
+        """
+        parts = []
+        scale_factors = []
+        misses = {}  # 设备像素比 -> 未命中缓存的分片
+        for cmd_index, cmd in enumerate(commands):
+            lines = build_terminal_lines(env, cmd['command'], cmd['output'], cmd['return_code'])
+            scale_factor = ScreenshotService.scale_factor_for(lines)
+            tiles = split_terminal_tiles(lines, scale_factor)
+            paths = []
+            for part_index, tile in enumerate(tiles):
+                cache_key = screenshot_cache_key(
+                    tile, DEFAULT_FONT_FILE, scale_factor, encoding=encoding_signature()
+                )
+                cached_path = ScreenshotService._acquire_cached(cache_key)
+                paths.append(cached_path)
+                if not cached_path:
+                    misses.setdefault(scale_factor, []).append((cmd_index, part_index, len(tiles), tile, cache_key))
+            parts.append(paths)
+            scale_factors.append(scale_factor)
+
+        try:
+            for scale_factor, scale_misses in misses.items():
+                ScreenshotService._render_misses(record_id, commands, parts, scale_misses, scale_factor)
+        except Exception:
+            # 已获取或已保存的引用不会写入数据库，需要释放
+            ScreenshotService.release_screenshots([path for paths in parts for path in paths if path])
+            raise
+
+        return list(zip(parts, scale_factors))
+
+    @staticmethod
+    def scale_factor_for(lines):
+        """
+        命令截图的设备像素比
+
+        Args:
+            lines: build_terminal_lines 返回的行列表（整个命令）
+
+        Returns:
+            int | float: adaptive 模式下按像素预算和打印 DPI 选择，否则为 DEFAULT_SCALE_FACTOR
+        """
+        if SCREENSHOT_SCALE_MODE == 'adaptive':
+            return choose_scale_factor(lines)
+        return DEFAULT_SCALE_FACTOR
+
+    @staticmethod
+    def _render_misses(record_id, commands, parts, misses, scale_factor):
+        """渲染同一设备像素比下未命中缓存的分片，保存后写入 parts 中对应的位置"""
+        saved = 0
+        # 逐组渲染并立即保存，不在内存中保留整条记录的截图
+        screenshots = iter_tile_bytes(
+            [tile for _, _, _, tile, _ in misses],
             font_file=DEFAULT_FONT_FILE,
-            scale_factor=DEFAULT_SCALE_FACTOR
+            scale_factor=scale_factor
         )
+        for (cmd_index, part_index, part_count, _, cache_key), screenshot_bytes in zip(misses, screenshots):
+            cmd = commands[cmd_index]
+            parts[cmd_index][part_index] = ScreenshotService._save(
+                record_id, cmd['command'], cmd['execution_order'], part_index, part_count,
+                screenshot_bytes, cache_key
+            )
+            saved += 1
+        if saved != len(misses):
+            raise RuntimeError(f"截图分片数量不匹配: 期望 {len(misses)}，实际 {saved}")
+
+    @staticmethod
+    def _acquire_cached(cache_key):
+        """命中缓存时增加引用计数并返回已有文件路径，未命中返回 None"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE screenshot_cache
+                SET ref_count = ref_count + 1, hit_count = hit_count + 1, last_used_at = CURRENT_TIMESTAMP
+                WHERE cache_key = ?
+            ''', (cache_key,))
+            if cursor.rowcount == 0:
+                return None
+
+            cursor.execute('SELECT screenshot_path FROM screenshot_cache WHERE cache_key = ?', (cache_key,))
+            screenshot_path = cursor.fetchone()['screenshot_path']
+
+            # 文件已被外部删除：丢弃缓存条目，重新渲染
+            if not (SCREENSHOTS_DIR / screenshot_path).exists():
+                cursor.execute('DELETE FROM screenshot_cache WHERE cache_key = ?', (cache_key,))
+                return None
+
+        logger.debug(f"截图缓存命中: {screenshot_path}")
+        return screenshot_path
+
+    @staticmethod
+    def _save(record_id, command, order, part_index, part_count, screenshot_bytes, cache_key):
+        """优化编码后保存截图分片文件并登记到缓存（引用计数为 1），返回相对路径"""
+        raw_size = len(screenshot_bytes)
+        screenshot_bytes, image_format = optimize_screenshot(screenshot_bytes)
+        with _encoding_stats_lock:
+            _encoding_stats['screenshots'] += 1
+            _encoding_stats['raw_bytes'] += raw_size
+            _encoding_stats['encoded_bytes'] += len(screenshot_bytes)
 
         # 构建文件路径（按月份组织）
         month_dir = datetime.now().strftime('%Y-%m')
         save_dir = SCREENSHOTS_DIR / month_dir
         save_dir.mkdir(exist_ok=True, parents=True)
 
-        # 文件名：记录ID_顺序_命令名.png
+        # 文件名：记录ID_顺序_命令名[_p分片序号]_缓存键前缀.扩展名（缓存键保证不同内容不会覆盖同名文件）
         safe_command = sanitize_filename(command)
         if not safe_command:
             safe_command = f"command_{order}"
+        part_suffix = f"_p{part_index + 1}" if part_count > 1 else ''
 
-        filename = f"{record_id}_{order:02d}_{safe_command}.png"
+        extension = IMAGE_FORMATS[image_format][0]
+        filename = f"{record_id}_{order:02d}_{safe_command}{part_suffix}_{cache_key[:8]}.{extension}"
         file_path = save_dir / filename
+        relative_path = f"{month_dir}/{filename}"
 
         # 保存文件
         with open(file_path, 'wb') as f:
             f.write(screenshot_bytes)
         logger.debug(f"截图已保存: {file_path}")
 
-        # 返回相对路径
-        return f"{month_dir}/{filename}"
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR IGNORE INTO screenshot_cache (cache_key, screenshot_path, ref_count, file_size, raw_size)
+                VALUES (?, ?, 1, ?, ?)
+            ''', (cache_key, relative_path, len(screenshot_bytes), raw_size))
+            if cursor.rowcount == 1:
+                return relative_path
+
+        # 其他进程同时渲染了相同内容：引用先登记的文件，删除本次生成的文件
+        existing_path = ScreenshotService._acquire_cached(cache_key)
+        if existing_path and existing_path != relative_path:
+            file_path.unlink(missing_ok=True)
+            return existing_path
+        return relative_path
+
+    @staticmethod
+    def parse_screenshot_parts(screenshot_path, screenshot_parts):
+        """
+        解析命令的截图分片列表
+
+        Args:
+            screenshot_path: command_executions.screenshot_path（第一张分片）
+            screenshot_parts: command_executions.screenshot_parts（JSON 数组，旧数据为空）
+
+        Returns:
+            list: 按顺序排列的分片相对路径
+        """
+        if screenshot_parts:
+            return json.loads(screenshot_parts)
+        return [screenshot_path] if screenshot_path else []
+
+    @staticmethod
+    def describe_screenshots(paths):
+        """
+        获取截图分片的编码格式和总字节数
+
+        Args:
+            paths: 分片相对路径列表
+
+        Returns:
+            tuple: (格式, 总字节数)；分片格式不一致时格式为 'mixed'，无分片时为 (None, 0)
+        """
+        formats = {format_from_path(path) for path in paths}
+        size = sum(
+            (SCREENSHOTS_DIR / path).stat().st_size for path in paths
+            if (SCREENSHOTS_DIR / path).exists()
+        )
+        if not formats:
+            return None, 0
+        return (formats.pop() if len(formats) == 1 else 'mixed'), size
+
+    @staticmethod
+    def get_encoding_stats():
+        """
+        获取本进程的截图编码统计
+
+        Returns:
+            dict: 编码的截图数、优化前后的字节数和节省的字节数
+        """
+        with _encoding_stats_lock:
+            stats = dict(_encoding_stats)
+        stats['saved_bytes'] = stats['raw_bytes'] - stats['encoded_bytes']
+        return stats
+
+    @staticmethod
+    def release_screenshots(paths, conn=None):
+        """
+        释放截图引用：引用计数减一，无引用时删除缓存条目和文件
+
+        不在缓存中的旧截图视为只有一个引用，直接删除文件。
+
+        Args:
+            paths: 截图相对路径列表
+            conn: 可选的数据库连接，传入时在调用方事务中执行
+        """
+        if conn is None:
+            with get_db_connection() as own_conn:
+                return ScreenshotService.release_screenshots(paths, own_conn)
+
+        cursor = conn.cursor()
+        for path in paths:
+            cursor.execute('''
+                UPDATE screenshot_cache SET ref_count = ref_count - 1
+                WHERE screenshot_path = ?
+            ''', (path,))
+            cursor.execute('''
+                SELECT COUNT(*) FROM screenshot_cache
+                WHERE screenshot_path = ? AND ref_count > 0
+            ''', (path,))
+            if cursor.fetchone()[0] > 0:
+                continue
+
+            cursor.execute('DELETE FROM screenshot_cache WHERE screenshot_path = ?', (path,))
+            # 在持有写锁时删除文件，避免与并发写入的同名文件冲突
+            file_path = SCREENSHOTS_DIR / path
+            if file_path.exists():
+                file_path.unlink()
+
+    @staticmethod
+    def get_cache_stats():
+        """
+        获取截图缓存统计
+
+        Returns:
+            dict: 缓存条目数、引用数、命中次数、命中率、缓存节省的文件字节数（saved_bytes）
+                  和编码优化节省的字节数（encoding_saved_bytes）
+        """
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) AS entries,
+                       COALESCE(SUM(ref_count), 0) AS total_refs,
+                       COALESCE(SUM(hit_count), 0) AS hits,
+                       COALESCE(SUM(file_size), 0) AS stored_bytes,
+                       COALESCE(SUM(file_size * MAX(ref_count - 1, 0)), 0) AS saved_bytes,
+                       COALESCE(SUM(raw_size - file_size), 0) AS encoding_saved_bytes
+                FROM screenshot_cache
+            ''')
+            stats = dict(cursor.fetchone())
+
+        # 每个缓存条目对应一次未命中（实际渲染）
+        lookups = stats['hits'] + stats['entries']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0
+        return stats
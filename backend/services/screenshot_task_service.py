@@ -4,47 +4,196 @@
 """
 
 import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
 from models.database import get_db_connection
+from services.output_store import OutputStore
 from services.screenshot_service import ScreenshotService
 from utils.logger import get_logger
+from config import (
+    SCREENSHOT_TASK_LEASE_SECONDS, SCREENSHOT_TASK_MAX_ATTEMPTS, SCREENSHOT_BATCH_RENDER,
+    SCREENSHOT_LAZY_RENDER, SCREENSHOT_LAZY_RENDER_THREADS, SCREENSHOT_LAZY_WAIT_SECONDS
+)
 
 logger = get_logger('services.screenshot_task')
 
+# SQLite 3.35+ 支持 UPDATE ... RETURNING，可在单条语句内完成领取
+_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# 待领取任务的选择条件
+_PENDING_SELECT = '''
+    SELECT id FROM command_executions
+    WHERE screenshot_status = 'pending'
+    ORDER BY id
+    LIMIT ?
+'''
+
+# 按记录领取：只选择最早的待处理记录下的任务
+_PENDING_RECORD_SELECT = '''
+    SELECT id FROM command_executions
+    WHERE screenshot_status = 'pending'
+      AND record_id = (
+          SELECT record_id FROM command_executions
+          WHERE screenshot_status = 'pending'
+          ORDER BY id
+          LIMIT 1
+      )
+    ORDER BY id
+    LIMIT ?
+'''
+
+# 按命令ID领取单个任务（按需渲染）
+_PENDING_ID_SELECT = '''
+    SELECT id FROM command_executions
+    WHERE id = ? AND screenshot_status = 'pending'
+'''
+
+# 等待其他工作者完成任务时的轮询间隔（秒）
+_LAZY_POLL_INTERVAL = 0.2
+
+# 本进程正在按需渲染的任务：command_id -> Future，同一任务的并发请求共用一次渲染
+_inflight = {}
+_inflight_lock = threading.Lock()
+_lazy_executor = None
+
 
 class ScreenshotTaskService:
     """截图任务处理服务"""
 
     @staticmethod
-    def get_pending_tasks(limit=10):
-        """获取待处理的截图任务"""
+    def default_worker_id():
+        """当前进程的工作者标识（主机名:PID）"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def claim_tasks(worker_id, limit=10, lease_seconds=SCREENSHOT_TASK_LEASE_SECONDS, by_record=False):
+        """
+        原子领取待处理的截图任务
+
+        将最多 limit 个 pending 任务标记为 processing，写入领取者和租约到期时间，
+        并增加尝试次数。多个进程/节点同时领取时每个任务只会被领取一次。
+
+        Args:
+            worker_id: 领取者标识
+            limit: 最大任务数
+            lease_seconds: 租约时长（秒），超时未完成的任务会被 reap_expired_leases 回收
+            by_record: 为 True 时只领取同一条巡检记录下的任务，便于批量渲染
+
+        Returns:
+            list: 已领取的任务
+        """
+        select_sql = _PENDING_RECORD_SELECT if by_record else _PENDING_SELECT
+        return ScreenshotTaskService._claim(worker_id, select_sql, limit, lease_seconds)
+
+    @staticmethod
+    def claim_task(command_id, worker_id, lease_seconds=SCREENSHOT_TASK_LEASE_SECONDS):
+        """
+        原子领取指定的待处理任务（按需渲染时跳过队列顺序）
+
+        Returns:
+            dict | None: 已领取的任务；任务不是 pending 状态（已被领取或已完成）时返回 None
+        """
+        tasks = ScreenshotTaskService._claim(worker_id, _PENDING_ID_SELECT, command_id, lease_seconds)
+        return tasks[0] if tasks else None
+
+    @staticmethod
+    def _claim(worker_id, select_sql, param, lease_seconds):
+        """将 select_sql（一个参数 param）选出的 pending 任务标记为 processing 并返回"""
+        lease_modifier = f'+{int(lease_seconds)} seconds'
+
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT ce.id, ce.record_id, ce.command, ce.output, ce.return_code,
-                       ce.execution_order, ir.env_data
-                FROM command_executions ce
-                JOIN inspection_records ir ON ce.record_id = ir.id
-                WHERE ce.screenshot_status = 'pending'
-                ORDER BY ce.created_at
-                LIMIT ?
-            ''', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
-
-    @staticmethod
-    def process_task(task):
-        """处理单个截图任务"""
-        command_id = task['id']
-
-        # 标记为处理中
+
+            if _SUPPORTS_RETURNING:
+                cursor.execute(f'''
+                    UPDATE command_executions
+                    SET screenshot_status = 'processing',
+                        claimed_by = ?,
+                        lease_expires_at = datetime('now', ?),
+                        attempts = attempts + 1
+                    WHERE id IN ({select_sql})
+                    RETURNING id, record_id, command, output, output_hash, return_code, execution_order, attempts
+                ''', (worker_id, lease_modifier, param))
+                tasks = [dict(row) for row in cursor.fetchall()]
+            else:
+                # 旧版 SQLite：先获取写锁再查询和更新
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(select_sql, (param,))
+                ids = [row['id'] for row in cursor.fetchall()]
+                if not ids:
+                    return []
+                placeholders = ','.join('?' * len(ids))
+                cursor.execute(f'''
+                    UPDATE command_executions
+                    SET screenshot_status = 'processing',
+                        claimed_by = ?,
+                        lease_expires_at = datetime('now', ?),
+                        attempts = attempts + 1
+                    WHERE id IN ({placeholders})
+                ''', [worker_id, lease_modifier] + ids)
+                cursor.execute(f'''
+                    SELECT id, record_id, command, output, output_hash, return_code, execution_order, attempts
+                    FROM command_executions
+                    WHERE id IN ({placeholders})
+                ''', ids)
+                tasks = [dict(row) for row in cursor.fetchall()]
+
+            if not tasks:
+                return []
+
+            # 读取命令输出
+            OutputStore.resolve(cursor, tasks)
+
+            # 补充每条巡检记录的环境变量
+            record_ids = sorted({task['record_id'] for task in tasks})
+            placeholders = ','.join('?' * len(record_ids))
+            cursor.execute(f'''
+                SELECT id, env_data FROM inspection_records WHERE id IN ({placeholders})
+            ''', record_ids)
+            env_map = {row['id']: row['env_data'] for row in cursor.fetchall()}
+
+        for task in tasks:
+            task['env_data'] = env_map.get(task['record_id'])
+        tasks.sort(key=lambda task: task['id'])
+        return tasks
+
+    @staticmethod
+    def reap_expired_leases(max_attempts=SCREENSHOT_TASK_MAX_ATTEMPTS):
+        """
+        回收租约已过期的任务（进程崩溃或重启后遗留的 processing 任务）
+
+        尝试次数未达上限的重新放回队列，达到上限的标记为 dead（死信）。
+
+        Returns:
+            int: 回收的任务数
+        """
         with get_db_connection() as conn:
-            conn.execute(
-                "UPDATE command_executions SET screenshot_status = 'processing' WHERE id = ?",
-                (command_id,)
-            )
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE command_executions
+                SET screenshot_status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,
+                    last_error = COALESCE(last_error, '租约过期'),
+                    claimed_by = NULL,
+                    lease_expires_at = NULL
+                WHERE screenshot_status = 'processing'
+                  AND (lease_expires_at IS NULL OR lease_expires_at < datetime('now'))
+            ''', (max_attempts,))
+            reaped = cursor.rowcount
 
+        if reaped:
+            logger.warning(f"回收了 {reaped} 个租约过期的截图任务")
+        return reaped
+
+    @staticmethod
+    def process_task(task, worker_id, max_attempts=SCREENSHOT_TASK_MAX_ATTEMPTS):
+        """处理单个已领取的截图任务，返回是否成功"""
         try:
             env = json.loads(task['env_data']) if task['env_data'] else {}
-            screenshot_path = ScreenshotService.generate_and_save(
+            screenshot_parts, scale_factor = ScreenshotService.generate_and_save(
                 record_id=task['record_id'],
                 env=env,
                 command=task['command'],
@@ -52,34 +201,258 @@ class ScreenshotTaskService:
                 return_code=task['return_code'],
                 order=task['execution_order']
             )
+        except Exception as e:
+            ScreenshotTaskService._fail_task(task, e, worker_id, max_attempts)
+            return False
 
-            # 更新为完成
-            with get_db_connection() as conn:
-                conn.execute('''
-                    UPDATE command_executions
-                    SET screenshot_path = ?, screenshot_status = 'completed'
-                    WHERE id = ?
-                ''', (screenshot_path, command_id))
+        return ScreenshotTaskService._complete_task(task, screenshot_parts, scale_factor, worker_id)
+
+    @staticmethod
+    def process_record_tasks(tasks, worker_id, on_processed=None):
+        """
+        批量处理同一巡检记录下的已领取任务（单页面渲染）
 
+        批量渲染失败时逐个回退到 process_task，避免一条异常命令拖累整条记录。
+
+        Returns:
+            int: 成功数量
+        """
+        env_data = tasks[0]['env_data']
+        try:
+            env = json.loads(env_data) if env_data else {}
+            results = ScreenshotService.generate_and_save_batch(
+                record_id=tasks[0]['record_id'],
+                env=env,
+                commands=tasks
+            )
         except Exception as e:
-            logger.error(f"截图生成失败 [command_id={command_id}]: {e}")
-            with get_db_connection() as conn:
-                conn.execute(
-                    "UPDATE command_executions SET screenshot_status = 'failed' WHERE id = ?",
-                    (command_id,)
-                )
+            logger.warning(f"批量截图失败，逐个重试 [record_id={tasks[0]['record_id']}]: {e}")
+            succeeded = 0
+            for task in tasks:
+                success = ScreenshotTaskService.process_task(task, worker_id)
+                succeeded += success
+                if on_processed:
+                    on_processed(task, success)
+            return succeeded
+
+        succeeded = 0
+        for task, (parts, scale_factor) in zip(tasks, results):
+            success = ScreenshotTaskService._complete_task(task, parts, scale_factor, worker_id)
+            succeeded += success
+            if on_processed:
+                on_processed(task, success)
+        return succeeded
+
+    @staticmethod
+    def _complete_task(task, screenshot_parts, scale_factor, worker_id):
+        """
+        标记任务完成（仅当租约仍属于自己时），返回是否写入
+
+        screenshot_path 保存第一张分片（兼容只显示单张截图的调用方），
+        screenshot_parts 保存全部分片，screenshot_format/screenshot_size 保存编码格式和总字节数，
+        screenshot_scale 保存渲染使用的设备像素比。
+        """
+        image_format, size = ScreenshotService.describe_screenshots(screenshot_parts)
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                UPDATE command_executions
+                SET screenshot_path = ?, screenshot_parts = ?, screenshot_format = ?, screenshot_size = ?,
+                    screenshot_scale = ?, screenshot_status = 'completed',
+                    claimed_by = NULL, lease_expires_at = NULL, last_error = NULL
+                WHERE id = ? AND claimed_by = ?
+            ''', (screenshot_parts[0], json.dumps(screenshot_parts), image_format, size, scale_factor,
+                  task['id'], worker_id))
+            if cursor.rowcount == 0:
+                logger.warning(f"截图任务租约已失效，结果未写入 [command_id={task['id']}]")
+                ScreenshotService.release_screenshots(screenshot_parts, conn)
+                return False
+        return True
+
+    @staticmethod
+    def _fail_task(task, error, worker_id, max_attempts=SCREENSHOT_TASK_MAX_ATTEMPTS):
+        """记录失败：未达到重试上限的放回队列，否则进入死信状态"""
+        logger.error(f"截图生成失败 [command_id={task['id']}, attempt={task['attempts']}]: {error}")
+        status = 'dead' if task['attempts'] >= max_attempts else 'pending'
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE command_executions
+                SET screenshot_status = ?, last_error = ?,
+                    claimed_by = NULL, lease_expires_at = NULL
+                WHERE id = ? AND claimed_by = ?
+            ''', (status, str(error)[:1000], task['id'], worker_id))
+
+    @staticmethod
+    def process_all_pending(batch_size=5, worker_id=None, should_stop=None, on_processed=None,
+                            batch_render=SCREENSHOT_BATCH_RENDER):
+        """
+        处理所有待处理任务，返回处理数量
+
+        Args:
+            batch_size: 每次领取的任务数
+            worker_id: 领取者标识，默认为 主机名:PID
+            should_stop: 可选回调，返回 True 时在当前任务完成后停止
+            on_processed: 可选回调 on_processed(task, success)，每个任务完成后调用
+            batch_render: 为 True 时按巡检记录领取任务并在单个页面中批量渲染
+
+        结束时输出本轮新生成截图的编码优化节省的字节数。
+        """
+        worker_id = worker_id or ScreenshotTaskService.default_worker_id()
+        ScreenshotTaskService.reap_expired_leases()
+
+        encoding_before = ScreenshotService.get_encoding_stats()
+        try:
+            return ScreenshotTaskService._process_pending(
+                batch_size, worker_id, should_stop, on_processed, batch_render
+            )
+        finally:
+            ScreenshotTaskService._log_encoding_savings(encoding_before)
+
+    @staticmethod
+    def _log_encoding_savings(before):
+        """输出本轮新生成截图的编码优化节省的字节数"""
+        after = ScreenshotService.get_encoding_stats()
+        count = after['screenshots'] - before['screenshots']
+        if not count:
+            return
+        raw_bytes = after['raw_bytes'] - before['raw_bytes']
+        saved_bytes = after['saved_bytes'] - before['saved_bytes']
+        ratio = saved_bytes / raw_bytes if raw_bytes else 0
+        logger.info(f"本轮编码 {count} 张截图，节省 {saved_bytes} 字节（{ratio:.1%}）")
 
     @staticmethod
-    def process_all_pending():
-        """处理所有待处理任务，返回处理数量"""
+    def _process_pending(batch_size, worker_id, should_stop, on_processed, batch_render):
+        """领取并处理任务，直到没有待处理任务或收到停止信号"""
         processed = 0
-        while True:
-            tasks = ScreenshotTaskService.get_pending_tasks(limit=5)
+        while not (should_stop and should_stop()):
+            tasks = ScreenshotTaskService.claim_tasks(worker_id, limit=batch_size, by_record=batch_render)
             if not tasks:
                 break
-            logger.info(f"发现 {len(tasks)} 个待处理截图任务")
-            for task in tasks:
+            logger.info(f"领取 {len(tasks)} 个待处理截图任务")
+            if batch_render:
+                ScreenshotTaskService.process_record_tasks(tasks, worker_id, on_processed)
+                processed += len(tasks)
+                continue
+            for index, task in enumerate(tasks):
+                if should_stop and should_stop():
+                    # 未开始的任务立即释放，无需等待租约过期
+                    ScreenshotTaskService.release_tasks(tasks[index:], worker_id)
+                    break
                 logger.debug(f"处理截图任务: command_id={task['id']}, command={task['command'][:30]}")
-                ScreenshotTaskService.process_task(task)
+                success = ScreenshotTaskService.process_task(task, worker_id)
                 processed += 1
+                if on_processed:
+                    on_processed(task, success)
         return processed
+
+    @staticmethod
+    def release_tasks(tasks, worker_id):
+        """将已领取但未处理的任务放回队列（不计入尝试次数）"""
+        ids = [task['id'] for task in tasks]
+        if not ids:
+            return
+        placeholders = ','.join('?' * len(ids))
+        with get_db_connection() as conn:
+            conn.execute(f'''
+                UPDATE command_executions
+                SET screenshot_status = 'pending', attempts = attempts - 1,
+                    claimed_by = NULL, lease_expires_at = NULL
+                WHERE id IN ({placeholders}) AND claimed_by = ?
+            ''', ids + [worker_id])
+
+    @staticmethod
+    def render_on_demand(command_id, timeout=SCREENSHOT_LAZY_WAIT_SECONDS):
+        """
+        按需渲染：截图仍在排队时立即在本进程中渲染，最多等待 timeout 秒
+
+        同一任务的并发请求只触发一次渲染（single-flight），其余请求等待同一结果；
+        任务已被其他工作者领取时轮询数据库等待其完成。等待超时后渲染仍在后台继续。
+
+        Args:
+            command_id: 命令ID
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            dict | None: 命令的 screenshot_status、screenshot_path、screenshot_parts、last_error；
+                         命令不存在时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        started = False
+        while True:
+            state = ScreenshotTaskService._screenshot_state(command_id)
+            if state is None or state['screenshot_status'] not in ('pending', 'processing'):
+                return state
+
+            # 每个请求最多发起一次渲染，失败放回队列后不在本请求中反复重试
+            claim = SCREENSHOT_LAZY_RENDER and not started and state['screenshot_status'] == 'pending'
+            future = ScreenshotTaskService._start_lazy_render(command_id, claim)
+            started = started or claim
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return state
+            if future is not None:
+                wait_futures([future], remaining)
+            else:
+                time.sleep(min(_LAZY_POLL_INTERVAL, remaining))
+
+    @staticmethod
+    def _start_lazy_render(command_id, claim):
+        """
+        返回本进程中该任务进行中的渲染；没有且 claim 为 True 时领取任务并提交渲染
+
+        Returns:
+            Future | None: 任务由其他进程处理（或已处理完）时返回 None
+        """
+        global _lazy_executor
+        with _inflight_lock:
+            future = _inflight.get(command_id)
+            if future is not None or not claim:
+                return future
+            # 领取前先登记占位的 Future，同时到达的请求等待同一结果，不会各自尝试领取
+            future = Future()
+            _inflight[command_id] = future
+
+        try:
+            worker_id = f"{ScreenshotTaskService.default_worker_id()}:lazy"
+            task = ScreenshotTaskService.claim_task(command_id, worker_id)
+            if task is None:
+                # 任务已被其他进程领取（或已处理完）：等待者改为轮询数据库
+                ScreenshotTaskService._finish_lazy_render(command_id, future, None)
+                return None
+
+            logger.info(f"按需渲染截图任务: command_id={command_id}")
+            with _inflight_lock:
+                if _lazy_executor is None:
+                    _lazy_executor = ThreadPoolExecutor(SCREENSHOT_LAZY_RENDER_THREADS,
+                                                        thread_name_prefix='LazyScreenshot')
+                render = _lazy_executor.submit(ScreenshotTaskService.process_task, task, worker_id)
+        except BaseException as e:
+            ScreenshotTaskService._finish_lazy_render(command_id, future, None, e)
+            raise
+
+        def on_done(done):
+            error = done.exception()
+            ScreenshotTaskService._finish_lazy_render(command_id, future, None if error else done.result(), error)
+
+        render.add_done_callback(on_done)
+        return future
+
+    @staticmethod
+    def _finish_lazy_render(command_id, future, result, error=None):
+        """移除进行中的渲染并把结果交给等待者"""
+        with _inflight_lock:
+            if _inflight.get(command_id) is future:
+                del _inflight[command_id]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def _screenshot_state(command_id):
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                SELECT screenshot_status, screenshot_path, screenshot_parts, last_error
+                FROM command_executions WHERE id = ?
+            ''', (command_id,)).fetchone()
+        return dict(row) if row else None
@@ -0,0 +1,294 @@
+"""
+截图工作进程池
+多个进程并行消费 command_executions 中的待处理截图任务
+
+工作进程由一个单线程的监控进程 fork 和重启：从已启动其他线程（请求处理、按需渲染、
+浏览器池等）的 API 进程中 fork 可能继承被其他线程持有的锁而死锁，监控进程只在启动时
+fork 一次，之后所有 fork 都发生在监控进程中。
+"""
+
+import atexit
+import multiprocessing
+import os
+import signal
+import time
+from services.screenshot_task_service import ScreenshotTaskService
+from services import screenshot_notifier
+from utils.browser_pool import shutdown_browser_pool, get_browser_stats, BROWSER_STAT_KEYS
+from utils.async_browser_pool import shutdown_async_browser_pool
+from utils.logger import get_logger
+from config import (
+    SCREENSHOT_WORKER_PROCESSES, SCREENSHOT_WORKER_BATCH_SIZE,
+    SCREENSHOT_WORKER_POLL_INTERVAL, SCREENSHOT_WORKER_STATS_INTERVAL
+)
+
+logger = get_logger('services.screenshot_worker_pool')
+
+
+def _report_deltas(index, keys, shared, stats, reported):
+    """把本进程统计相对上次上报的增量累加到共享数组中该进程的位置"""
+    with shared.get_lock():
+        for offset, key in enumerate(keys):
+            shared[index * len(keys) + offset] += stats[key] - reported[key]
+
+
+class _WakeupSignal:
+    """
+    跨进程唤醒信号（set/clear/wait 与 Event 相同，但 wait 返回时消费掉信号）
+
+    multiprocessing.Event 基于 Condition，等待中的进程被强制结束后再调用 set() 会永久阻塞，
+    这里用有界信号量实现，工作进程意外退出后重启的进程仍可继续使用同一信号。
+    """
+
+    def __init__(self, ctx):
+        self._semaphore = ctx.BoundedSemaphore(1)
+        self._semaphore.acquire()
+
+    def set(self):
+        try:
+            self._semaphore.release()
+        except ValueError:
+            # 已置位
+            pass
+
+    def clear(self):
+        self._semaphore.acquire(False)
+
+    def wait(self, timeout=None):
+        return self._semaphore.acquire(True, timeout)
+
+
+def _worker_main(index, batch_size, poll_interval, stop_flag, wakeup_event, processed, failed, browser_stats):
+    """
+    工作进程入口：循环领取并处理待处理任务
+
+    stop_flag 是整个进程池的停止标记（无锁的共享内存，由监控进程置位）；
+    本进程收到 SIGTERM 时只结束自己，处理完当前任务后退出，由监控进程重新启动。
+    """
+    terminated = False
+
+    def on_sigterm(signum, frame):
+        # 信号处理函数中不获取任何锁：只设置本进程的标记，并通过信号量唤醒等待
+        nonlocal terminated
+        terminated = True
+        wakeup_event.set()
+
+    def should_stop():
+        return terminated or stop_flag.value
+
+    # 由父进程统一处理 Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+    def on_processed(task, success):
+        counter = processed if success else failed
+        with counter.get_lock():
+            counter[index] += 1
+
+    # fork 时继承了父进程的统计值，只上报之后的增量
+    reported = get_browser_stats()
+
+    logger.info(f"截图工作进程 #{index} 已启动")
+    try:
+        while not should_stop():
+            # 先清除唤醒标记再处理，处理期间到达的通知不会丢失
+            wakeup_event.clear()
+            try:
+                ScreenshotTaskService.process_all_pending(
+                    batch_size=batch_size,
+                    should_stop=should_stop,
+                    on_processed=on_processed
+                )
+            except Exception as e:
+                logger.exception(f"截图工作进程 #{index} 处理错误: {e}")
+            # 累加上报本进程的浏览器事件统计（进程重启后不丢失历史数据）
+            stats = get_browser_stats()
+            _report_deltas(index, BROWSER_STAT_KEYS, browser_stats, stats, reported)
+            reported = stats
+            # 等待新任务通知，超时后兜底轮询
+            wakeup_event.wait(poll_interval)
+    finally:
+        shutdown_browser_pool()
+        shutdown_async_browser_pool()
+        logger.info(f"截图工作进程 #{index} 已退出")
+
+
+def _supervisor_main(processes, batch_size, poll_interval, stats_interval, parent_pid, stop_flag, stop_signal,
+                     drain_timeout, wakeup_events, pids, processed, failed, browser_stats):
+    """监控进程入口：启动工作进程，定期输出吞吐量并重启意外退出的工作进程，停止时等待工作进程退出"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_signal.set())
+
+    ctx = multiprocessing.get_context('fork')
+    workers = [None] * processes
+
+    def spawn(index):
+        process = ctx.Process(
+            target=_worker_main,
+            args=(index, batch_size, poll_interval, stop_flag, wakeup_events[index], processed, failed, browser_stats),
+            name=f"ScreenshotWorker-{index}",
+            daemon=True
+        )
+        process.start()
+        workers[index] = process
+        pids[index] = process.pid
+
+    for index in range(processes):
+        spawn(index)
+
+    last_counts = [0] * processes
+    last_time = time.monotonic()
+    try:
+        while not stop_signal.wait(stats_interval):
+            if os.getppid() != parent_pid:
+                logger.warning("API 进程已退出，停止截图工作进程")
+                break
+            for index, process in enumerate(workers):
+                if not process.is_alive():
+                    logger.warning(f"截图工作进程 #{index} 已退出 (exitcode={process.exitcode})，正在重启")
+                    spawn(index)
+
+            now = time.monotonic()
+            counts = list(processed)
+            rates = [(c - l) / (now - last_time) for c, l in zip(counts, last_counts)]
+            if any(rates):
+                summary = ', '.join(f"#{i}: {r * 60:.1f}/min" for i, r in enumerate(rates))
+                logger.info(f"截图吞吐量 {sum(rates) * 60:.1f}/min ({summary})")
+            last_counts, last_time = counts, now
+    finally:
+        # 通知所有工作进程处理完当前任务后退出
+        stop_flag.value = 1
+        for event in wakeup_events:
+            event.set()
+        deadline = time.monotonic() + drain_timeout.value
+        for index, process in enumerate(workers):
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"截图工作进程 {process.name} 未在 {drain_timeout.value:g}s 内退出，强制终止")
+                process.terminate()
+                process.join()
+            pids[index] = 0
+
+
+class ScreenshotWorkerPool:
+    """截图工作进程池（每个进程持有自己的常驻浏览器）"""
+
+    def __init__(self, processes=SCREENSHOT_WORKER_PROCESSES, batch_size=SCREENSHOT_WORKER_BATCH_SIZE,
+                 poll_interval=SCREENSHOT_WORKER_POLL_INTERVAL, stats_interval=SCREENSHOT_WORKER_STATS_INTERVAL):
+        """
+        Args:
+            processes: 工作进程数
+            batch_size: 每个进程每次拉取的任务数
+            poll_interval: 未收到通知时的兜底轮询间隔（秒）
+            stats_interval: 吞吐量日志和检查工作进程存活的间隔（秒）
+        """
+        self.processes = max(1, processes)
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.stats_interval = stats_interval
+
+        # fork 启动，避免子进程重新导入 Flask 入口模块
+        self._ctx = multiprocessing.get_context('fork')
+        self._stop_flag = self._ctx.RawValue('b', 0)
+        self._stop_signal = _WakeupSignal(self._ctx)
+        self._drain_timeout = self._ctx.RawValue('d', 30.0)
+        self._pids = self._ctx.Array('l', self.processes)
+        self._processed = self._ctx.Array('l', self.processes)
+        self._failed = self._ctx.Array('l', self.processes)
+        self._browser_stats = self._ctx.Array('l', self.processes * len(BROWSER_STAT_KEYS))
+        # 每个进程一个唤醒事件，新任务入队时全部置位
+        self._wakeup_events = [screenshot_notifier.subscribe(_WakeupSignal(self._ctx)) for _ in range(self.processes)]
+        self._supervisor = None
+        self._started_at = None
+
+    def start(self):
+        """
+        启动监控进程，由它启动所有工作进程
+
+        需在本进程启动其他线程之前调用（监控进程由本进程 fork）。
+        """
+        self._started_at = time.monotonic()
+        # 监控进程需要创建子进程，不能是守护进程；本进程退出前通过 stop 结束它
+        self._supervisor = self._ctx.Process(
+            target=_supervisor_main,
+            args=(self.processes, self.batch_size, self.poll_interval, self.stats_interval, os.getpid(),
+                  self._stop_flag, self._stop_signal, self._drain_timeout, self._wakeup_events, self._pids,
+                  self._processed, self._failed, self._browser_stats),
+            name="ScreenshotWorkerSupervisor"
+        )
+        self._supervisor.start()
+        atexit.register(self.stop)
+        logger.info(f"截图工作进程池已启动: {self.processes} 个进程")
+
+    def get_stats(self):
+        """
+        获取每个工作进程的吞吐统计
+
+        Returns:
+            list: 每个进程的 pid、存活状态、处理/失败数量、平均吞吐（个/分钟）、版式预测统计和浏览器事件统计
+        """
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0
+        stats = []
+        for index in range(self.processes):
+            pid = self._pids[index] or None
+            processed = self._processed[index]
+            stats.append({
+                'worker': index,
+                'pid': pid,
+                'alive': bool(pid and _pid_alive(pid)),
+                'processed': processed,
+                'failed': self._failed[index],
+                'per_minute': round(processed * 60 / elapsed, 2) if elapsed else 0,
+                'browser': self.get_browser_stats(index)
+            })
+        return stats
+
+    def get_browser_stats(self, index=None):
+        """
+        获取浏览器事件统计（渲染超时和按原因统计的浏览器回收次数）
+
+        Args:
+            index: 工作进程序号，默认汇总所有进程
+
+        Returns:
+            dict: BROWSER_STAT_KEYS 中各事件的次数
+        """
+        return self._sum_stats(self._browser_stats, BROWSER_STAT_KEYS, index)
+
+    def _sum_stats(self, shared, keys, index=None):
+        indexes = range(self.processes) if index is None else [index]
+        width = len(keys)
+        return {
+            key: sum(shared[i * width + offset] for i in indexes)
+            for offset, key in enumerate(keys)
+        }
+
+    def stop(self, timeout=30):
+        """通知所有工作进程在当前任务完成后退出，并等待其结束（可重复调用）"""
+        if self._supervisor is None:
+            return
+        supervisor, self._supervisor = self._supervisor, None
+        atexit.unregister(self.stop)
+        # 监控进程最多等待工作进程 timeout 秒，之后强制终止它们
+        self._drain_timeout.value = timeout
+        self._stop_signal.set()
+        supervisor.join(timeout + 5)
+        if supervisor.is_alive():
+            logger.warning(f"截图工作进程监控进程未在 {timeout}s 内退出，强制终止")
+            supervisor.terminate()
+            supervisor.join()
+            # 监控进程没能通知到的工作进程直接在这里通知
+            self._stop_flag.value = 1
+            for event in self._wakeup_events:
+                event.set()
+        logger.info("截图工作进程池已停止")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
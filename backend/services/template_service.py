@@ -6,6 +6,7 @@
 import json
 from datetime import datetime
 from models.database import get_db_connection
+from utils.image_optimizer import DOCX_FORMATS
 
 
 class TemplateService:
@@ -301,3 +302,7 @@ class TemplateService:
         valid_orgs = ['by_host', 'by_command']
         if config['section_organization'] not in valid_orgs:
             raise ValueError(f"section_organization 必须是 {valid_orgs} 之一")
+
+        # 验证 screenshot_format（可选）
+        if config.get('screenshot_format') not in (None, *DOCX_FORMATS):
+            raise ValueError(f"screenshot_format 必须是 {list(DOCX_FORMATS)} 之一")
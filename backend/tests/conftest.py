@@ -0,0 +1,63 @@
+"""
+测试公共夹具
+每个测试使用临时目录中的数据库、截图目录和通知目录，截图使用 Pillow 引擎（不需要浏览器）
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# 在导入任何项目模块之前设置：不在 API 进程内启动截图工作者，截图不依赖 Chromium
+os.environ['SCREENSHOT_EMBEDDED_WORKER'] = '0'
+os.environ['SCREENSHOT_ENGINE'] = 'pillow'
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """临时数据库（已初始化表结构），返回数据库路径"""
+    import config
+    from models import database
+    from services import screenshot_notifier, screenshot_service
+
+    db_path = tmp_path / 'inspections.db'
+    screenshots_dir = tmp_path / 'screenshots'
+    screenshots_dir.mkdir()
+    monkeypatch.setattr(config, 'DATABASE_PATH', db_path)
+    monkeypatch.setattr(database, 'DATABASE_PATH', db_path)
+    monkeypatch.setattr(screenshot_service, 'SCREENSHOTS_DIR', screenshots_dir)
+    monkeypatch.setattr(screenshot_notifier, 'SCREENSHOT_NOTIFY_DIR', tmp_path / 'notify')
+    database.init_database()
+    return db_path
+
+
+@pytest.fixture
+def screenshots_dir(db):
+    """当前测试的截图目录"""
+    from services import screenshot_service
+    return screenshot_service.SCREENSHOTS_DIR
+
+
+@pytest.fixture
+def client(db):
+    """Flask 测试客户端（app 在第一次使用时导入，此时数据库已指向临时目录）"""
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    return app_module.app.test_client()
+
+
+def make_inspection(hostname='host-1', commands=None, generate_screenshots=True):
+    """构造一条巡检数据（格式与 POST /inspections 的请求体相同）"""
+    if commands is None:
+        commands = {
+            'uptime': {'command': 'uptime', 'output': 'up 3 days', 'return_code': 0},
+            'df': {'command': 'df -h', 'output': '/dev/sda1 50G 20G 30G 40% /', 'return_code': 0},
+        }
+    return {
+        'data': {'env': {'HOSTNAME': hostname, 'USER': 'root'}, 'commands': commands},
+        'metadata': {'hostname': hostname, 'timestamp': '2024-01-01T00:00:00'},
+        'options': {'generate_screenshots': generate_screenshots},
+    }
@@ -0,0 +1,163 @@
+"""流式 JSON 解析，以及 POST /inspections 对大请求体的流式写入"""
+
+import io
+import json
+
+import pytest
+
+from conftest import make_inspection
+from api import inspection_routes
+from models.database import get_db_connection
+from utils.json_stream import JsonStream, JsonStreamError, iter_items, load_skipping
+
+
+class _TrickleReader(io.RawIOBase):
+    """每次最多返回 1 个字节，覆盖值、转义符和多字节字符跨越读取边界的情况"""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunk = self._data[self._pos:self._pos + 1]
+        self._pos += len(chunk)
+        return chunk
+
+
+DOCUMENT = {
+    'metadata': {'hostname': 'host-1', 'tags': ['a', 'b'], 'empty': {}},
+    'data': {
+        'env': {'PATH': '/usr/bin'},
+        'commands': {
+            'uptime': {'command': 'uptime', 'output': 'up 3 days', 'return_code': 0},
+            'escaped': {'command': 'echo', 'output': 'quote " backslash \\ }{][ 中文 \t', 'return_code': 1},
+            'nested': {'output': [1, 2.5, -3e2, True, False, None, {'k': [{}]}]},
+        },
+        'after': 1,
+    },
+    'options': None,
+}
+
+
+def _readers(document):
+    data = json.dumps(document, ensure_ascii=False).encode('utf-8')
+    return [io.BytesIO(data), _TrickleReader(data)]
+
+
+@pytest.mark.parametrize('reader', range(2), ids=['buffered', 'trickle'])
+def test_load_skipping(reader):
+    fp = _readers(DOCUMENT)[reader]
+
+    result = load_skipping(fp, [('data', 'commands')])
+
+    expected = json.loads(json.dumps(DOCUMENT))
+    expected['data']['commands'] = None
+    assert result == expected
+
+
+@pytest.mark.parametrize('reader', range(2), ids=['buffered', 'trickle'])
+def test_iter_items(reader):
+    fp = _readers(DOCUMENT)[reader]
+
+    assert list(iter_items(fp, ('data', 'commands'))) == list(DOCUMENT['data']['commands'].items())
+
+
+def test_iter_items_is_lazy():
+    items = iter_items(io.BytesIO(b'{"data": {"commands": {"a": 1, "b": ]}}}'), ('data', 'commands'))
+
+    assert next(items) == ('a', 1)
+    with pytest.raises(JsonStreamError):
+        next(items)
+
+
+def test_iter_items_missing_or_null_path():
+    assert list(iter_items(io.BytesIO(b'{"data": {"env": {}}}'), ('data', 'commands'))) == []
+    assert list(iter_items(io.BytesIO(b'{"data": {"commands": null}}'), ('data', 'commands'))) == []
+    assert list(iter_items(io.BytesIO(b'{"data": []}'), ('data', 'commands'))) == []
+    with pytest.raises(JsonStreamError, match='必须是对象'):
+        list(iter_items(io.BytesIO(b'{"data": {"commands": [1]}}'), ('data', 'commands')))
+
+
+def test_load_skipping_non_object_at_prefix():
+    assert load_skipping(io.BytesIO(b'{"data": [1, 2]}'), [('data', 'commands')]) == {'data': [1, 2]}
+    assert load_skipping(io.BytesIO(b'[1]'), [('data', 'commands')]) == [1]
+
+
+def test_control_characters_allowed_in_strings():
+    assert load_skipping(io.BytesIO(b'{"output": "a\tb\nc"}'), []) == {'output': 'a\tb\nc'}
+
+
+@pytest.mark.parametrize('cut', [1, 20, 60, 90, -30, -2, -1])
+def test_truncated_body(cut):
+    data = json.dumps(DOCUMENT).encode()[:cut]
+
+    with pytest.raises(JsonStreamError):
+        load_skipping(io.BytesIO(data), [('data', 'commands')])
+    with pytest.raises(JsonStreamError):
+        list(iter_items(io.BytesIO(data), ('data', 'commands')))
+
+
+@pytest.mark.parametrize('data', [
+    b'{"a": 1,}',
+    b'{"a" 1}',
+    b'{1: 2}',
+    b'{"a": tru}',
+    b'{"a": 1} extra',
+    b'{"a": [1, 2}',
+    b'',
+])
+def test_malformed_documents(data):
+    with pytest.raises(JsonStreamError):
+        load_skipping(io.BytesIO(data), [])
+
+
+def test_skip_value_keeps_buffer_small():
+    # 跳过的大值不保留在缓冲区中
+    big = '"' + 'x' * (1024 * 1024) + '"'
+    stream = JsonStream(io.BytesIO(f'[{big}, 1]'.encode()), chunk_size=1024)
+    stream._expect('[')
+    stream.skip_value()
+
+    assert len(stream._buf) < 4096
+
+
+def _post_streaming(client, monkeypatch, body):
+    monkeypatch.setattr(inspection_routes, 'INGEST_STREAM_THRESHOLD_MB', 0)
+    return client.post('/api/v1/inspections', data=body, content_type='application/json')
+
+
+def _count(table):
+    with get_db_connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_streaming_ingest(client, monkeypatch):
+    response = _post_streaming(client, monkeypatch, json.dumps(make_inspection()).encode())
+
+    assert response.status_code == 201
+    record_id = response.get_json()['data']['id']
+    commands = client.get(f'/api/v1/inspections/{record_id}').get_json()['data']['commands']
+    assert [cmd['output'] for cmd in commands] == ['up 3 days', '/dev/sda1 50G 20G 30G 40% /']
+
+
+def test_streaming_ingest_truncated_body_writes_nothing(client, monkeypatch):
+    body = json.dumps(make_inspection()).encode()
+
+    response = _post_streaming(client, monkeypatch, body[:-40])
+
+    assert response.status_code == 400
+    assert 'JSON 格式错误' in response.get_json()['error']
+    assert _count('inspection_records') == _count('command_executions') == _count('output_blobs') == 0
+
+
+def test_streaming_ingest_rejects_non_object_command(client, monkeypatch):
+    body = make_inspection(commands={'ok': {'command': 'id', 'output': 'uid=0'}, 'bad': 'text'})
+
+    response = _post_streaming(client, monkeypatch, json.dumps(body).encode())
+
+    assert response.status_code == 400
+    assert 'data.commands.bad' in response.get_json()['error']
+    assert _count('inspection_records') == 0
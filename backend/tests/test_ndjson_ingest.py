@@ -0,0 +1,118 @@
+"""NDJSON 流式提交：每行的确认、分批提交和中断时的处理"""
+
+import gzip
+import json
+
+import pytest
+
+from conftest import make_inspection
+from api import inspection_routes
+from models.database import get_db_connection
+
+
+@pytest.fixture
+def batch_size(monkeypatch):
+    monkeypatch.setattr(inspection_routes, 'INGEST_STREAM_BATCH_SIZE', 2)
+    return 2
+
+
+def _lines(*items):
+    return ''.join((item if isinstance(item, str) else json.dumps(item)) + '\n' for item in items).encode()
+
+
+def _stream(client, body, **headers):
+    response = client.post('/api/v1/inspections:stream', data=body, headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def _hostnames():
+    with get_db_connection() as conn:
+        rows = conn.execute('SELECT hostname FROM inspection_records ORDER BY id').fetchall()
+    return [row[0] for row in rows]
+
+
+def test_acks_every_line_in_order(client, batch_size):
+    body = _lines(*(make_inspection(f'host-{i}') for i in range(5)))
+
+    acks = _stream(client, body)
+
+    assert [ack['line'] for ack in acks[:-1]] == [1, 2, 3, 4, 5]
+    assert all(ack['success'] for ack in acks[:-1])
+    assert [ack['data']['hostname'] for ack in acks[:-1]] == [f'host-{i}' for i in range(5)]
+    assert acks[-1] == {'done': True, 'total': 5, 'succeeded': 5, 'failed': 0}
+    assert _hostnames() == [f'host-{i}' for i in range(5)]
+
+
+def test_acks_are_streamed_per_batch(client, batch_size):
+    body = _lines(*(make_inspection(f'host-{i}') for i in range(5)))
+
+    response = client.post('/api/v1/inspections:stream', data=body)
+    chunks = [chunk.decode() for chunk in response.response]
+
+    # 每批的确认一次输出，最后是汇总
+    assert [chunk.count('\n') for chunk in chunks] == [2, 2, 1, 1]
+
+
+def test_failed_lines_do_not_block_others(client, batch_size):
+    missing_hostname = make_inspection('host-x')
+    del missing_hostname['metadata']['hostname']
+    unknown_project = make_inspection('host-y')
+    unknown_project['metadata']['project_id'] = 'no-such-project'
+    body = _lines(
+        make_inspection('host-1'),
+        '',
+        '{"data": ',
+        missing_hostname,
+        unknown_project,
+        make_inspection('host-2'),
+    )
+
+    acks = _stream(client, body)
+
+    # 空行不确认，行号仍按原始行计算
+    results = {ack['line']: ack for ack in acks[:-1]}
+    assert sorted(results) == [1, 3, 4, 5, 6]
+    assert results[1]['success'] and results[6]['success']
+    assert 'JSON 格式错误' in results[3]['error']
+    assert 'metadata.hostname' in results[4]['error']
+    assert '项目不存在' in results[5]['error']
+    assert acks[-1] == {'done': True, 'total': 5, 'succeeded': 2, 'failed': 3}
+    assert _hostnames() == ['host-1', 'host-2']
+
+
+def test_non_object_command_fails_only_its_line(client, batch_size):
+    bad = make_inspection('host-bad', commands={'bad': 'text'})
+    body = _lines(make_inspection('host-1'), bad, make_inspection('host-2'))
+
+    acks = _stream(client, body)
+
+    assert [ack['success'] for ack in acks[:-1]] == [True, False, True]
+    assert 'data.commands.bad' in acks[1]['error']
+    assert _hostnames() == ['host-1', 'host-2']
+
+
+def test_interrupted_body_keeps_acked_lines(client, monkeypatch):
+    monkeypatch.setattr(inspection_routes, 'INGEST_STREAM_BATCH_SIZE', 1)
+    body = _lines(*(make_inspection(f'host-{i}', commands={
+        'log': {'command': 'cat log', 'output': f'{i}' * 200000}
+    }) for i in range(3)))
+    # 截断压缩数据：最后一行不完整，读取时解压出错
+    compressed = gzip.compress(body)
+    truncated = compressed[:len(compressed) * 2 // 3]
+
+    acks = _stream(client, truncated, **{'Content-Encoding': 'gzip'})
+
+    summary = acks[-1]
+    assert summary['done'] is False
+    assert '未确认的行未写入' in summary['error']
+    acked = [ack['data']['hostname'] for ack in acks[:-1] if ack['success']]
+    assert acked and len(acked) < 3
+    assert summary['succeeded'] == len(acked)
+    # 收到确认的行均已提交，其余行没有写入
+    assert _hostnames() == acked
+
+
+def test_empty_body(client):
+    assert _stream(client, b'') == [{'done': True, 'total': 0, 'succeeded': 0, 'failed': 0}]
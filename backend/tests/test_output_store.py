@@ -0,0 +1,158 @@
+"""命令输出存储：按内容去重、释放引用和旧数据迁移"""
+
+import hashlib
+
+from conftest import make_inspection
+from models.database import get_db_connection
+from services import output_store
+from services.inspection_service import InspectionService
+from services.output_store import OutputStore
+
+
+def _digest(output):
+    return hashlib.sha256(output.encode('utf-8')).hexdigest()
+
+
+def _blobs():
+    with get_db_connection() as conn:
+        rows = conn.execute('SELECT hash, codec, raw_size, stored_size, ref_count FROM output_blobs').fetchall()
+    return {row['hash']: dict(row) for row in rows}
+
+
+def _create(commands):
+    body = make_inspection(commands=commands)
+    return InspectionService.create_inspection(body['data'], body['metadata'], body['options'])['id']
+
+
+def test_put_deduplicates_identical_outputs(db):
+    output = 'line\n' * 1000
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        first = OutputStore.put(cursor, output)
+        second = OutputStore.put(cursor, output)
+        assert OutputStore.put(cursor, None) is None
+
+    assert first == second == _digest(output)
+    blob = _blobs()[first]
+    assert blob['ref_count'] == 2
+    assert blob['codec'] == 'zlib'
+    assert blob['raw_size'] == len(output)
+    assert blob['stored_size'] < blob['raw_size']
+
+
+def test_put_with_prepared_outputs(db):
+    outputs = ['a' * 500, 'b' * 500, 'a' * 500]
+    prepared = OutputStore.prepare(outputs)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        hashes = [OutputStore.put(cursor, output, prepared) for output in outputs]
+        assert OutputStore.load(cursor, hashes + [None]) == {_digest(o): o for o in outputs}
+
+    assert hashes[0] == hashes[2] != hashes[1]
+    assert {digest: blob['ref_count'] for digest, blob in _blobs().items()} == {hashes[0]: 2, hashes[1]: 1}
+
+
+def test_prepare_skips_existing_outputs(db):
+    with get_db_connection() as conn:
+        OutputStore.put(conn.cursor(), 'existing output')
+
+    prepared = OutputStore.prepare(['existing output', 'new output'])
+
+    assert prepared['existing output'][2] is None
+    assert prepared['new output'][2] is not None
+
+
+def test_incompressible_output_stored_raw(db):
+    with get_db_connection() as conn:
+        digest = OutputStore.put(conn.cursor(), 'x')
+
+    assert _blobs()[digest]['codec'] == 'raw'
+
+
+def test_round_trip_preserves_lone_surrogates(db):
+    output = 'bad \ud800 char 中文'
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        digest = OutputStore.put(cursor, output)
+        assert OutputStore.load(cursor, [digest]) == {digest: output}
+
+
+def test_inspections_share_outputs(db):
+    commands = {'uptime': {'command': 'uptime', 'output': 'up 3 days', 'return_code': 0}}
+    first = _create(commands)
+    _create(commands)
+
+    assert [blob['ref_count'] for blob in _blobs().values()] == [2]
+    detail = InspectionService.get_inspection_detail(first)
+    assert detail['commands'][0]['output'] == 'up 3 days'
+    assert 'output_hash' not in detail['commands'][0]
+
+
+def test_release_record_drops_unreferenced_outputs(db):
+    shared = {'command': 'uptime', 'output': 'up 3 days', 'return_code': 0}
+    first = _create({'uptime': shared, 'own': {'command': 'id', 'output': 'uid=0(root)', 'return_code': 0}})
+    # 同一记录内重复的输出只保存一份，引用计数按命令数计算
+    second = _create({'uptime': shared, 'again': dict(shared)})
+    assert {blob['ref_count'] for blob in _blobs().values()} == {3, 1}
+
+    InspectionService.delete_inspection(first)
+    assert [blob['ref_count'] for blob in _blobs().values()] == [2]
+
+    InspectionService.delete_inspection(second)
+    assert _blobs() == {}
+
+
+def test_migrate_inline_outputs(db):
+    record_id = _create({'new': {'command': 'uptime', 'output': 'up 3 days', 'return_code': 0}})
+    # 升级前的旧数据：输出直接保存在 output 列
+    legacy_outputs = ['up 3 days', 'legacy output', 'legacy output', '']
+    with get_db_connection() as conn:
+        conn.executemany('''
+            INSERT INTO command_executions (record_id, command, output, execution_order)
+            VALUES (?, 'legacy', ?, ?)
+        ''', [(record_id, output, order) for order, output in enumerate(legacy_outputs, 2)])
+    assert OutputStore.get_stats()['inline_rows'] == 4
+
+    batches = []
+    stats = OutputStore.migrate_inline_outputs(batch_size=3, on_batch=batches.append)
+
+    assert stats['rows'] == 4
+    assert stats['raw_bytes'] == sum(len(output) for output in legacy_outputs)
+    # 'up 3 days' 已存在，两条 'legacy output' 只新建一份
+    assert stats['new_blobs'] == 2
+    assert stats['unique_bytes'] == len('legacy output')
+    assert [batch['rows'] for batch in batches] == [3, 4]
+
+    assert {blob['hash']: blob['ref_count'] for blob in _blobs().values()} == {
+        _digest('up 3 days'): 2, _digest('legacy output'): 2, _digest(''): 1
+    }
+    store_stats = OutputStore.get_stats()
+    assert store_stats['inline_rows'] == 0
+    assert store_stats['refs'] == 5
+    detail = InspectionService.get_inspection_detail(record_id)
+    assert [cmd['output'] for cmd in detail['commands']] == ['up 3 days'] + legacy_outputs
+
+    # 可重复执行，已迁移的行不再处理
+    assert OutputStore.migrate_inline_outputs()['rows'] == 0
+
+
+def test_unmigrated_outputs_still_readable(db):
+    record_id = _create({})
+    with get_db_connection() as conn:
+        conn.execute('''
+            INSERT INTO command_executions (record_id, command, output, execution_order)
+            VALUES (?, 'legacy', 'inline output', 1)
+        ''', (record_id,))
+
+    detail = InspectionService.get_inspection_detail(record_id)
+
+    assert detail['commands'][0]['output'] == 'inline output'
+
+
+def test_zstd_without_module_falls_back_to_zlib(db, monkeypatch):
+    monkeypatch.setattr(output_store, 'OUTPUT_BLOB_CODEC', 'zstd')
+    monkeypatch.setattr(output_store, 'zstandard', None)
+    with get_db_connection() as conn:
+        digest = OutputStore.put(conn.cursor(), 'line\n' * 100)
+
+    assert _blobs()[digest]['codec'] == 'zlib'
@@ -0,0 +1,140 @@
+"""压缩请求体解压：大小和压缩比限制、损坏数据，以及中间件返回的状态码"""
+
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+from conftest import make_inspection
+from utils.request_decompression import (
+    DecompressionLimitError, decompress_body, iter_decompressed, supported_encodings
+)
+
+MB = 1024 * 1024
+
+
+def test_gzip_round_trip():
+    data = b'hello world\n' * 1000
+
+    assert decompress_body(gzip.compress(data), 'gzip') == data
+
+
+def test_concatenated_gzip_members():
+    data = gzip.compress(b'first\n') + gzip.compress(b'second\n')
+
+    assert decompress_body(data, 'gzip') == b'first\nsecond\n'
+
+
+def test_size_limit():
+    data = gzip.compress(os.urandom(MB).hex().encode())
+
+    assert len(decompress_body(data, 'gzip', max_bytes=2 * MB, max_ratio=100)) == 2 * MB
+    with pytest.raises(DecompressionLimitError, match='MB 上限'):
+        decompress_body(data, 'gzip', max_bytes=MB, max_ratio=100)
+
+
+def test_ratio_limit():
+    data = gzip.compress(b'\0' * (4 * MB))
+
+    with pytest.raises(DecompressionLimitError, match='压缩比'):
+        decompress_body(data, 'gzip', max_bytes=64 * MB, max_ratio=100)
+
+
+def test_small_bodies_skip_ratio_check():
+    # 解压后不超过 1 MB 时压缩比再高也允许
+    data = b'\0' * MB
+
+    assert decompress_body(gzip.compress(data), 'gzip', max_bytes=64 * MB, max_ratio=2) == data
+
+
+def test_bomb_stops_before_full_output():
+    produced = 0
+    src = io.BytesIO(gzip.compress(b'\0' * (64 * MB)))
+    with pytest.raises(DecompressionLimitError):
+        for chunk in iter_decompressed(src, 'gzip', max_bytes=2 * MB, max_ratio=1000000):
+            produced += len(chunk)
+
+    assert produced <= 2 * MB
+
+
+def test_corrupt_and_truncated_data():
+    with pytest.raises(ValueError, match='数据损坏'):
+        decompress_body(b'not gzip at all', 'gzip')
+    with pytest.raises(ValueError, match='不完整'):
+        decompress_body(gzip.compress(b'hello world' * 100)[:-20], 'gzip')
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError, match='不支持'):
+        decompress_body(b'data', 'br')
+
+
+def test_zstd_limits():
+    zstandard = pytest.importorskip('zstandard')
+    assert supported_encodings()[0] == 'zstd'
+    data = zstandard.ZstdCompressor().compress(b'\0' * (4 * MB))
+
+    assert len(decompress_body(data, 'zstd', max_bytes=8 * MB, max_ratio=1000000)) == 4 * MB
+    with pytest.raises(DecompressionLimitError):
+        decompress_body(data, 'zstd', max_bytes=MB, max_ratio=1000000)
+    with pytest.raises(DecompressionLimitError, match='压缩比'):
+        decompress_body(data, 'zstd', max_bytes=8 * MB, max_ratio=100)
+
+
+def _post(client, path, body, encoding='gzip'):
+    return client.post(path, data=body, headers={'Content-Encoding': encoding, 'Content-Type': 'application/json'})
+
+
+def test_middleware_decompresses_request(client):
+    body = gzip.compress(json.dumps(make_inspection()).encode())
+
+    response = _post(client, '/api/v1/inspections', body)
+
+    assert response.status_code == 201
+    assert response.get_json()['data']['commands_count'] == 2
+
+
+def test_middleware_rejects_bomb(client, monkeypatch):
+    monkeypatch.setattr(client.application.wsgi_app, 'max_bytes', MB)
+    monkeypatch.setattr(client.application.wsgi_app, 'max_ratio', 1000000)
+
+    response = _post(client, '/api/v1/inspections', gzip.compress(b' ' * (2 * MB)))
+
+    assert response.status_code == 413
+    assert response.get_json() == {'success': False, 'error': '解压后超过 1 MB 上限'}
+
+
+def test_middleware_rejects_high_ratio(client):
+    max_ratio = client.application.wsgi_app.max_ratio
+    body = gzip.compress(b' ' * (2 * MB))
+    assert 2 * MB > len(body) * max_ratio
+
+    response = _post(client, '/api/v1/inspections', body)
+
+    assert response.status_code == 413
+    assert '压缩比' in response.get_json()['error']
+
+
+def test_middleware_rejects_unsupported_encoding(client):
+    response = _post(client, '/api/v1/inspections', b'data', encoding='br')
+
+    assert response.status_code == 415
+    assert 'gzip' in response.headers['Accept-Encoding']
+
+
+def test_middleware_rejects_corrupt_body(client):
+    assert _post(client, '/api/v1/inspections', b'not gzip').status_code == 400
+
+
+def test_streaming_path_decompresses_lazily(client, monkeypatch):
+    # 流式接口不限制总大小，只检查压缩比
+    monkeypatch.setattr(client.application.wsgi_app, 'max_bytes', 16)
+    lines = ''.join(json.dumps(make_inspection(f'host-{i}')) + '\n' for i in range(3))
+
+    response = _post(client, '/api/v1/inspections:stream', gzip.compress(lines.encode()))
+
+    acks = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert acks[-1] == {'done': True, 'total': 3, 'succeeded': 3, 'failed': 0}
+
@@ -0,0 +1,134 @@
+"""截图缓存的引用计数：相同内容共用文件，删除和重新生成时释放引用"""
+
+from conftest import make_inspection
+from models.database import get_db_connection
+from services.inspection_service import InspectionService
+from services.screenshot_service import ScreenshotService
+from services.screenshot_task_service import ScreenshotTaskService
+
+
+def _create(hostname='host-1'):
+    body = make_inspection(hostname)
+    return InspectionService.create_inspection(body['data'], body['metadata'], body['options'])['id']
+
+
+def _render_pending():
+    ScreenshotTaskService.process_all_pending(batch_size=10, worker_id='test-worker')
+
+
+def _record_paths(record_id):
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT screenshot_path, screenshot_parts FROM command_executions
+            WHERE record_id = ? ORDER BY execution_order
+        ''', (record_id,)).fetchall()
+    return [path for row in rows for path in ScreenshotService.parse_screenshot_parts(row[0], row[1])]
+
+
+def _ref_counts():
+    with get_db_connection() as conn:
+        rows = conn.execute('SELECT screenshot_path, ref_count FROM screenshot_cache').fetchall()
+    return {row['screenshot_path']: row['ref_count'] for row in rows}
+
+
+def test_identical_content_shares_files(db, screenshots_dir):
+    first = _create()
+    second = _create()
+    _render_pending()
+
+    paths = _record_paths(first)
+    assert len(paths) == 2
+    assert _record_paths(second) == paths
+    assert _ref_counts() == {path: 2 for path in paths}
+    assert all((screenshots_dir / path).exists() for path in paths)
+    assert len(list(screenshots_dir.rglob('*.*'))) == 2
+
+
+def test_different_content_gets_own_files(db):
+    first = _create('host-1')
+    second = _create('host-2')
+    _render_pending()
+
+    assert not set(_record_paths(first)) & set(_record_paths(second))
+    assert set(_ref_counts().values()) == {1}
+
+
+def test_delete_releases_references(db, screenshots_dir):
+    first = _create()
+    second = _create()
+    _render_pending()
+    paths = _record_paths(first)
+
+    assert InspectionService.delete_inspection(first)
+    assert _ref_counts() == {path: 1 for path in paths}
+    assert all((screenshots_dir / path).exists() for path in paths)
+
+    assert InspectionService.delete_inspection(second)
+    assert _ref_counts() == {}
+    assert not any((screenshots_dir / path).exists() for path in paths)
+
+
+def test_delete_route_releases_references(client, screenshots_dir):
+    record_id = _create()
+    _render_pending()
+    paths = _record_paths(record_id)
+
+    response = client.delete(f'/api/v1/inspections/{record_id}')
+
+    assert response.status_code == 200
+    assert _ref_counts() == {}
+    assert not any((screenshots_dir / path).exists() for path in paths)
+
+
+def test_regenerate_releases_and_reacquires(client, screenshots_dir):
+    first = _create()
+    second = _create()
+    _render_pending()
+    paths = _record_paths(first)
+
+    response = client.post(f'/api/v1/inspections/{first}/regenerate-screenshots')
+    assert response.status_code == 200
+    assert _record_paths(first) == []
+    assert _ref_counts() == {path: 1 for path in paths}
+
+    # 重新生成时命中仍被另一条记录引用的缓存，不再渲染新文件
+    _render_pending()
+    assert _record_paths(first) == paths
+    assert _ref_counts() == {path: 2 for path in paths}
+    assert len(list(screenshots_dir.rglob('*.*'))) == 2
+
+    # 唯一的引用被释放后文件随之删除
+    client.post(f'/api/v1/inspections/{second}/regenerate-screenshots')
+    client.post(f'/api/v1/inspections/{first}/regenerate-screenshots')
+    assert _ref_counts() == {}
+    assert not any((screenshots_dir / path).exists() for path in paths)
+
+
+def test_missing_file_is_rendered_again(db, screenshots_dir):
+    first = _create()
+    _render_pending()
+    paths = _record_paths(first)
+    (screenshots_dir / paths[0]).unlink()
+
+    second = _create()
+    _render_pending()
+
+    # 文件被外部删除的缓存条目被丢弃，重新渲染并登记
+    new_paths = _record_paths(second)
+    assert new_paths[0] != paths[0]
+    assert (screenshots_dir / new_paths[0]).exists()
+    assert new_paths[1] == paths[1]
+    assert _ref_counts() == {new_paths[0]: 1, paths[1]: 2}
+
+
+def test_cache_stats_count_hits(db):
+    _create()
+    _create()
+    _render_pending()
+
+    stats = ScreenshotService.get_cache_stats()
+
+    assert stats['entries'] == 2
+    assert stats['total_refs'] == 4
+    assert stats['hits'] == 2
+    assert stats['hit_rate'] == 0.5
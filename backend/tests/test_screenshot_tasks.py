@@ -0,0 +1,206 @@
+"""截图任务领取、租约校验和过期回收"""
+
+import threading
+
+import pytest
+
+from conftest import make_inspection
+from models.database import get_db_connection
+from services import screenshot_task_service
+from services.inspection_service import InspectionService
+from services.screenshot_task_service import ScreenshotTaskService
+
+
+def _create_tasks(count):
+    commands = {
+        f'cmd{i}': {'command': f'echo {i}', 'output': f'output {i}', 'return_code': 0}
+        for i in range(count)
+    }
+    body = make_inspection(commands=commands)
+    return InspectionService.create_inspection(body['data'], body['metadata'], body['options'])['id']
+
+
+def _task_rows():
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT id, screenshot_status, claimed_by, lease_expires_at, attempts, last_error
+            FROM command_executions ORDER BY id
+        ''').fetchall()
+    return [dict(row) for row in rows]
+
+
+def _expire_leases():
+    with get_db_connection() as conn:
+        conn.execute('''
+            UPDATE command_executions SET lease_expires_at = datetime('now', '-1 seconds')
+            WHERE screenshot_status = 'processing'
+        ''')
+
+
+@pytest.fixture(params=[True, False], ids=['returning', 'begin-immediate'])
+def claim_mode(request, monkeypatch):
+    """分别覆盖 UPDATE ... RETURNING 和旧版 SQLite 的 BEGIN IMMEDIATE 两种领取方式"""
+    monkeypatch.setattr(screenshot_task_service, '_SUPPORTS_RETURNING', request.param)
+    return request.param
+
+
+def test_claim_marks_tasks_processing(db, claim_mode):
+    _create_tasks(3)
+
+    tasks = ScreenshotTaskService.claim_tasks('worker-a', limit=2, lease_seconds=60)
+
+    assert [task['output'] for task in tasks] == ['output 0', 'output 1']
+    assert all(task['attempts'] == 1 and task['env_data'] for task in tasks)
+    rows = _task_rows()
+    assert [row['screenshot_status'] for row in rows] == ['processing', 'processing', 'pending']
+    assert [row['claimed_by'] for row in rows] == ['worker-a', 'worker-a', None]
+    assert rows[0]['lease_expires_at'] is not None
+
+
+def test_concurrent_claims_never_overlap(db, claim_mode):
+    _create_tasks(40)
+    claimed = {}
+    barrier = threading.Barrier(8)
+
+    def claim(worker_id):
+        barrier.wait()
+        ids = []
+        while True:
+            tasks = ScreenshotTaskService.claim_tasks(worker_id, limit=3, lease_seconds=60)
+            if not tasks:
+                break
+            ids.extend(task['id'] for task in tasks)
+        claimed[worker_id] = ids
+
+    threads = [threading.Thread(target=claim, args=(f'worker-{i}',)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_ids = [task_id for ids in claimed.values() for task_id in ids]
+    assert len(all_ids) == len(set(all_ids)) == 40
+    owners = {row['id']: row['claimed_by'] for row in _task_rows()}
+    assert all(owners[task_id] == worker_id for worker_id, ids in claimed.items() for task_id in ids)
+
+
+def test_claim_task_skips_claimed_task(db, claim_mode):
+    _create_tasks(1)
+    command_id = _task_rows()[0]['id']
+
+    assert ScreenshotTaskService.claim_task(command_id, 'worker-a')['id'] == command_id
+    assert ScreenshotTaskService.claim_task(command_id, 'worker-b') is None
+    assert _task_rows()[0]['claimed_by'] == 'worker-a'
+
+
+def test_claim_by_record_takes_one_record(db):
+    _create_tasks(2)
+    _create_tasks(2)
+
+    tasks = ScreenshotTaskService.claim_tasks('worker-a', limit=10, by_record=True)
+
+    assert len(tasks) == 2
+    assert len({task['record_id'] for task in tasks}) == 1
+
+
+def test_complete_task_requires_current_lease(db, screenshots_dir):
+    _create_tasks(1)
+    task = ScreenshotTaskService.claim_tasks('worker-a', limit=1, lease_seconds=60)[0]
+    # 租约过期后被回收并由其他工作者重新领取
+    _expire_leases()
+    ScreenshotTaskService.reap_expired_leases(max_attempts=3)
+    ScreenshotTaskService.claim_tasks('worker-b', limit=1, lease_seconds=60)
+
+    assert ScreenshotTaskService.process_task(task, 'worker-a') is False
+
+    row = _task_rows()[0]
+    assert row['screenshot_status'] == 'processing'
+    assert row['claimed_by'] == 'worker-b'
+    # 过期租约生成的截图已释放，没有遗留文件和缓存条目
+    assert not list(screenshots_dir.rglob('*.*'))
+    with get_db_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM screenshot_cache').fetchone()[0] == 0
+
+
+def test_complete_task_with_current_lease(db, screenshots_dir):
+    _create_tasks(1)
+    task = ScreenshotTaskService.claim_tasks('worker-a', limit=1, lease_seconds=60)[0]
+
+    assert ScreenshotTaskService.process_task(task, 'worker-a') is True
+
+    row = _task_rows()[0]
+    assert row['screenshot_status'] == 'completed'
+    assert row['claimed_by'] is None and row['lease_expires_at'] is None
+    assert len(list(screenshots_dir.rglob('*.*'))) == 1
+
+
+def test_fail_task_requires_current_lease(db):
+    _create_tasks(1)
+    task = ScreenshotTaskService.claim_tasks('worker-a', limit=1, lease_seconds=60)[0]
+
+    ScreenshotTaskService._fail_task(task, RuntimeError('boom'), 'worker-b', max_attempts=3)
+    row = _task_rows()[0]
+    assert row['screenshot_status'] == 'processing'
+    assert row['claimed_by'] == 'worker-a'
+    assert row['last_error'] is None
+
+    ScreenshotTaskService._fail_task(task, RuntimeError('boom'), 'worker-a', max_attempts=3)
+    row = _task_rows()[0]
+    assert row['screenshot_status'] == 'pending'
+    assert row['claimed_by'] is None
+    assert row['last_error'] == 'boom'
+
+
+def test_fail_task_at_max_attempts_is_dead(db):
+    _create_tasks(1)
+    task = ScreenshotTaskService.claim_tasks('worker-a', limit=1, lease_seconds=60)[0]
+
+    ScreenshotTaskService._fail_task(task, RuntimeError('boom'), 'worker-a', max_attempts=1)
+
+    assert _task_rows()[0]['screenshot_status'] == 'dead'
+
+
+def test_reap_ignores_live_leases(db):
+    _create_tasks(1)
+    ScreenshotTaskService.claim_tasks('worker-a', limit=1, lease_seconds=60)
+
+    assert ScreenshotTaskService.reap_expired_leases(max_attempts=3) == 0
+    assert _task_rows()[0]['claimed_by'] == 'worker-a'
+
+
+def test_reap_returns_expired_tasks_to_queue(db):
+    _create_tasks(2)
+    ScreenshotTaskService.claim_tasks('worker-a', limit=2, lease_seconds=60)
+    _expire_leases()
+
+    assert ScreenshotTaskService.reap_expired_leases(max_attempts=3) == 2
+
+    rows = _task_rows()
+    assert [row['screenshot_status'] for row in rows] == ['pending', 'pending']
+    assert all(row['claimed_by'] is None and row['lease_expires_at'] is None for row in rows)
+    assert all(row['last_error'] == '租约过期' for row in rows)
+    # 重新领取时尝试次数继续累加
+    assert [task['attempts'] for task in ScreenshotTaskService.claim_tasks('worker-b', limit=2)] == [2, 2]
+
+
+def test_reap_marks_exhausted_tasks_dead(db):
+    _create_tasks(1)
+    for attempt in range(3):
+        ScreenshotTaskService.claim_tasks(f'worker-{attempt}', limit=1, lease_seconds=60)
+        _expire_leases()
+        ScreenshotTaskService.reap_expired_leases(max_attempts=3)
+
+    row = _task_rows()[0]
+    assert row['attempts'] == 3
+    assert row['screenshot_status'] == 'dead'
+    assert ScreenshotTaskService.claim_tasks('worker-x', limit=1) == []
+
+
+def test_reap_recovers_processing_without_lease(db):
+    _create_tasks(1)
+    # 升级前遗留的 processing 任务没有租约
+    with get_db_connection() as conn:
+        conn.execute("UPDATE command_executions SET screenshot_status = 'processing'")
+
+    assert ScreenshotTaskService.reap_expired_leases(max_attempts=3) == 1
+    assert _task_rows()[0]['screenshot_status'] == 'pending'
@@ -0,0 +1,343 @@
+"""
+异步浏览器池
+在一个 asyncio 事件循环线程中持有一个 Chromium，多个页面同时渲染，
+使单个进程即可让浏览器的多个渲染进程并行栅格化
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+from playwright.async_api import async_playwright
+from utils.browser_pool import RenderTimeoutError, count_browser_event
+from utils.process_tree import tree_rss_bytes, kill_tree, playwright_driver_pid
+from utils.logger import get_logger
+from config import (
+    ASYNC_BROWSER_MAX_PAGES, BROWSER_MAX_RENDERS, BROWSER_MAX_RSS_MB, SCREENSHOT_RENDER_TIMEOUT, DEFAULT_SCALE_FACTOR
+)
+
+logger = get_logger('utils.async_browser_pool')
+
+# 默认视口，截图时会按内容尺寸重新调整
+DEFAULT_VIEWPORT = {"width": 1600, "height": 100}
+
+# 超时后关闭卡住页面的等待时间（秒），仍无响应时强制结束整个浏览器
+PAGE_CLOSE_TIMEOUT = 5
+
+# 新建 context 后执行的异步初始化函数（如注册请求拦截），在事件循环线程中调用
+_context_setups = []
+
+
+def register_async_context_setup(setup):
+    """
+    注册浏览器 context 初始化函数
+
+    Args:
+        setup: 接收 BrowserContext 并返回可等待对象的函数，对之后使用的每个 context 执行一次
+    """
+    if setup not in _context_setups:
+        _context_setups.append(setup)
+
+
+class AsyncBrowserPool:
+    """
+    异步浏览器池：一个浏览器，最多 max_pages 个页面同时渲染
+
+    Playwright 异步 API 的对象只能在创建它的事件循环中使用，
+    因此浏览器由一个专属的事件循环线程持有。其他事件循环中的协程通过 render 提交渲染，
+    同步代码通过 render_sync 提交。
+    页面渲染后放回空闲列表复用（保留上次渲染的页面状态），出错的页面直接关闭。
+    """
+
+    def __init__(self, max_pages=ASYNC_BROWSER_MAX_PAGES, max_renders=BROWSER_MAX_RENDERS,
+                 max_rss_mb=BROWSER_MAX_RSS_MB, render_timeout=SCREENSHOT_RENDER_TIMEOUT):
+        """
+        Args:
+            max_pages: 同时渲染的页面数上限
+            max_renders: 浏览器渲染次数上限，达到后停止分配页面，等进行中的渲染结束后重启以释放内存
+            max_rss_mb: 浏览器进程树的内存上限（MB），超过后同样等进行中的渲染结束后重启，0 表示不限制
+            render_timeout: 单次渲染期限（秒），超时的页面被关闭，页面无响应时强制结束浏览器
+        """
+        self.max_pages = max(1, max_pages)
+        self.max_renders = max(1, max_renders)
+        self.max_rss_bytes = max(0, max_rss_mb) * 1024 * 1024
+        self.render_timeout = max(1, render_timeout)
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # 以下状态只在事件循环线程中访问
+        self._semaphore = None
+        self._browser_lock = None
+        self._drained = None  # 没有进行中的渲染时置位
+        self._playwright = None
+        self._driver_pid = None  # Playwright 驱动进程，浏览器进程是它的后代
+        self._browser = None
+        self._generation = 0  # 浏览器重启后递增，旧浏览器的页面不再放回空闲列表
+        self._contexts = {}  # scale_factor -> BrowserContext
+        self._applied_setups = {}  # scale_factor -> 已执行的初始化函数数量
+        self._idle_pages = {}  # scale_factor -> 空闲页面列表
+        self._render_count = 0
+        self._in_flight = 0
+
+    def _ensure_loop(self):
+        """启动事件循环线程（首次渲染时）"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("浏览器池已关闭")
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="AsyncBrowserLoop")
+                self._thread.start()
+            return self._loop
+
+    async def render(self, fn, scale_factor=DEFAULT_SCALE_FACTOR, timings=None):
+        """
+        在池中的页面上执行异步渲染函数（可在任意事件循环中 await）
+
+        Args:
+            fn: 异步渲染函数，接收一个 page，返回值原样返回
+            scale_factor: 设备像素比
+            timings: 可选的分阶段耗时字典，累加 browser_acquire（秒）
+
+        Returns:
+            fn 的返回值
+        """
+        loop = self._ensure_loop()
+        coroutine = self._render(fn, scale_factor, timings, time.perf_counter())
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def render_sync(self, fn, scale_factor=DEFAULT_SCALE_FACTOR, timings=None):
+        """同步版本的 render，阻塞到渲染完成（不能在事件循环线程中调用）"""
+        return self.run_sync(self.render(fn, scale_factor, timings))
+
+    def run_sync(self, coroutine):
+        """
+        在浏览器池的事件循环中执行协程并阻塞等待结果（不能在事件循环线程中调用）
+
+        协程中可多次 await render，多个渲染会并行执行。
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def _render(self, fn, scale_factor, timings, submitted):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pages)
+            self._browser_lock = asyncio.Lock()
+            self._drained = asyncio.Event()
+
+        async with self._semaphore:
+            page, generation = await self._acquire_page(scale_factor)
+            if timings is not None:
+                # 排队等待、浏览器（重）启动和获取页面的耗时
+                timings['browser_acquire'] = timings.get('browser_acquire', 0) + time.perf_counter() - submitted
+            failed = False
+            try:
+                return await asyncio.wait_for(fn(page), self.render_timeout)
+            except asyncio.TimeoutError as e:
+                failed = True
+                count_browser_event('timeouts')
+                logger.error(f"渲染超过 {self.render_timeout}s，关闭页面")
+                await self._close_stuck_page(page, generation)
+                raise RenderTimeoutError(f"渲染超过 {self.render_timeout}s") from e
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                self._in_flight -= 1
+                if not self._in_flight:
+                    self._drained.set()
+                self._render_count += 1
+                if failed or generation != self._generation or page.is_closed():
+                    # 出错的页面状态未知，浏览器已重启时页面也已失效
+                    try:
+                        await page.close()
+                    except Exception:
+                        pass
+                else:
+                    self._idle_pages.setdefault(scale_factor, []).append(page)
+
+    async def _close_stuck_page(self, page, generation):
+        """关闭超时的页面（同时结束其渲染进程）；页面无响应时强制结束整个浏览器"""
+        try:
+            await asyncio.wait_for(page.close(), PAGE_CLOSE_TIMEOUT)
+            return
+        except Exception as e:
+            logger.debug(f"关闭超时页面失败: {e}")
+        if generation != self._generation or not self._driver_pid:
+            return
+        logger.error("浏览器无响应，强制结束并重启")
+        kill_tree(self._driver_pid)
+        # 连接已断开，丢弃整个 Playwright 实例，下次渲染重新启动
+        self._generation += 1
+        self._idle_pages.clear()
+        self._contexts.clear()
+        self._applied_setups.clear()
+        self._browser = None
+        if self._playwright is not None:
+            try:
+                await asyncio.wait_for(self._playwright.stop(), PAGE_CLOSE_TIMEOUT)
+            except Exception as e:
+                logger.debug(f"停止 Playwright 失败: {e}")
+        self._playwright = None
+        self._driver_pid = None
+
+    async def _acquire_page(self, scale_factor):
+        """确保浏览器可用后取出空闲页面（没有则新建），返回 (page, 浏览器代次)"""
+        async with self._browser_lock:
+            await self._ensure_browser()
+            self._in_flight += 1
+            try:
+                idle = self._idle_pages.get(scale_factor)
+                while idle:
+                    page = idle.pop()
+                    if not page.is_closed():
+                        return page, self._generation
+                context = await self._get_context(scale_factor)
+                return await context.new_page(), self._generation
+            except BaseException:
+                self._in_flight -= 1
+                if not self._in_flight:
+                    self._drained.set()
+                raise
+
+    async def _ensure_browser(self):
+        """
+        确保浏览器可用（调用方持有 _browser_lock）：断线时重启；达到渲染次数上限或内存超限时
+        不再分配页面，等进行中的渲染结束后重启（每次渲染有期限，等待时间有上限）
+        """
+        if self._browser is not None and not self._browser.is_connected():
+            logger.warning("浏览器连接已断开，正在重启")
+            count_browser_event('recycled_crash')
+            await self._close_browser()
+
+        if self._browser is not None and self._render_count >= self.max_renders:
+            await self._wait_drained()
+            logger.info(f"浏览器已渲染 {self._render_count} 次，正在回收")
+            count_browser_event('recycled_renders')
+            await self._close_browser()
+
+        if self._browser is not None and self.max_rss_bytes and self._driver_pid:
+            rss = tree_rss_bytes(self._driver_pid)
+            if rss is not None and rss > self.max_rss_bytes:
+                await self._wait_drained()
+                logger.info(f"浏览器内存 {rss // (1024 * 1024)} MB 超过上限，正在回收")
+                count_browser_event('recycled_rss')
+                await self._close_browser()
+
+        if self._browser is None:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+                self._driver_pid = playwright_driver_pid(self._playwright)
+            self._browser = await self._playwright.chromium.launch(headless=True)
+            self._render_count = 0
+            logger.info(f"浏览器已启动（最多 {self.max_pages} 个页面并行渲染）")
+
+    async def _wait_drained(self):
+        """等待所有进行中的渲染结束"""
+        while self._in_flight:
+            self._drained.clear()
+            await self._drained.wait()
+
+    async def _get_context(self, scale_factor):
+        """获取指定设备像素比的 context（每个 scale_factor 一个）"""
+        context = self._contexts.get(scale_factor)
+        if context is None:
+            context = await self._browser.new_context(
+                device_scale_factor=scale_factor,
+                viewport=DEFAULT_VIEWPORT
+            )
+            context.set_default_timeout(self.render_timeout * 1000)
+            self._contexts[scale_factor] = context
+            self._applied_setups[scale_factor] = 0
+
+        setups = list(_context_setups)
+        for setup in setups[self._applied_setups[scale_factor]:]:
+            await setup(context)
+        self._applied_setups[scale_factor] = len(setups)
+        return context
+
+    async def _close_browser(self):
+        self._generation += 1
+        self._idle_pages.clear()
+        for context in self._contexts.values():
+            try:
+                await context.close()
+            except Exception:
+                pass
+        self._contexts.clear()
+        self._applied_setups.clear()
+
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logger.debug(f"关闭浏览器失败: {e}")
+            self._browser = None
+
+    async def _stop(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                logger.debug(f"停止 Playwright 失败: {e}")
+            self._playwright = None
+
+    def shutdown(self, timeout=10):
+        """关闭浏览器并停止事件循环线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            loop = self._loop
+
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), loop).result(timeout)
+        except Exception as e:
+            logger.debug(f"关闭异步浏览器池失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
+        logger.info("异步浏览器池已关闭")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_async_browser_pool():
+    """获取进程内共享的异步浏览器池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = AsyncBrowserPool()
+        return _pool
+
+
+def shutdown_async_browser_pool():
+    """关闭进程内共享的异步浏览器池（关闭后不再接受渲染任务）"""
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.shutdown()
+
+
+def _reset_after_fork():
+    """fork 出的子进程不继承父进程的事件循环线程，使用新的浏览器池"""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+atexit.register(shutdown_async_browser_pool)
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,356 @@
+"""
+浏览器池
+维护常驻的 Chromium 进程，避免每次截图都冷启动浏览器
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from playwright.sync_api import sync_playwright
+from utils.process_tree import tree_rss_bytes, kill_tree, playwright_driver_pid
+from utils.logger import get_logger
+from config import (
+    BROWSER_POOL_SIZE, BROWSER_MAX_RENDERS, BROWSER_MAX_RSS_MB, SCREENSHOT_RENDER_TIMEOUT, DEFAULT_SCALE_FACTOR
+)
+
+logger = get_logger('utils.browser_pool')
+
+# 默认视口，截图时会按内容尺寸重新调整
+DEFAULT_VIEWPORT = {"width": 1600, "height": 100}
+
+# 槽位线程退出标记
+_STOP = object()
+
+# 看门狗检查间隔（秒）
+WATCHDOG_INTERVAL = 1
+
+# 浏览器事件统计：渲染超时次数，以及按原因统计的浏览器回收次数
+BROWSER_STAT_KEYS = ('timeouts', 'recycled_renders', 'recycled_rss', 'recycled_crash')
+_browser_stats = dict.fromkeys(BROWSER_STAT_KEYS, 0)
+_browser_stats_lock = threading.Lock()
+
+
+class RenderTimeoutError(TimeoutError):
+    """渲染超过期限，浏览器已被强制结束"""
+
+
+def count_browser_event(key, count=1):
+    """累加浏览器事件统计（同步和异步浏览器池共用）"""
+    with _browser_stats_lock:
+        _browser_stats[key] += count
+
+
+def get_browser_stats():
+    """
+    获取本进程的浏览器事件统计
+
+    Returns:
+        dict: timeouts（渲染超时）、recycled_renders（达到渲染次数上限）、
+              recycled_rss（内存超限）、recycled_crash（断线或崩溃）次数
+    """
+    with _browser_stats_lock:
+        return dict(_browser_stats)
+
+# 新建 context 后执行的初始化函数（如注册请求拦截），在槽位线程中调用
+_context_setups = []
+
+
+def register_context_setup(setup):
+    """
+    注册浏览器 context 初始化函数
+
+    Args:
+        setup: 接收 BrowserContext 的函数，对之后使用的每个 context 执行一次
+    """
+    if setup not in _context_setups:
+        _context_setups.append(setup)
+
+
+class _BrowserSlot(threading.Thread):
+    """
+    浏览器槽位
+
+    Playwright 同步 API 的对象只能在创建它的线程中使用，
+    因此每个浏览器由一个专属线程持有，渲染任务通过队列投递到该线程执行。
+    """
+
+    def __init__(self, pool, index):
+        super().__init__(daemon=True, name=f"BrowserSlot-{index}")
+        self.pool = pool
+        self._playwright = None
+        self._browser = None
+        self._contexts = {}  # scale_factor -> BrowserContext
+        self._applied_setups = {}  # scale_factor -> 已执行的初始化函数数量
+        self._render_count = 0
+        self._driver_pid = None  # Playwright 驱动进程，浏览器进程是它的后代
+        # 看门狗状态：当前任务开始时间和是否已因超时被强制结束，由 _job_lock 保护
+        self._job_lock = threading.Lock()
+        self._job_started = None
+        self._timed_out = False
+
+    def run(self):
+        try:
+            while True:
+                job = self.pool._jobs.get()
+                if job is _STOP:
+                    break
+                fn, scale_factor, future, timings, submitted = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = self._execute(fn, scale_factor, timings, submitted)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            self._close_browser()
+            if self._playwright is not None:
+                try:
+                    self._playwright.stop()
+                except Exception as e:
+                    logger.debug(f"停止 Playwright 失败: {e}")
+                self._playwright = None
+
+    def _ensure_browser(self):
+        """确保浏览器可用：断线、达到渲染次数上限或内存超限时重启"""
+        if self._browser is not None and not self._browser.is_connected():
+            logger.warning(f"[{self.name}] 浏览器连接已断开，正在重启")
+            count_browser_event('recycled_crash')
+            self._close_browser()
+
+        if self._browser is not None and self._render_count >= self.pool.max_renders:
+            logger.info(f"[{self.name}] 浏览器已渲染 {self._render_count} 次，正在回收")
+            count_browser_event('recycled_renders')
+            self._close_browser()
+
+        if self._browser is not None and self.pool.max_rss_bytes and self._driver_pid:
+            rss = tree_rss_bytes(self._driver_pid)
+            if rss is not None and rss > self.pool.max_rss_bytes:
+                logger.info(f"[{self.name}] 浏览器内存 {rss // (1024 * 1024)} MB 超过上限，正在回收")
+                count_browser_event('recycled_rss')
+                self._close_browser()
+
+        if self._browser is None:
+            if self._playwright is None:
+                self._playwright = sync_playwright().start()
+                self._driver_pid = playwright_driver_pid(self._playwright)
+            self._browser = self._playwright.chromium.launch(headless=True)
+            self._render_count = 0
+            logger.info(f"[{self.name}] 浏览器已启动")
+
+    def _get_context(self, scale_factor):
+        """获取指定设备像素比的 context（每个 scale_factor 一个）"""
+        context = self._contexts.get(scale_factor)
+        if context is None:
+            context = self._browser.new_context(
+                device_scale_factor=scale_factor,
+                viewport=DEFAULT_VIEWPORT
+            )
+            # Playwright 自身的等待超时先于看门狗生效，卡在等待上的渲染无需结束浏览器
+            context.set_default_timeout(self.pool.render_timeout * 1000)
+            self._contexts[scale_factor] = context
+            self._applied_setups[scale_factor] = 0
+
+        setups = list(_context_setups)
+        for setup in setups[self._applied_setups[scale_factor]:]:
+            setup(context)
+        self._applied_setups[scale_factor] = len(setups)
+        return context
+
+    def _execute(self, fn, scale_factor, timings=None, submitted=None):
+        with self._job_lock:
+            self._job_started = time.monotonic()
+        try:
+            return self._execute_job(fn, scale_factor, timings, submitted)
+        except BaseException as e:
+            with self._job_lock:
+                timed_out, self._timed_out = self._timed_out, False
+            if not timed_out:
+                raise
+            # 看门狗已结束驱动进程，丢弃整个 Playwright 实例，下次任务重新启动
+            self._abandon_playwright()
+            raise RenderTimeoutError(f"渲染超过 {self.pool.render_timeout}s，浏览器已重启") from e
+        finally:
+            with self._job_lock:
+                self._job_started = None
+
+    def _execute_job(self, fn, scale_factor, timings, submitted):
+        self._ensure_browser()
+        page = self._get_context(scale_factor).new_page()
+        if timings is not None:
+            # 排队等待、浏览器（重）启动和新建页面的耗时
+            timings['browser_acquire'] = timings.get('browser_acquire', 0) + time.perf_counter() - submitted
+        try:
+            return fn(page)
+        except BaseException:
+            # 浏览器崩溃时丢弃，下次任务会重新启动
+            if self._browser is not None and not self._browser.is_connected():
+                # 看门狗结束的浏览器计入超时，不重复计入崩溃
+                if not self._timed_out:
+                    count_browser_event('recycled_crash')
+                self._close_browser()
+            raise
+        finally:
+            self._render_count += 1
+            if self._browser is not None:
+                try:
+                    page.close()
+                except Exception:
+                    pass
+
+    def check_deadline(self, timeout):
+        """
+        看门狗调用：当前任务超过期限时强制结束该槽位的驱动进程及浏览器
+
+        被阻塞的 Playwright 调用随即因连接断开而抛出异常，槽位线程恢复处理后续任务。
+
+        Returns:
+            bool: 是否结束了浏览器
+        """
+        with self._job_lock:
+            started = self._job_started
+            if started is None or self._timed_out or time.monotonic() - started < timeout:
+                return False
+            if not self._driver_pid:
+                return False
+            self._timed_out = True
+            logger.error(f"[{self.name}] 渲染超过 {timeout}s，强制结束浏览器")
+            count_browser_event('timeouts')
+            kill_tree(self._driver_pid)
+            return True
+
+    def _abandon_playwright(self):
+        """丢弃已被强制结束的 Playwright 实例（连接已断开，不再关闭页面和浏览器）"""
+        self._contexts.clear()
+        self._applied_setups.clear()
+        self._browser = None
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception as e:
+                logger.debug(f"[{self.name}] 停止 Playwright 失败: {e}")
+            self._playwright = None
+            self._driver_pid = None
+
+    def _close_browser(self):
+        for context in self._contexts.values():
+            try:
+                context.close()
+            except Exception:
+                pass
+        self._contexts.clear()
+        self._applied_setups.clear()
+
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception as e:
+                logger.debug(f"[{self.name}] 关闭浏览器失败: {e}")
+            self._browser = None
+
+
+class BrowserPool:
+    """线程安全的浏览器池"""
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_renders=BROWSER_MAX_RENDERS,
+                 max_rss_mb=BROWSER_MAX_RSS_MB, render_timeout=SCREENSHOT_RENDER_TIMEOUT):
+        """
+        Args:
+            size: 常驻浏览器数量
+            max_renders: 单个浏览器渲染次数上限，达到后重启以释放内存
+            max_rss_mb: 单个浏览器进程树的内存上限（MB），超过后重启，0 表示不限制
+            render_timeout: 单次渲染期限（秒），超过后看门狗强制结束并重启浏览器
+        """
+        self.size = max(1, size)
+        self.max_renders = max(1, max_renders)
+        self.max_rss_bytes = max(0, max_rss_mb) * 1024 * 1024
+        self.render_timeout = max(1, render_timeout)
+        self._jobs = queue.Queue()
+        self._slots = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._watchdog_stop = threading.Event()
+
+    def render(self, fn, scale_factor=DEFAULT_SCALE_FACTOR, timings=None):
+        """
+        在池中的浏览器上执行渲染函数
+
+        Args:
+            fn: 渲染函数，接收一个新建的 page，返回值原样返回
+            scale_factor: 设备像素比
+            timings: 可选的分阶段耗时字典，累加 browser_acquire（秒）
+
+        Returns:
+            fn 的返回值
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("浏览器池已关闭")
+            if not self._slots:
+                for index in range(self.size):
+                    slot = _BrowserSlot(self, index)
+                    slot.start()
+                    self._slots.append(slot)
+                threading.Thread(target=self._watchdog, daemon=True, name="BrowserWatchdog").start()
+
+        future = Future()
+        self._jobs.put((fn, scale_factor, future, timings, time.perf_counter()))
+        return future.result()
+
+    def _watchdog(self):
+        """定期检查各槽位的当前任务，超过期限的强制结束浏览器"""
+        while not self._watchdog_stop.wait(WATCHDOG_INTERVAL):
+            for slot in self._slots:
+                slot.check_deadline(self.render_timeout)
+
+    def shutdown(self, timeout=10):
+        """关闭所有浏览器，等待正在执行的任务结束"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            slots = list(self._slots)
+        self._watchdog_stop.set()
+
+        for _ in slots:
+            self._jobs.put(_STOP)
+        for slot in slots:
+            slot.join(timeout)
+        if slots:
+            logger.info(f"浏览器池已关闭（{len(slots)} 个浏览器）")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool():
+    """获取进程内共享的浏览器池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+        return _pool
+
+
+def shutdown_browser_pool():
+    """关闭进程内共享的浏览器池（关闭后不再接受渲染任务）"""
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.shutdown()
+
+
+def _reset_after_fork():
+    """fork 出的子进程不继承父进程的浏览器线程，使用新的浏览器池"""
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+atexit.register(shutdown_browser_pool)
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+离线批量截图渲染
+将大量 JSON 巡检数据（与 test.json 格式相同）用进程池并行渲染为截图，
+清单文件记录每份数据的渲染结果，已是最新的数据直接跳过，中断后再次运行从断点继续
+
+用法（在 backend 目录下）:
+    python -m utils.bulk_renderer ../archive --output ../data/rendered --processes 8
+    python -m utils.bulk_renderer '../archive/**/*.json' --engine pillow --scale auto
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.util import Finalize
+from pathlib import Path
+from utils.screenshot_generator import (
+    build_terminal_lines, split_terminal_tiles, choose_scale_factor, iter_tile_bytes, sanitize_filename,
+    render_signature
+)
+from utils.image_optimizer import optimize_screenshot, encoding_signature, IMAGE_FORMATS
+from utils.browser_pool import shutdown_browser_pool
+from utils.async_browser_pool import shutdown_async_browser_pool
+from utils.logger import setup_logging, get_logger
+from config import (
+    DEFAULT_FONT_FILE, DEFAULT_SCALE_FACTOR, SCREENSHOT_ENGINE, SCREENSHOT_IMAGE_FORMAT,
+    SCREENSHOT_TILE_MAX_LINES, SCREENSHOT_TILE_MAX_PIXELS
+)
+
+logger = get_logger('utils.bulk_renderer')
+
+MANIFEST_NAME = '.manifest.jsonl'
+
+
+def find_dumps(sources):
+    """
+    展开输入路径
+
+    Args:
+        sources: 目录（递归查找 *.json）、文件或 glob 模式列表
+
+    Returns:
+        list: (数据文件绝对路径, 输出子目录相对路径) 列表，按路径排序且不重复
+    """
+    dumps = {}
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            for dump in path.rglob('*.json'):
+                dumps.setdefault(dump.resolve(), dump.relative_to(path).with_suffix(''))
+        elif path.is_file():
+            dumps.setdefault(path.resolve(), Path(path.stem))
+        else:
+            # 输出子目录相对于模式中第一个通配符之前的目录，避免不同目录下的同名文件互相覆盖
+            root = _glob_root(source)
+            for match in glob.glob(source, recursive=True):
+                if Path(match).is_file():
+                    dumps.setdefault(Path(match).resolve(), Path(match).relative_to(root).with_suffix(''))
+    return sorted(dumps.items())
+
+
+def _glob_root(pattern):
+    """glob 模式中不含通配符的前缀目录"""
+    parts = []
+    for part in Path(pattern).parts[:-1]:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return Path(*parts) if parts else Path('.')
+
+
+def settings_signature(font_file, scale_factor, engine, image_format):
+    """影响渲染结果的设置（渲染版本、引擎、字体、设备像素比、分片和编码设置）的摘要"""
+    payload = json.dumps([
+        render_signature(font_file, engine),
+        scale_factor,
+        SCREENSHOT_TILE_MAX_LINES,
+        SCREENSHOT_TILE_MAX_PIXELS,
+        encoding_signature(image_format),
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    读取清单（JSON Lines，每渲染完一份数据追加一行，同一数据以最后一行为准）
+
+    中断时可能留下不完整的最后一行，忽略即可；重复记录较多时压缩重写。
+
+    Returns:
+        dict: 数据文件路径 -> 清单记录
+    """
+    entries = {}
+    line_count = 0
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line_count += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['source']] = entry
+    except FileNotFoundError:
+        return entries
+
+    if line_count > len(entries) * 2:
+        tmp_path = manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, manifest_path)
+    return entries
+
+
+def is_up_to_date(entry, stat, signature, output_dir):
+    """清单记录与数据文件的大小、修改时间和渲染设置一致，且输出文件都存在"""
+    return (
+        entry is not None
+        and entry['signature'] == signature
+        and entry['size'] == stat.st_size
+        and entry['mtime_ns'] == stat.st_mtime_ns
+        and all((output_dir / name).exists() for name in entry['files'])
+    )
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _init_worker():
+    """工作进程初始化：Ctrl+C 由主进程处理，进程正常退出时关闭浏览器"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # spawn 启动的进程不继承主进程的日志配置
+    setup_logging()
+    # 进程池的工作进程退出时不执行 atexit，通过 multiprocessing 的终结器关闭浏览器
+    Finalize(None, shutdown_browser_pool, exitpriority=10)
+    Finalize(None, shutdown_async_browser_pool, exitpriority=10)
+
+
+def render_dump(job):
+    """
+    渲染一份数据的所有命令截图（在工作进程中执行）
+
+    Args:
+        job: dict，包含 source、target、entry（上次的清单记录）、signature、font_file、scale_factor、engine、
+             image_format、output_dir
+
+    Returns:
+        dict: 清单记录；内容未变（仅修改时间变化）时 unchanged 为 True；失败时包含 error
+    """
+    source = Path(job['source'])
+    started = time.perf_counter()
+    try:
+        stat = source.stat()
+        digest = _file_digest(source)
+        entry = job['entry']
+        output_dir = Path(job['output_dir'])
+        if (entry and entry['sha256'] == digest and entry['signature'] == job['signature']
+                and all((output_dir / name).exists() for name in entry['files'])):
+            # 文件被复制或 touch 过，内容未变，只需更新清单中的大小和修改时间
+            return dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns, unchanged=True)
+
+        data = json.loads(source.read_bytes()).get('data', {})
+        env = data.get('env', {})
+        commands = data.get('commands', {})
+
+        target = output_dir / job['target']
+        target.mkdir(parents=True, exist_ok=True)
+        files = []
+        raw_bytes = encoded_bytes = 0
+        for order, cmd in enumerate(commands.values(), 1):
+            lines = build_terminal_lines(env, cmd.get('command', ''), cmd.get('output', ''), cmd.get('return_code', 0))
+            scale_factor = choose_scale_factor(lines) if job['scale_factor'] == 'auto' else job['scale_factor']
+            tiles = split_terminal_tiles(lines, scale_factor)
+            safe_command = sanitize_filename(cmd.get('command', '')) or f"command_{order}"
+            screenshots = iter_tile_bytes(tiles, job['font_file'], scale_factor, job['engine'])
+            for part_index, screenshot_bytes in enumerate(screenshots):
+                raw_bytes += len(screenshot_bytes)
+                screenshot_bytes, image_format = optimize_screenshot(screenshot_bytes, job['image_format'])
+                encoded_bytes += len(screenshot_bytes)
+                part_suffix = f"_p{part_index + 1}" if len(tiles) > 1 else ''
+                filename = f"{order:02d}_{safe_command}{part_suffix}.{IMAGE_FORMATS[image_format][0]}"
+                (target / filename).write_bytes(screenshot_bytes)
+                files.append((job['target'] / filename).as_posix())
+
+        return {
+            'source': str(source),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest,
+            'signature': job['signature'],
+            'files': files,
+            'commands': len(commands),
+            'raw_bytes': raw_bytes,
+            'encoded_bytes': encoded_bytes,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+    except Exception as e:
+        return {'source': str(source), 'error': f"{type(e).__name__}: {e}"}
+
+
+class Progress:
+    """按固定间隔输出进度和吞吐量"""
+
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.rendered = self.unchanged = self.failed = self.screenshots = 0
+        self.started = self._last_report = time.monotonic()
+
+    @property
+    def done(self):
+        return self.rendered + self.unchanged + self.failed
+
+    def update(self, result):
+        if 'error' in result:
+            self.failed += 1
+        elif result.get('unchanged'):
+            self.unchanged += 1
+        else:
+            self.rendered += 1
+            self.screenshots += len(result['files'])
+        if time.monotonic() - self._last_report >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        self._last_report = time.monotonic()
+        elapsed = max(self._last_report - self.started, 1e-6)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate and not final else 0
+        logger.info(
+            f"{'完成' if final else '进度'} {self.done}/{self.total} 份"
+            f"（渲染 {self.rendered}，内容未变 {self.unchanged}，失败 {self.failed}），"
+            f"{rate:.2f} 份/s，{self.screenshots / elapsed:.1f} 张/s"
+            + (f"，预计剩余 {eta:.0f}s" if eta else f"，耗时 {elapsed:.1f}s" if final else '')
+        )
+
+
+def run(sources, output_dir, processes=None, engine=None, font_file=DEFAULT_FONT_FILE,
+        scale_factor=DEFAULT_SCALE_FACTOR, image_format=None, manifest_path=None, force=False, progress_interval=5):
+    """
+    批量渲染
+
+    Args:
+        sources: 目录、文件或 glob 模式列表
+        output_dir: 输出目录，每份数据一个子目录
+        processes: 工作进程数，默认 CPU 核数
+        scale_factor: 设备像素比，'auto' 表示按命令自适应选择
+        manifest_path: 清单文件，默认 output_dir/.manifest.jsonl
+        force: 忽略清单，全部重新渲染
+
+    Returns:
+        Progress: 渲染统计
+    """
+    engine = engine or SCREENSHOT_ENGINE
+    image_format = image_format or SCREENSHOT_IMAGE_FORMAT
+    output_dir = Path(output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = Path(manifest_path) if manifest_path else output_dir / MANIFEST_NAME
+    manifest = {} if force else load_manifest(manifest_path)
+    signature = settings_signature(font_file, scale_factor, engine, image_format)
+
+    dumps = find_dumps(sources)
+    jobs = []
+    for source, target in dumps:
+        entry = manifest.get(str(source))
+        if is_up_to_date(entry, source.stat(), signature, output_dir):
+            continue
+        jobs.append({
+            'source': str(source), 'target': target, 'entry': entry, 'signature': signature,
+            'font_file': font_file, 'scale_factor': scale_factor, 'engine': engine,
+            'image_format': image_format, 'output_dir': str(output_dir),
+        })
+    logger.info(f"共 {len(dumps)} 份数据，{len(dumps) - len(jobs)} 份已是最新，待处理 {len(jobs)} 份")
+
+    progress = Progress(len(jobs), progress_interval)
+    if not jobs:
+        return progress
+
+    processes = max(1, min(processes or os.cpu_count() or 1, len(jobs)))
+    # spawn 启动：进程池由内部的管理线程补充退出的工作进程，从多线程进程中 fork 可能死锁；
+    # 每个进程持有自己的浏览器
+    pool = multiprocessing.get_context('spawn').Pool(processes, initializer=_init_worker)
+    try:
+        with open(manifest_path, 'a', encoding='utf-8') as manifest_file:
+            for result in pool.imap_unordered(render_dump, jobs):
+                progress.update(result)
+                if 'error' in result:
+                    logger.error(f"渲染失败: {result['source']}: {result['error']}")
+                    continue
+                # 删除上次渲染留下、本次不再生成的文件（命令或分片数量变化）
+                previous = manifest.get(result['source'])
+                for name in set(previous['files'] if previous else []) - set(result['files']):
+                    (output_dir / name).unlink(missing_ok=True)
+                result.pop('unchanged', None)
+                # 每完成一份立即追加并刷新，中断后不会重复渲染
+                manifest_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+                manifest_file.flush()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    progress.report(final=True)
+    return progress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量截图渲染（可中断续跑）')
+    parser.add_argument('sources', nargs='+', help='JSON 数据目录（递归）、文件或 glob 模式')
+    parser.add_argument('--output', '-o', default='output', help='输出目录（默认 output）')
+    parser.add_argument('--processes', '-j', type=int, help='工作进程数（默认 CPU 核数）')
+    parser.add_argument('--engine', default=SCREENSHOT_ENGINE, help='截图引擎（默认使用配置 SCREENSHOT_ENGINE）')
+    parser.add_argument('--font', default=DEFAULT_FONT_FILE, help='字体文件')
+    parser.add_argument('--scale', default=str(DEFAULT_SCALE_FACTOR), help="设备像素比，'auto' 表示自适应")
+    parser.add_argument('--format', choices=list(IMAGE_FORMATS), default=SCREENSHOT_IMAGE_FORMAT, help='截图格式')
+    parser.add_argument('--manifest', help='清单文件（默认 <输出目录>/.manifest.jsonl）')
+    parser.add_argument('--force', action='store_true', help='忽略清单，全部重新渲染')
+    parser.add_argument('--progress-interval', type=float, default=5, help='进度输出间隔（秒）')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    scale_factor = args.scale if args.scale == 'auto' else float(args.scale)
+    if scale_factor != 'auto' and scale_factor.is_integer():
+        scale_factor = int(scale_factor)
+
+    try:
+        progress = run(
+            args.sources, args.output, args.processes, args.engine, args.font, scale_factor,
+            args.format, args.manifest, args.force, args.progress_interval
+        )
+    except KeyboardInterrupt:
+        logger.warning("已中断，再次运行相同命令将从断点继续")
+        return 130
+    return 1 if progress.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
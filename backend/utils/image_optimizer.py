@@ -0,0 +1,132 @@
+"""
+截图图片优化
+对浏览器输出的真彩色 PNG 做后处理：调色板量化、zlib 压缩级别调优，或转码为 WebP/JPEG
+"""
+
+from io import BytesIO
+from PIL import Image
+from config import (
+    SCREENSHOT_IMAGE_FORMAT, SCREENSHOT_PNG_QUANTIZE, SCREENSHOT_PNG_COMPRESS_LEVEL, SCREENSHOT_JPEG_QUALITY
+)
+
+# 支持的存储格式 -> (文件扩展名, MIME 类型)
+IMAGE_FORMATS = {
+    'png': ('png', 'image/png'),
+    'webp': ('webp', 'image/webp'),
+    'jpeg': ('jpg', 'image/jpeg'),
+}
+
+# python-docx 可直接嵌入的格式
+DOCX_FORMATS = ('png', 'jpeg')
+
+# 文件扩展名 -> 格式
+_EXTENSION_FORMATS = {extension: image_format for image_format, (extension, _) in IMAGE_FORMATS.items()}
+
+
+def format_from_path(path):
+    """根据文件扩展名判断图片格式（未知扩展名按 png 处理）"""
+    return _EXTENSION_FORMATS.get(str(path).rsplit('.', 1)[-1].lower(), 'png')
+
+
+def mimetype_for_path(path):
+    """根据文件扩展名获取 MIME 类型"""
+    return IMAGE_FORMATS[format_from_path(path)][1]
+
+
+def encoding_signature(image_format=None):
+    """影响编码结果的设置，计入截图缓存键（设置变化后重新编码）"""
+    image_format = image_format or SCREENSHOT_IMAGE_FORMAT
+    if image_format == 'png':
+        return [image_format, SCREENSHOT_PNG_QUANTIZE, SCREENSHOT_PNG_COMPRESS_LEVEL]
+    if image_format == 'jpeg':
+        return [image_format, SCREENSHOT_JPEG_QUALITY]
+    return [image_format]
+
+
+# 灰度调色板（索引即亮度）
+_GRAY_PALETTE = [level for level in range(256) for _ in range(3)]
+
+
+def _to_palette(image):
+    """
+    无损转换为调色板图像
+
+    终端截图只有背景色、前景色和抗锯齿过渡色，通常不超过 256 种颜色：
+    没有彩色文字时全部为灰度，亮度值直接作为调色板索引；
+    包含彩色文字（如错误输出）时用中位切分量化并校验结果。
+    颜色超过 256 种或量化结果与原图不一致时返回 None（保持真彩色，不引入失真）。
+    """
+    colors = image.getcolors(256)
+    if colors is None:
+        return None
+
+    if all(red == green == blue for _, (red, green, blue) in colors):
+        palette_image = Image.frombytes('P', image.size, image.convert('L').tobytes())
+        palette_image.putpalette(_GRAY_PALETTE)
+        return palette_image
+
+    palette_image = image.quantize(colors=256, method=Image.Quantize.MAXCOVERAGE, dither=Image.Dither.NONE)
+    if palette_image.convert('RGB').tobytes() != image.tobytes():
+        return None
+    return palette_image
+
+
+def optimize_screenshot(png_bytes, image_format=None):
+    """
+    优化截图编码
+
+    Args:
+        png_bytes: 浏览器或 Pillow 引擎输出的 PNG 字节流
+        image_format: 目标格式 png、webp 或 jpeg，默认使用配置 SCREENSHOT_IMAGE_FORMAT
+
+    Returns:
+        tuple: (编码后的字节流, 格式)；PNG 优化后反而更大时返回原字节流
+    """
+    image_format = image_format or SCREENSHOT_IMAGE_FORMAT
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"未知的截图格式: {image_format}，可选: {', '.join(IMAGE_FORMATS)}")
+
+    image = Image.open(BytesIO(png_bytes))
+    encoded = _encode(image, image_format)
+    if image_format == 'png' and len(encoded) >= len(png_bytes):
+        return png_bytes, 'png'
+    return encoded, image_format
+
+
+def _encode(image, image_format):
+    """按格式编码图像，返回字节流"""
+    # 截图背景不透明，去掉 alpha 通道
+    image = image.convert('RGB')
+    buffer = BytesIO()
+    if image_format == 'webp':
+        # 终端文字边缘锐利，无损 WebP 比有损压缩更小且没有振铃
+        image.save(buffer, format='WEBP', lossless=True, method=4)
+    elif image_format == 'jpeg':
+        # 关闭色度抽样，避免彩色文字（如错误输出）发虚
+        image.save(buffer, format='JPEG', quality=SCREENSHOT_JPEG_QUALITY, subsampling=0, optimize=True)
+    else:
+        palette_image = _to_palette(image) if SCREENSHOT_PNG_QUANTIZE else None
+        (palette_image or image).save(buffer, format='PNG', compress_level=SCREENSHOT_PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def convert_for_docx(path, image_format=None):
+    """
+    将截图文件转换为 python-docx 可嵌入的格式
+
+    Args:
+        path: 截图文件路径
+        image_format: 目标格式 png 或 jpeg；为空时 PNG/JPEG 文件原样使用，其他格式（WebP）转为 PNG
+
+    Returns:
+        str | BytesIO: 可传给 Document.add_picture 的文件路径或字节流
+    """
+    source_format = format_from_path(path)
+    target_format = image_format or (source_format if source_format in DOCX_FORMATS else 'png')
+    if target_format not in DOCX_FORMATS:
+        raise ValueError(f"报告不支持的截图格式: {target_format}，可选: {', '.join(DOCX_FORMATS)}")
+    if target_format == source_format:
+        return str(path)
+
+    with Image.open(path) as image:
+        return BytesIO(_encode(image, target_format))
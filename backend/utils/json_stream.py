@@ -0,0 +1,250 @@
+"""
+流式 JSON 解析
+从二进制文件流中按需读取 JSON 文档的一部分：逐个读取对象的键值、跳过不需要的值，
+内存占用取决于单个被读取的值，而不是整个文档
+"""
+
+import codecs
+import json
+import re
+
+# 读取块大小
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# 字符串内容（不含结束引号），转义序列整体匹配
+_STRING_BODY = re.compile(r'(?:[^"\\]+|\\.)*', re.S)
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_PRIMITIVE_END = re.compile(r'[ \t\n\r,\]}]')
+
+
+class JsonStreamError(ValueError):
+    """JSON 格式错误"""
+
+
+class JsonStream:
+    """
+    JSON 流读取器
+
+    只保留当前正在读取的值所需的文本，已读取或跳过的部分随即丢弃。
+    字符串按 strict=False 解析（允许控制字符，与 POST /inspections 的兼容解析一致）。
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            fp: 二进制文件对象（UTF-8 编码的 JSON）
+            chunk_size: 每次读取的字节数
+        """
+        self._fp = fp
+        self._chunk_size = chunk_size
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder(strict=False)
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """读取下一块追加到缓冲区（先丢弃已读取的部分），到达文件末尾时返回 False"""
+        if self._eof:
+            return False
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        # 正在读取的值较大时按缓冲区大小的比例增大读取量，避免反复拼接造成平方级的复制
+        chunk = self._fp.read(max(self._chunk_size, len(self._buf) // 4))
+        if not chunk:
+            self._eof = True
+            self._buf += self._text_decoder.decode(b'', final=True)
+            return False
+        self._buf += self._text_decoder.decode(chunk)
+        return True
+
+    def _error(self, message):
+        return JsonStreamError(f"JSON 格式错误: {message}")
+
+    def _peek(self):
+        """跳过空白，返回下一个字符（不消费）"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise self._error("数据意外结束")
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise self._error(f"期望 '{char}'，实际为 '{found}'")
+        self._pos += 1
+
+    def _scan_value(self, keep):
+        """
+        从当前位置扫描一个完整的值，返回其在缓冲区中的结束位置
+
+        Args:
+            keep: 为 True 时保留值的全部文本以便解析；为 False 时边扫描边丢弃（跳过值）
+        """
+        first = self._peek()
+        if first not in '"{[':
+            # 数字、true、false、null：读到分隔符为止
+            offset = 0
+            while True:
+                match = _PRIMITIVE_END.search(self._buf, self._pos + offset)
+                if match:
+                    return match.start()
+                offset = len(self._buf) - self._pos
+                if not self._fill():
+                    return len(self._buf)
+
+        depth = 0
+        in_string = first == '"'
+        index = self._pos + 1 if in_string else self._pos
+        while True:
+            if in_string:
+                index = _STRING_BODY.match(self._buf, index).end()
+                if index < len(self._buf) and self._buf[index] == '"':
+                    index += 1
+                    in_string = False
+                    if depth == 0:
+                        return index
+                    continue
+            else:
+                match = _STRUCTURAL.search(self._buf, index)
+                if match:
+                    char = match.group()
+                    index = match.end()
+                    if char == '"':
+                        in_string = True
+                    elif char in '{[':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            return index
+                    continue
+                index = len(self._buf)
+
+            # 当前缓冲区内未结束（字符串可能停在末尾的转义符前），读取更多数据后从同一位置继续
+            if not keep:
+                self._pos = index
+            offset = index - self._pos
+            if not self._fill():
+                raise self._error("数据意外结束")
+            index = self._pos + offset
+
+    def read_value(self):
+        """读取并解析当前位置的值"""
+        end = self._scan_value(keep=True)
+        try:
+            value, parsed_end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError as e:
+            raise self._error(e.msg) from e
+        if parsed_end != end:
+            raise self._error(f"无法解析的值: {self._buf[self._pos:end][:50]!r}")
+        self._pos = end
+        return value
+
+    def skip_value(self):
+        """跳过当前位置的值（不解析、不保留其文本）"""
+        self._pos = self._scan_value(keep=False)
+
+    def iter_keys(self):
+        """
+        逐个读取当前位置对象的键
+
+        每次产出一个键后，调用方必须在继续迭代前用 read_value、skip_value 或 iter_keys 消费其值。
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                raise self._error("对象的键必须是字符串")
+            key = self.read_value()
+            self._expect(':')
+            yield key
+            separator = self._peek()
+            self._pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise self._error(f"期望 ',' 或 '}}'，实际为 '{separator}'")
+
+    def expect_end(self):
+        """确认文档已结束（之后只有空白）"""
+        try:
+            found = self._peek()
+        except JsonStreamError:
+            return
+        raise self._error(f"文档结束后有多余内容 '{found}'")
+
+    def peek_type(self):
+        """下一个值的类型：object、array、string 或 primitive"""
+        first = self._peek()
+        return {'{': 'object', '[': 'array', '"': 'string'}.get(first, 'primitive')
+
+
+def load_skipping(fp, skip_paths):
+    """
+    解析整个文档，但不读取指定路径上的值（返回文档中该位置为 None）
+
+    Args:
+        fp: 二进制文件对象
+        skip_paths: 要跳过的键路径集合，如 {('data', 'commands')}
+
+    Returns:
+        解析结果
+    """
+    stream = JsonStream(fp)
+    skip_paths = {tuple(path) for path in skip_paths}
+    prefixes = {path[:i] for path in skip_paths for i in range(len(path))}
+
+    def read(path):
+        if path in skip_paths:
+            stream.skip_value()
+            return None
+        if path not in prefixes or stream.peek_type() != 'object':
+            return stream.read_value()
+        return {key: read(path + (key,)) for key in stream.iter_keys()}
+
+    result = read(())
+    stream.expect_end()
+    return result
+
+
+def iter_items(fp, path):
+    """
+    逐个读取指定路径上的对象的键值对（每次只解析一个值）
+
+    Args:
+        fp: 二进制文件对象
+        path: 键路径，如 ('data', 'commands')
+
+    Yields:
+        tuple: (键, 值)；路径不存在或值为 null 时不产出任何内容
+    """
+    stream = JsonStream(fp)
+
+    def descend(depth):
+        if depth == len(path):
+            if stream.peek_type() == 'primitive' and stream.read_value() is None:
+                return
+            if stream.peek_type() != 'object':
+                raise JsonStreamError(f"JSON 格式错误: {'.'.join(path)} 必须是对象")
+            for key in stream.iter_keys():
+                yield key, stream.read_value()
+            return
+        if stream.peek_type() != 'object':
+            stream.skip_value()
+            return
+        found = False
+        for key in stream.iter_keys():
+            if key == path[depth] and not found:
+                found = True
+                yield from descend(depth + 1)
+            else:
+                stream.skip_value()
+
+    yield from descend(0)
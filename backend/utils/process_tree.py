@@ -0,0 +1,94 @@
+"""
+进程树工具
+通过 /proc 统计浏览器进程树的内存并强制结束卡死的浏览器（仅 Linux，其他平台返回 None / 不执行）
+"""
+
+import os
+import signal
+from utils.logger import get_logger
+
+logger = get_logger('utils.process_tree')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _children_map():
+    """ppid -> 子进程 pid 列表；不支持 /proc 时返回 None"""
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return None
+
+    children = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        # 进程名可能包含空格和括号，从最后一个右括号之后解析：state ppid ...
+        ppid = int(data[data.rindex(b')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def descendant_pids(pid):
+    """
+    获取进程的所有后代进程
+
+    Returns:
+        list | None: 后代进程 pid 列表；不支持 /proc 时返回 None
+    """
+    children = _children_map()
+    if children is None:
+        return None
+    result, stack = [], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            result.append(child)
+            stack.append(child)
+    return result
+
+
+def tree_rss_bytes(pid):
+    """
+    进程所有后代的常驻内存（RSS）之和，不含进程本身
+
+    Returns:
+        int | None: 字节数；不支持 /proc 时返回 None
+    """
+    pids = descendant_pids(pid)
+    if pids is None:
+        return None
+    total = 0
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/statm') as f:
+                total += int(f.read().split()[1]) * _PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def kill_tree(pid):
+    """强制结束进程及其所有后代（SIGKILL），已退出的进程忽略"""
+    for target in (descendant_pids(pid) or []) + [pid]:
+        try:
+            os.kill(target, signal.SIGKILL)
+        except OSError:
+            pass
+    logger.debug(f"已结束进程树: {pid}")
+
+
+def playwright_driver_pid(playwright):
+    """
+    获取 Playwright 驱动进程的 pid（浏览器进程是它的后代）
+
+    Playwright 未公开该信息，读取内部属性；版本不兼容时返回 None。
+    """
+    try:
+        return playwright._impl_obj._connection._transport._proc.pid
+    except AttributeError:
+        return None
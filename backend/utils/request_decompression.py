@@ -0,0 +1,244 @@
+"""
+请求体解压
+支持 Content-Encoding: gzip（以及安装 zstandard 后的 zstd）的上传请求，
+按解压后大小和压缩比限制防止解压炸弹
+"""
+
+import io
+import json
+import tempfile
+import zlib
+from io import BytesIO
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import ClosingIterator, get_input_stream
+from utils.logger import get_logger
+from config import REQUEST_MAX_DECOMPRESSED_MB, REQUEST_MAX_DECOMPRESSION_RATIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = get_logger('utils.request_decompression')
+
+# 每次读取和解压输出的块大小
+_CHUNK_SIZE = 64 * 1024
+
+# 解压结果超过该大小后写入磁盘临时文件
+_SPOOL_MAX_MEMORY = 1024 * 1024
+
+# 流式接口的路径后缀：请求体边读边解压，只检查压缩比，不限制总大小
+STREAMING_PATH_SUFFIX = ':stream'
+
+# 解压后不超过该大小时不检查压缩比（小请求的压缩比没有意义）
+_RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+
+class DecompressionLimitError(ValueError):
+    """解压后大小或压缩比超过限制"""
+
+
+def supported_encodings():
+    """服务端支持的请求体编码（按优先级排列）"""
+    return ['zstd', 'gzip'] if zstandard else ['gzip']
+
+
+class _CountingReader:
+    """记录已读取字节数的文件包装（用于计算压缩比）"""
+
+    def __init__(self, fp):
+        self._fp = fp
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self._fp.read(size)
+        self.count += len(data)
+        return data
+
+
+class _ChunkReader(io.RawIOBase):
+    """把数据块迭代器包装成可读文件（流式接口边读边解压）"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, b'')
+            if not self._pending:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _check_limits(output_size, input_size, max_bytes, max_ratio):
+    if output_size > max_bytes:
+        raise DecompressionLimitError(f"解压后超过 {max_bytes // (1024 * 1024)} MB 上限")
+    if output_size > _RATIO_CHECK_MIN_BYTES and output_size > input_size * max_ratio:
+        raise DecompressionLimitError(f"压缩比超过 {max_ratio}:1 上限")
+
+
+def _gunzip(src, max_bytes, max_ratio):
+    """逐块解压 gzip（支持多个 member 拼接），超限时立即停止"""
+    size, input_size = 0, 0
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    while True:
+        data = src.read(_CHUNK_SIZE)
+        if not data:
+            break
+        input_size += len(data)
+        while data:
+            if decompressor.eof:
+                # 下一个 gzip member
+                decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            chunk = decompressor.decompress(data, _CHUNK_SIZE)
+            data = decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail
+            size += len(chunk)
+            _check_limits(size, input_size, max_bytes, max_ratio)
+            yield chunk
+    # 输入已读完，取出 zlib 内部尚未输出的数据
+    while not decompressor.eof:
+        chunk = decompressor.decompress(b'', _CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("gzip 数据不完整")
+        size += len(chunk)
+        _check_limits(size, input_size, max_bytes, max_ratio)
+        yield chunk
+
+
+def _unzstd(src, max_bytes, max_ratio):
+    """逐块解压 zstd，超限时立即停止"""
+    size, counter = 0, _CountingReader(src)
+    with zstandard.ZstdDecompressor().stream_reader(counter, read_size=_CHUNK_SIZE) as reader:
+        while True:
+            chunk = reader.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            _check_limits(size, counter.count, max_bytes, max_ratio)
+            yield chunk
+
+
+def iter_decompressed(src, encoding, max_bytes=REQUEST_MAX_DECOMPRESSED_MB * 1024 * 1024,
+                      max_ratio=REQUEST_MAX_DECOMPRESSION_RATIO):
+    """
+    逐块解压请求体（不需要同时持有整个请求体）
+
+    Args:
+        src: 压缩数据的文件对象
+        encoding: Content-Encoding（gzip 或 zstd）
+        max_bytes: 解压后的最大字节数，None 表示不限制（流式接口）
+        max_ratio: 解压后超过 1 MB 时允许的最大压缩比
+
+    Yields:
+        bytes: 解压后的数据块
+
+    Raises:
+        DecompressionLimitError: 超过大小或压缩比限制
+        ValueError: 数据损坏或编码不支持
+    """
+    if encoding not in supported_encodings():
+        raise ValueError(f"不支持的 Content-Encoding: {encoding}")
+    max_bytes = float('inf') if max_bytes is None else max_bytes
+    codec_errors = (zlib.error, zstandard.ZstdError) if zstandard else (zlib.error,)
+    try:
+        if encoding == 'gzip':
+            yield from _gunzip(src, max_bytes, max_ratio)
+        else:
+            yield from _unzstd(src, max_bytes, max_ratio)
+    except codec_errors as e:
+        raise ValueError(f"{encoding} 数据损坏: {e}")
+
+
+def decompress_stream(src, dst, encoding, max_bytes=REQUEST_MAX_DECOMPRESSED_MB * 1024 * 1024,
+                      max_ratio=REQUEST_MAX_DECOMPRESSION_RATIO):
+    """逐块解压请求体并写入 dst（参数和异常同 iter_decompressed），返回解压后的字节数"""
+    size = 0
+    for chunk in iter_decompressed(src, encoding, max_bytes, max_ratio):
+        dst.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def decompress_body(data, encoding, max_bytes=REQUEST_MAX_DECOMPRESSED_MB * 1024 * 1024,
+                    max_ratio=REQUEST_MAX_DECOMPRESSION_RATIO):
+    """解压内存中的请求体（参数和异常同 decompress_stream），返回 bytes"""
+    output = BytesIO()
+    decompress_stream(BytesIO(data), output, encoding, max_bytes, max_ratio)
+    return output.getvalue()
+
+
+class DecompressionMiddleware:
+    """
+    WSGI 中间件：请求带 Content-Encoding 时解压请求体，
+    之后的路由按未压缩请求处理（request.get_json() 等不变）
+
+    流式接口（路径以 :stream 结尾）的请求体可能很大，不预先解压，
+    改为路由读取时边读边解压，只检查压缩比。
+    """
+
+    def __init__(self, wsgi_app, max_bytes=REQUEST_MAX_DECOMPRESSED_MB * 1024 * 1024,
+                 max_ratio=REQUEST_MAX_DECOMPRESSION_RATIO):
+        self.wsgi_app = wsgi_app
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return self.wsgi_app(environ, start_response)
+
+        encoding = 'gzip' if encoding == 'x-gzip' else encoding
+        if encoding not in supported_encodings():
+            return self._error(start_response, '415 Unsupported Media Type',
+                               f"不支持的 Content-Encoding: {encoding}，可选: {', '.join(supported_encodings())}")
+        if environ.get('PATH_INFO', '').endswith(STREAMING_PATH_SUFFIX):
+            # 解压错误在路由读取请求体时以 ValueError 抛出
+            src = get_input_stream(environ)
+            environ['wsgi.input'] = io.BufferedReader(
+                _ChunkReader(iter_decompressed(src, encoding, None, self.max_ratio)), _CHUNK_SIZE
+            )
+            environ['wsgi.input_terminated'] = True
+            environ.pop('CONTENT_LENGTH', None)
+            environ.pop('HTTP_CONTENT_ENCODING', None)
+            return self.wsgi_app(environ, start_response)
+
+        # 解压结果先写入临时文件，超过 1 MB 后落盘，大请求体不必整个留在内存中
+        body = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_MEMORY)
+        try:
+            # 压缩数据不会比解压后的上限还大
+            src = get_input_stream(environ, max_content_length=self.max_bytes)
+            size = decompress_stream(src, body, encoding, self.max_bytes, self.max_ratio)
+        except (DecompressionLimitError, RequestEntityTooLarge) as e:
+            body.close()
+            logger.warning(f"拒绝压缩请求体 {environ.get('PATH_INFO')}: {e}")
+            message = str(e) if isinstance(e, DecompressionLimitError) else '请求体过大'
+            return self._error(start_response, '413 Request Entity Too Large', message)
+        except ValueError as e:
+            body.close()
+            logger.warning(f"压缩请求体解压失败 {environ.get('PATH_INFO')}: {e}")
+            return self._error(start_response, '400 Bad Request', str(e))
+
+        logger.debug(f"请求体解压: {encoding} -> {size} 字节")
+        body.seek(0)
+        environ['wsgi.input'] = body
+        environ['CONTENT_LENGTH'] = str(size)
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        environ.pop('wsgi.input_terminated', None)
+        return ClosingIterator(self.wsgi_app(environ, start_response), body.close)
+
+    @staticmethod
+    def _error(start_response, status, message):
+        body = json.dumps({'success': False, 'error': message}, ensure_ascii=False).encode('utf-8')
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Accept-Encoding', ', '.join(supported_encodings())),
+        ])
+        return [body]
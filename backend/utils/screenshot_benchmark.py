@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+截图渲染基准测试
+按输出行数、行宽和设备像素比渲染合成命令，统计各阶段耗时的 p50/p95/p99，
+结果写入 JSON 文件，用于对比引擎和发现性能回退
+
+用法（在 backend 目录下）:
+    python -m utils.screenshot_benchmark --engine pillow --repeat 5
+    python -m utils.screenshot_benchmark --baseline data/benchmarks/old.json --threshold 0.2
+"""
+
+import argparse
+import json
+import math
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from utils.screenshot_generator import build_screenshot_tiles, iter_tile_bytes, RENDER_CACHE_VERSION
+from utils.logger import setup_logging, get_logger
+from config import (
+    DATA_DIR, DEFAULT_FONT_FILE, SCREENSHOT_ENGINE, SCREENSHOT_MAX_LINE_LENGTH,
+    SCREENSHOT_TILE_MAX_LINES, SCREENSHOT_TILE_MAX_PIXELS, SCREENSHOT_PAGE_MAX_PIXELS
+)
+
+logger = get_logger('utils.screenshot_benchmark')
+
+DEFAULT_LINE_COUNTS = (10, 100, 1000, 10000)
+DEFAULT_SCALE_FACTORS = (1, 2, 3)
+LINE_WIDTHS = {
+    'narrow': 40,
+    'wide': SCREENSHOT_MAX_LINE_LENGTH,
+}
+
+# 阶段顺序（playwright 引擎无 draw，pillow 引擎无浏览器相关阶段）
+STAGES = (
+    'browser_acquire', 'set_content', 'font_ready', 'size_evaluate', 'resize',
+    'draw', 'png_encode', 'file_write'
+)
+
+BENCHMARK_ENV = {
+    'USER': 'root',
+    'HOSTNAME': 'benchmark-host',
+    'PWD': '/root',
+}
+
+
+def synthetic_output(line_count, width):
+    """生成确定性的合成命令输出（类似 ps -ef），每行恰好 width 个字符"""
+    lines = []
+    for i in range(line_count):
+        line = f"root {1000 + i:>7} {i % 97:>5}  0 10:{i % 60:02d} ?  00:00:{i % 60:02d} /usr/sbin/daemon-{i} --opt"
+        lines.append((line * (width // len(line) + 1))[:width])
+    return '\n'.join(lines)
+
+
+def percentile(values, pct):
+    """最近秩法百分位数"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    """耗时统计（毫秒）"""
+    return {
+        'p50': round(percentile(values, 50) * 1000, 3),
+        'p95': round(percentile(values, 95) * 1000, 3),
+        'p99': round(percentile(values, 99) * 1000, 3),
+        'mean': round(sum(values) / len(values) * 1000, 3),
+        'min': round(min(values) * 1000, 3),
+        'max': round(max(values) * 1000, 3),
+    }
+
+
+def run_case(engine, line_count, width_name, scale_factor, repeat, warmup, output_dir):
+    """
+    执行一个基准用例：按生产路径切分分片、渲染并写入文件
+
+    Returns:
+        dict: 用例参数、分片数、输出字节数、总耗时及各阶段耗时统计
+    """
+    command = f"benchmark --lines {line_count} --width {width_name}"
+    output = synthetic_output(line_count, LINE_WIDTHS[width_name])
+    tiles = build_screenshot_tiles(BENCHMARK_ENV, command, output, 0, scale_factor)
+
+    samples = {stage: [] for stage in STAGES}
+    totals = []
+    output_bytes = 0
+    for iteration in range(warmup + repeat):
+        timings = {}
+        output_bytes = 0
+        started = time.perf_counter()
+        screenshots = iter_tile_bytes(tiles, DEFAULT_FONT_FILE, scale_factor, engine, timings=timings)
+        for index, screenshot_bytes in enumerate(screenshots):
+            write_started = time.perf_counter()
+            (output_dir / f"tile_{index:04d}.png").write_bytes(screenshot_bytes)
+            timings['file_write'] = timings.get('file_write', 0) + time.perf_counter() - write_started
+            output_bytes += len(screenshot_bytes)
+        elapsed = time.perf_counter() - started
+
+        # 预热轮次不计入统计（浏览器启动、字体缓存等一次性开销）
+        if iteration < warmup:
+            continue
+        totals.append(elapsed)
+        for stage, seconds in timings.items():
+            samples.setdefault(stage, []).append(seconds)
+
+    return {
+        'engine': engine,
+        'lines': line_count,
+        'width': width_name,
+        'columns': LINE_WIDTHS[width_name],
+        'scale_factor': scale_factor,
+        'tiles': len(tiles),
+        'output_bytes': output_bytes,
+        'repeat': repeat,
+        'total_ms': summarize(totals),
+        'stages_ms': {stage: summarize(values) for stage, values in samples.items() if values},
+    }
+
+
+def run_benchmark(engine=None, line_counts=DEFAULT_LINE_COUNTS, widths=tuple(LINE_WIDTHS),
+                  scale_factors=DEFAULT_SCALE_FACTORS, repeat=5, warmup=1):
+    """
+    执行全部基准用例
+
+    Returns:
+        dict: 运行环境元数据和各用例结果
+    """
+    engine = engine or SCREENSHOT_ENGINE
+    cases = []
+    with tempfile.TemporaryDirectory(prefix='screenshot_benchmark_') as tmp_dir:
+        output_dir = Path(tmp_dir)
+        for line_count in line_counts:
+            for width_name in widths:
+                for scale_factor in scale_factors:
+                    case = run_case(engine, line_count, width_name, scale_factor, repeat, warmup, output_dir)
+                    logger.info(
+                        f"[{engine}] {line_count:>6} 行 {width_name:<6} x{scale_factor}: "
+                        f"p50={case['total_ms']['p50']:.1f}ms p95={case['total_ms']['p95']:.1f}ms "
+                        f"p99={case['total_ms']['p99']:.1f}ms ({case['tiles']} 张)"
+                    )
+                    cases.append(case)
+
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'engine': engine,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+        },
+        'config': {
+            'render_cache_version': RENDER_CACHE_VERSION,
+            'font_file': DEFAULT_FONT_FILE,
+            'max_line_length': SCREENSHOT_MAX_LINE_LENGTH,
+            'tile_max_lines': SCREENSHOT_TILE_MAX_LINES,
+            'tile_max_pixels': SCREENSHOT_TILE_MAX_PIXELS,
+            'page_max_pixels': SCREENSHOT_PAGE_MAX_PIXELS,
+            'warmup': warmup,
+        },
+        'cases': cases,
+    }
+
+
+def find_regressions(result, baseline, threshold=0.2):
+    """
+    与基线结果对比，找出 p50 总耗时变慢超过 threshold 的用例
+
+    Returns:
+        list: 回退用例描述
+    """
+    def case_key(case):
+        return case['engine'], case['lines'], case['width'], case['scale_factor']
+
+    baseline_cases = {case_key(case): case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in result['cases']:
+        previous = baseline_cases.get(case_key(case))
+        if not previous:
+            continue
+        before, after = previous['total_ms']['p50'], case['total_ms']['p50']
+        if before > 0 and (after - before) / before > threshold:
+            regressions.append({
+                'engine': case['engine'],
+                'lines': case['lines'],
+                'width': case['width'],
+                'scale_factor': case['scale_factor'],
+                'baseline_p50_ms': before,
+                'p50_ms': after,
+                'change': round((after - before) / before, 4),
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='截图渲染基准测试')
+    parser.add_argument('--engine', default=SCREENSHOT_ENGINE, help='截图引擎（默认使用配置 SCREENSHOT_ENGINE）')
+    parser.add_argument('--lines', type=int, nargs='+', default=list(DEFAULT_LINE_COUNTS), help='输出行数')
+    parser.add_argument('--widths', nargs='+', choices=list(LINE_WIDTHS), default=list(LINE_WIDTHS), help='行宽')
+    parser.add_argument('--scales', type=float, nargs='+', default=[float(scale) for scale in DEFAULT_SCALE_FACTORS],
+                        help='设备像素比')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例的计时轮数')
+    parser.add_argument('--warmup', type=int, default=1, help='每个用例的预热轮数')
+    parser.add_argument('--output', help='结果 JSON 路径（默认 data/benchmarks/screenshot_<引擎>_<时间>.json）')
+    parser.add_argument('--baseline', help='基线结果 JSON，用于检测性能回退')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p50 变慢超过该比例视为回退（默认 0.2）')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    scale_factors = [int(scale) if scale.is_integer() else scale for scale in args.scales]
+    result = run_benchmark(args.engine, args.lines, args.widths, scale_factors, max(1, args.repeat), args.warmup)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        result['regressions'] = find_regressions(result, baseline, args.threshold)
+        for regression in result['regressions']:
+            logger.warning(
+                f"性能回退: {regression['lines']} 行 {regression['width']} x{regression['scale_factor']} "
+                f"p50 {regression['baseline_p50_ms']:.1f}ms -> {regression['p50_ms']:.1f}ms"
+            )
+
+    if args.output:
+        output_path = Path(args.output)
+    else:
+        output_path = DATA_DIR / 'benchmarks' / f"screenshot_{result['engine']}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    output_path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    logger.info(f"基准测试结果已保存到: {output_path}")
+
+    return 1 if result.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
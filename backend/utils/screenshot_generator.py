@@ -1,20 +1,44 @@
 #!/usr/bin/env python3
 """
 终端截图生成器
-使用 Playwright 将 JSON 中的命令执行记录渲染成终端截图
+将 JSON 中的命令执行记录渲染成终端截图，支持 Playwright（Chromium）和 Pillow 两种引擎
 """
 
 import html
+import math
 import json
+import asyncio
 import sys
+import time
 import base64
+import hashlib
+import unicodedata
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import urlparse, quote, unquote
 from playwright.sync_api import sync_playwright
+from utils.browser_pool import get_browser_pool, register_context_setup
+from utils.async_browser_pool import get_async_browser_pool, register_async_context_setup
 from utils.logger import get_logger
-from config import SCREENSHOT_MAX_LINE_LENGTH
+from config import (
+    DEFAULT_SCALE_FACTOR, SCREENSHOT_MIN_SCALE_FACTOR, SCREENSHOT_MAX_MEGAPIXELS,
+    REPORT_TARGET_DPI, REPORT_SCREENSHOT_WIDTH, SCREENSHOT_MAX_LINE_LENGTH, SCREENSHOT_RECORD_WAIT_TIME, SCREENSHOT_ENGINE,
+    SCREENSHOT_TILE_MAX_LINES, SCREENSHOT_TILE_MAX_PIXELS, SCREENSHOT_PAGE_MAX_PIXELS
+)
 
 logger = get_logger('utils.screenshot_generator')
 
+# 渲染版式版本号，修改样式或布局后递增以使截图缓存失效
+RENDER_CACHE_VERSION = 2
+
+# 版式尺寸（CSS 像素），与 get_css_styles 一致，用于在渲染前估算截图大小
+CHAR_WIDTH = 8.8        # OperatorMono 字宽 0.55em @ 16px
+WIDE_CHAR_WIDTH = 16    # 全角字符按 1em 估算
+LINE_PITCH = 24         # .line 行高 16px + 行间换行符 8px
+BLOCK_CHROME = 12       # 上下内边距 1px×2、首个换行符 8px、底部边距 2px
+BLOCK_WIDTH_CHROME = 4  # 左右内边距 1px×2、右侧边距 2px
+SCALE_FACTOR_STEP = 0.25  # 自适应设备像素比向下取整的步长（减少浏览器 context 数量，提高缓存命中）
+
 
 def parse_ps1(ps1_template, env):
     """
@@ -165,23 +189,8 @@ def load_font_as_base64(font_path):
         return font_base64
 
 
-def get_css_styles(font_base64):
-    """生成 CSS 样式"""
-    css_parts = []
-    
-    # 添加字体定义
-    if font_base64:
-        css_parts.append(f'''
-        @font-face {{
-            font-family: 'OperatorMono';
-            src: url('data:font/otf;base64,{font_base64}') format('opentype');
-            font-weight: 500;
-            font-style: normal;
-            font-display: swap;
-        }}
-        ''')
-    
-    css_parts.append('''
+# 终端样式（不含字体定义）
+TERMINAL_CSS = '''
         * {
             margin: 0;
             padding: 0;
@@ -234,32 +243,111 @@ def get_css_styles(font_base64):
             line-height: 1.0em;
             display: block;
         }
-    ''')
+        .shot {
+            background-color: #000000;
+            padding: 0 2px 2px 0;
+            width: fit-content;
+        }
+    '''
+
+
+def get_font_face_css(font_src):
+    """
+    生成字体定义
+
+    Args:
+        font_src: 字体地址（data URL 或由请求拦截提供的资源地址）
+    """
+    return f'''
+        @font-face {{
+            font-family: 'OperatorMono';
+            src: url('{font_src}') format('opentype');
+            font-weight: 500;
+            font-style: normal;
+            font-display: swap;
+        }}
+        '''
+
+
+def get_css_styles(font_base64):
+    """生成 CSS 样式（字体以 base64 内联）"""
+    css_parts = []
+    
+    # 添加字体定义
+    if font_base64:
+        css_parts.append(get_font_face_css(f'data:font/otf;base64,{font_base64}'))
+    
+    css_parts.append(TERMINAL_CSS)
     return '\n'.join(css_parts)
 
 
-def generate_single_command_html(env, command, output, return_code, font_base64):
-    """为单个命令生成 HTML 页面"""
-    # 解析 PS1 提示符
+# 就绪标记脚本：主动触发字体加载，字体就绪且完成一次布局后置为就绪
+READY_SCRIPT = (
+    "window.__terminalReady = document.fonts.load(\"500 16px 'OperatorMono'\")"
+    ".then(() => document.fonts.ready)"
+    ".then(() => new Promise(resolve => requestAnimationFrame(resolve)))"
+    ".then(() => { document.body.dataset.ready = '1'; });"
+)
+
+# 等待就绪后读取终端内容尺寸
+MEASURE_SCRIPT = """
+    async () => {
+        await (window.__terminalReady || document.fonts.ready);
+        const terminal = document.querySelector('.terminal');
+        if (terminal) {
+            return {
+                width: terminal.scrollWidth,
+                height: terminal.scrollHeight
+            };
+        }
+        const body = document.body;
+        const html = document.documentElement;
+        return {
+            width: Math.max(
+                body.scrollWidth, body.offsetWidth,
+                html.clientWidth, html.scrollWidth, html.offsetWidth
+            ),
+            height: Math.max(
+                body.scrollHeight, body.offsetHeight,
+                html.clientHeight, html.scrollHeight, html.offsetHeight
+            )
+        };
+    }
+"""
+
+# 仅等待字体和布局就绪（分阶段计时时与测量分开执行）
+FONT_READY_SCRIPT = "async () => { await (window.__terminalReady || document.fonts.ready); }"
+
+# 批量模式：等待就绪后读取最宽的截图元素宽度
+BATCH_MEASURE_SCRIPT = """
+    async () => {
+        await (window.__terminalReady || document.fonts.ready);
+        const widths = Array.from(document.querySelectorAll('.shot'), el => el.scrollWidth);
+        return Math.max(0, ...widths);
+    }
+"""
+
+# 等待视口调整后的下一帧
+NEXT_FRAME_SCRIPT = "() => new Promise(resolve => requestAnimationFrame(() => resolve()))"
+
+def render_prompt(env):
+    """根据环境变量中的 PS1 渲染提示符"""
     ps1 = env.get('PS1', '[\\u@\\h \\W]\\$ ')
-    prompt = parse_ps1(ps1, env)
+    return parse_ps1(ps1, env)
+
+
+def build_terminal_lines(env, command, output, return_code):
+    """
+    计算终端内容的逐行布局（HTML 和位图引擎共用）
+
+    Returns:
+        list: 每行是 (css_class, text) 片段列表，css_class 为 None 表示普通文本
+    """
+    prompt = render_prompt(env)
     
-    # 构建 HTML
-    html_parts = ['<!DOCTYPE html>']
-    html_parts.append('<html lang="zh-CN">')
-    html_parts.append('<head>')
-    html_parts.append('<meta charset="UTF-8">')
-    html_parts.append('<meta name="viewport" content="width=device-width, initial-scale=1.0">')
-    html_parts.append('<title>Terminal Screenshot</title>')
-    html_parts.append('<style>')
-    html_parts.append(get_css_styles(font_base64))
-    html_parts.append('</style>')
-    html_parts.append('</head>')
-    html_parts.append('<body>')
-    html_parts.append('<div class="terminal">')
+    lines = []
     
     # 提示符行（确保提示符和命令之间有一个空格）
-    prompt_escaped = escape_html(prompt)
     full_prompt_line = f"{prompt} {command}"
     if len(full_prompt_line) > SCREENSHOT_MAX_LINE_LENGTH:
         # 命令行超长，需要换行
@@ -267,11 +355,11 @@ def generate_single_command_html(env, command, output, return_code, font_base64)
         cmd_lines = wrapped_command.split('\n')
         for i, cmd_line in enumerate(cmd_lines):
             if i == 0:
-                html_parts.append(f'<div class="line"><span class="prompt">{prompt_escaped}</span> <span class="command">{escape_html(cmd_line)}</span></div>')
+                lines.append([('prompt', prompt), (None, ' '), ('command', cmd_line)])
             else:
-                html_parts.append(f'<div class="line"><span class="command">{escape_html(cmd_line)}</span></div>')
+                lines.append([('command', cmd_line)])
     else:
-        html_parts.append(f'<div class="line"><span class="prompt">{prompt_escaped}</span> <span class="command">{escape_html(command)}</span></div>')
+        lines.append([('prompt', prompt), (None, ' '), ('command', command)])
     
     # 输出行（return_code 为 1 时不显示输出）
     if output and return_code != 1:
@@ -280,18 +368,183 @@ def generate_single_command_html(env, command, output, return_code, font_base64)
             # 对每行输出进行长度限制
             wrapped_lines = wrap_text(line, SCREENSHOT_MAX_LINE_LENGTH).split('\n')
             for wrapped_line in wrapped_lines:
-                html_parts.append(f'<div class="line"><span class="output">{escape_html(wrapped_line)}</span></div>')
+                lines.append([('output', wrapped_line)])
     
     # 如果返回码非 0，显示错误信息（已禁用）
     # if return_code != 0:
-    #     html_parts.append(f'<div class="line"><span class="error">[返回码: {return_code}]</span></div>')
+    #     lines.append([('error', f'[返回码: {return_code}]')])
+    return lines
+
+
+def _line_width(segments):
+    """估算一行的 CSS 像素宽度"""
+    width = 0
+    for _, text in segments:
+        for char in text.expandtabs(8):
+            width += WIDE_CHAR_WIDTH if unicodedata.east_asian_width(char) in ('W', 'F') else CHAR_WIDTH
+    return width
+
+
+def estimate_block_size(lines, scale_factor=1):
+    """
+    估算终端区块截图的像素尺寸（不启动浏览器）
+
+    Args:
+        lines: build_terminal_lines 返回的行列表
+        scale_factor: 设备像素比
+
+    Returns:
+        tuple: (宽, 高)，单位为设备像素
+    """
+    css_width = max((_line_width(segments) for segments in lines), default=0) + BLOCK_WIDTH_CHROME
+    css_height = BLOCK_CHROME + len(lines) * LINE_PITCH
+    return round(css_width * scale_factor), round(css_height * scale_factor)
+
+
+def choose_scale_factor(lines, max_scale=DEFAULT_SCALE_FACTOR, min_scale=SCREENSHOT_MIN_SCALE_FACTOR,
+                        max_megapixels=SCREENSHOT_MAX_MEGAPIXELS, target_dpi=REPORT_TARGET_DPI,
+                        print_width=REPORT_SCREENSHOT_WIDTH):
+    """
+    自适应选择设备像素比
+
+    取满足以下条件的最大值（按 SCALE_FACTOR_STEP 向下取整，且不小于 min_scale）：
+    - 不超过 max_scale；
+    - 整个命令（所有分片）的像素总数不超过 max_megapixels；
+    - 截图在报告中按 print_width 英寸宽度嵌入时不超过 target_dpi，更高的分辨率打印不出来。
+    因此输出越长缩放越小，渲染耗时和文件大小大致不随输出长度增长。
+
+    Args:
+        lines: build_terminal_lines 返回的行列表（整个命令）
+
+    Returns:
+        int | float: 设备像素比（整数值返回 int，与固定模式的缓存键一致）
+    """
+    css_width, css_height = estimate_block_size(lines, 1)
+    scale = min(
+        max_scale,
+        math.sqrt(max_megapixels * 1_000_000 / max(css_width * css_height, 1)),
+        print_width * target_dpi / max(css_width, 1),
+    )
+    scale = max(min_scale, math.floor(scale / SCALE_FACTOR_STEP) * SCALE_FACTOR_STEP)
+    return int(scale) if float(scale).is_integer() else scale
+
+
+def split_terminal_tiles(lines, scale_factor, max_lines=SCREENSHOT_TILE_MAX_LINES,
+                         max_pixels=SCREENSHOT_TILE_MAX_PIXELS):
+    """
+    将终端内容按行数和像素预算切分为多张截图（分片）
+
+    每个分片的行数不超过 max_lines，且估算像素数（宽×高）不超过 max_pixels，
+    因此单张截图的大小与输出总长度无关。分片宽度按全部内容最宽的一行计算，
+    同一命令的各分片宽度一致。
+
+    Args:
+        lines: build_terminal_lines 返回的行列表
+        scale_factor: 设备像素比
+        max_lines: 每个分片的最大行数
+        max_pixels: 每个分片的最大像素数
+
+    Returns:
+        list: 分片列表，每个分片是行列表；内容为空时返回单个空分片
+    """
+    width, _ = estimate_block_size(lines, scale_factor)
+    pixel_lines = (max_pixels / max(width, 1) / scale_factor - BLOCK_CHROME) // LINE_PITCH
+    lines_per_tile = max(1, min(max_lines, int(pixel_lines)))
+    if not lines:
+        return [[]]
+    return [lines[start:start + lines_per_tile] for start in range(0, len(lines), lines_per_tile)]
+
+
+def build_screenshot_tiles(env, command, output, return_code, scale_factor):
+    """计算命令截图的分片（按顺序排列，每个分片渲染为一张 PNG）"""
+    return split_terminal_tiles(build_terminal_lines(env, command, output, return_code), scale_factor)
+
+
+def terminal_lines_html(lines):
+    """
+    根据行布局生成终端区块（.terminal 元素）
+
+    Returns:
+        list: HTML 行列表
+    """
+    html_parts = ['<div class="terminal">']
+    for segments in lines:
+        line_html = ''.join(
+            f'<span class="{css_class}">{escape_html(text)}</span>' if css_class else escape_html(text)
+            for css_class, text in segments
+        )
+        html_parts.append(f'<div class="line">{line_html}</div>')
     html_parts.append('</div>')
+    return html_parts
+
+
+def generate_terminal_block_html(env, command, output, return_code):
+    """
+    生成单个命令的终端区块（.terminal 元素）
+
+    Returns:
+        list: HTML 行列表
+    """
+    return terminal_lines_html(build_terminal_lines(env, command, output, return_code))
+
+
+def _wrap_html_document(body_parts, font_base64=None, font_src=None):
+    """
+    将终端区块包装为完整 HTML 页面
+
+    Args:
+        body_parts: 终端区块 HTML 行列表
+        font_base64: 内联的字体 base64（独立运行时使用）
+        font_src: 由请求拦截提供的字体地址；指定时样式表和字体都不内联
+    """
+    html_parts = ['<!DOCTYPE html>']
+    html_parts.append('<html lang="zh-CN">')
+    html_parts.append('<head>')
+    html_parts.append('<meta charset="UTF-8">')
+    html_parts.append('<meta name="viewport" content="width=device-width, initial-scale=1.0">')
+    html_parts.append('<title>Terminal Screenshot</title>')
+    if font_src:
+        html_parts.append(f'<link rel="stylesheet" href="{STYLESHEET_URL}">')
+        html_parts.append(f'<style>{get_font_face_css(font_src)}</style>')
+    else:
+        html_parts.append('<style>')
+        html_parts.append(get_css_styles(font_base64))
+        html_parts.append('</style>')
+    html_parts.append('</head>')
+    html_parts.append('<body>')
+    html_parts.extend(body_parts)
+    html_parts.append(f'<script>{READY_SCRIPT}</script>')
     html_parts.append('</body>')
     html_parts.append('</html>')
     
     return '\n'.join(html_parts)
 
 
+def generate_single_command_html(env, command, output, return_code, font_base64):
+    """为单个命令生成 HTML 页面"""
+    return _wrap_html_document(
+        generate_terminal_block_html(env, command, output, return_code),
+        font_base64
+    )
+
+
+def generate_blocks_html(blocks, font_base64=None, font_src=None):
+    """
+    为多个终端区块生成单个 HTML 页面，每个区块是一个独立的 .shot 元素
+
+    Args:
+        blocks: 区块列表，每个区块是 build_terminal_lines 格式的行列表
+        font_base64: 内联的字体 base64
+        font_src: 由请求拦截提供的字体地址（见 _wrap_html_document）
+    """
+    body_parts = []
+    for lines in blocks:
+        body_parts.append('<div class="shot">')
+        body_parts.extend(terminal_lines_html(lines))
+        body_parts.append('</div>')
+    return _wrap_html_document(body_parts, font_base64, font_src)
+
+
 def sanitize_filename(filename):
     """清理文件名，移除不安全的字符"""
     # 移除或替换不安全的字符
@@ -304,26 +557,116 @@ def sanitize_filename(filename):
     return filename
 
 
-def generate_screenshot_bytes(env, command, output, return_code, font_file='OperatorMono-Medium.otf', scale_factor=3):
+def _record_timing(timings, stage, started):
     """
-    生成终端截图并返回字节流
+    累加一个阶段的耗时（秒）到 timings，timings 为 None 时不记录
+
+    Returns:
+        float: 当前时间，作为下一阶段的起点
+    """
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + now - started
+    return now
+
+
+def _document_capture_steps(page, html_content, timings):
+    """
+    加载完整 HTML 并按内容尺寸截图的步骤（同步和异步 API 共用，执行方式见 _run_steps）
+    """
+    started = stage_started = time.perf_counter()
+
+    # 加载 HTML 内容（页面不依赖外部资源，DOM 就绪即可）
+    yield _set_content, (page, html_content)
+    stage_started = _record_timing(timings, 'set_content', stage_started)
+
+    if timings is not None:
+        # 分阶段计时：单独等待字体就绪，测量时就绪 Promise 已完成
+        yield page.evaluate, (FONT_READY_SCRIPT,)
+        stage_started = _record_timing(timings, 'font_ready', stage_started)
     
-    Args:
-        env: 环境变量字典
-        command: 命令字符串
-        output: 命令输出字符串
-        return_code: 返回码
-        font_file: 字体文件名，默认为 'OperatorMono-Medium.otf'
-        scale_factor: 设备像素比，默认 3
+    # 等待字体和布局就绪，并获取页面实际内容尺寸
+    content_size = yield page.evaluate, (MEASURE_SCRIPT,)
+    stage_started = _record_timing(timings, 'size_evaluate', stage_started)
+    
+    # 根据实际内容尺寸调整视口（添加2px边距用于padding）
+    yield page.set_viewport_size, ({
+        "width": content_size['width'] + 2,  # 1px padding * 2
+        "height": content_size['height'] + 2  # 1px padding * 2
+    },)
+    
+    # 等待调整视口后的重新布局
+    yield page.evaluate, (NEXT_FRAME_SCRIPT,)
+    stage_started = _record_timing(timings, 'resize', stage_started)
+
+    if SCREENSHOT_RECORD_WAIT_TIME:
+        waited_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"渲染就绪等待耗时: {waited_ms:.1f} ms (内容尺寸: {content_size['width']}x{content_size['height']})")
     
+    # 截图到内存（返回字节流）
+    screenshot = yield _screenshot_full_page, (page,)
+    _record_timing(timings, 'png_encode', stage_started)
+    return screenshot
+
+
+def _set_content(page, html_content):
+    return page.set_content(html_content, wait_until='domcontentloaded')
+
+
+def _screenshot_full_page(page):
+    return page.screenshot(full_page=True, type='png')
+
+
+def _run_steps(steps):
+    """
+    以同步 API 执行截图步骤
+
+    步骤生成器逐个产出 (页面方法, 参数)，执行结果 send 回生成器，
+    最后通过 StopIteration.value 返回截图结果。
+    """
+    result = None
+    try:
+        while True:
+            method, args = steps.send(result)
+            result = method(*args)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _run_steps_async(steps):
+    """以异步 API 执行截图步骤（见 _run_steps）"""
+    result = None
+    try:
+        while True:
+            method, args = steps.send(result)
+            result = await method(*args)
+    except StopIteration as stop:
+        return stop.value
+
+
+def capture_terminal_png(page, html_content, timings=None):
+    """
+    在给定页面中加载 HTML 并按内容尺寸截图
+
+    Args:
+        page: Playwright 页面
+        html_content: 终端 HTML
+        timings: 可选的分阶段耗时字典（秒），累加 set_content、font_ready、
+                 size_evaluate、resize、png_encode
+
     Returns:
         bytes: PNG 图片的字节流
-    
-    Raises:
-        FileNotFoundError: 如果字体文件不存在
     """
-    from io import BytesIO
-    
+    return _run_steps(_document_capture_steps(page, html_content, timings))
+
+
+async def capture_terminal_png_async(page, html_content, timings=None):
+    """capture_terminal_png 的异步版本（Playwright 异步 API 的页面）"""
+    return await _run_steps_async(_document_capture_steps(page, html_content, timings))
+
+
+def _resolve_font_path(font_file):
+    """获取 utils 目录下的字体文件路径，不存在时抛出 FileNotFoundError"""
     # 获取字体文件路径（相对于脚本目录）
     script_dir = Path(__file__).parent
     font_path = script_dir / font_file
@@ -331,81 +674,494 @@ def generate_screenshot_bytes(env, command, output, return_code, font_file='Oper
     # 验证字体文件是否存在
     if not font_path.exists():
         raise FileNotFoundError(f"字体文件不存在: {font_file}")
-    
-    # 加载字体文件并转换为 base64
-    font_base64 = load_font_as_base64(str(font_path))
-    
-    # 生成单个命令的 HTML
-    html_content = generate_single_command_html(env, command, output, return_code, font_base64)
-    
-    # 使用 Playwright 渲染并截图
-    with sync_playwright() as p:
-        # 启动浏览器
-        browser = p.chromium.launch(headless=True)
-        
-        # 创建 context 并设置设备像素比
-        context = browser.new_context(
-            device_scale_factor=scale_factor,
-            viewport={"width": 1600, "height": 100}
+    return font_path
+
+
+@lru_cache(maxsize=None)
+def _font_digest(font_path):
+    """字体文件内容摘要（用于缓存键，字体更新后缓存自动失效）"""
+    return hashlib.sha256(Path(font_path).read_bytes()).hexdigest()
+
+
+def render_signature(font_file, engine=None):
+    """
+    与内容无关、影响渲染结果的输入：渲染版本、引擎和字体内容
+
+    Returns:
+        list: 可 JSON 序列化的签名，任一项变化都需要重新渲染
+    """
+    engine = engine or SCREENSHOT_ENGINE
+    # 渲染结果相同的引擎（如 playwright 与 playwright_async）共用缓存
+    engine_class = SCREENSHOT_ENGINES.get(engine)
+    return [
+        RENDER_CACHE_VERSION,
+        engine_class.cache_name if engine_class else engine,
+        _font_digest(str(_resolve_font_path(font_file))),
+    ]
+
+
+def screenshot_cache_key(lines, font_file, scale_factor, engine=None, encoding=None):
+    """
+    计算截图缓存键：所有影响渲染结果的输入的哈希
+
+    以分片的行布局为内容（已包含渲染后的提示符、命令、换行后的输出，
+    以及返回码对输出显示的影响），加上字体内容、设备像素比和引擎，
+    任一变化都会得到不同的键。
+
+    Args:
+        lines: 分片的行列表（build_terminal_lines 格式）
+        encoding: 可选的图片编码设置（存储格式、压缩参数等），编码设置不同的文件不共用
+
+    Returns:
+        str: 64 位十六进制 SHA-256
+    """
+    version, engine_name, font_digest = render_signature(font_file, engine)
+    payload = json.dumps([version, engine_name, lines, font_digest, scale_factor, encoding], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _read_font_bytes(font_file):
+    """读取 utils 目录下的字体文件（每个进程只读一次）"""
+    return _resolve_font_path(font_file).read_bytes()
+
+
+@lru_cache(maxsize=None)
+def _load_bundled_font(font_file):
+    """加载 utils 目录下的字体文件为 base64（每个进程只编码一次）"""
+    return base64.b64encode(_read_font_bytes(font_file)).decode('utf-8')
+
+
+# 页面资源（样式表、字体）由浏览器 context 的请求拦截提供，渲染的 HTML 只包含终端文本
+ASSET_ORIGIN = 'https://terminal-assets.invalid'
+STYLESHEET_URL = f'{ASSET_ORIGIN}/terminal.css'
+FONT_URL_PREFIX = f'{ASSET_ORIGIN}/fonts/'
+
+def font_url(font_file):
+    """获取页面字体的资源地址（由请求拦截提供，浏览器可在页面间复用已解码的字体）"""
+    return f'{FONT_URL_PREFIX}{quote(font_file)}'
+
+
+def _asset_response(url):
+    """页面资源请求的响应参数（route.fulfill 的关键字参数）：样式表和字体，其他请求一律 404"""
+    path = urlparse(url).path
+    if path == urlparse(STYLESHEET_URL).path:
+        return {'status': 200, 'body': TERMINAL_CSS, 'content_type': 'text/css; charset=utf-8'}
+
+    font_prefix = urlparse(FONT_URL_PREFIX).path
+    if path.startswith(font_prefix):
+        font_file = unquote(path[len(font_prefix):])
+        body = None
+        # 只提供 utils 目录下的字体文件
+        if font_file == Path(font_file).name:
+            try:
+                body = _read_font_bytes(font_file)
+            except OSError:
+                body = None
+        if body is not None:
+            # 页面来源为 about:blank，跨域加载字体需要 CORS 响应头
+            return {'status': 200, 'body': body, 'headers': {
+                'Content-Type': 'font/otf',
+                'Access-Control-Allow-Origin': '*',
+                'Cache-Control': 'max-age=31536000, immutable',
+            }}
+
+    return {'status': 404, 'body': ''}
+
+
+def _handle_asset_route(route):
+    """
+    请求拦截（同步和异步 API 共用）
+
+    异步 API 的 route.fulfill 返回协程，由 Playwright 在调用处理函数后等待。
+    """
+    return route.fulfill(**_asset_response(route.request.url))
+
+
+def install_asset_routes(context):
+    """
+    为浏览器 context 注册页面资源的请求拦截（同步和异步 API 共用）
+
+    Returns:
+        异步 API 的 context 返回需要等待的协程，同步 API 返回 None
+    """
+    return context.route(f'{ASSET_ORIGIN}/**', _handle_asset_route)
+
+
+register_context_setup(install_asset_routes)
+register_async_context_setup(install_asset_routes)
+
+
+def capture_terminal_batch_png(page, html_content, timings=None):
+    """
+    在给定页面中加载批量 HTML，对每个 .shot 元素分别截图
+
+    Args:
+        page: Playwright 页面
+        html_content: generate_blocks_html 生成的 HTML
+        timings: 可选的分阶段耗时字典（秒），阶段同 capture_terminal_png
+
+    Returns:
+        list: 按页面顺序排列的 PNG 字节流
+    """
+    started = stage_started = time.perf_counter()
+
+    page.set_content(html_content, wait_until='domcontentloaded')
+    stage_started = _record_timing(timings, 'set_content', stage_started)
+
+    if timings is not None:
+        page.evaluate(FONT_READY_SCRIPT)
+        stage_started = _record_timing(timings, 'font_ready', stage_started)
+
+    # 等待字体和布局就绪，视口宽度设为最宽的命令，避免元素被横向裁剪
+    max_width = page.evaluate(BATCH_MEASURE_SCRIPT)
+    stage_started = _record_timing(timings, 'size_evaluate', stage_started)
+    page.set_viewport_size({
+        "width": max(1, max_width),
+        "height": page.viewport_size['height']
+    })
+    page.evaluate(NEXT_FRAME_SCRIPT)
+    stage_started = _record_timing(timings, 'resize', stage_started)
+
+    if SCREENSHOT_RECORD_WAIT_TIME:
+        waited_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"批量渲染就绪等待耗时: {waited_ms:.1f} ms")
+
+    shots = page.locator('.shot')
+    screenshots = [shots.nth(i).screenshot(type='png') for i in range(shots.count())]
+    _record_timing(timings, 'png_encode', stage_started)
+    return screenshots
+
+
+class ScreenshotEngine:
+    """
+    截图引擎接口
+
+    子类实现 render_blocks：一次渲染多个终端区块（行布局），每个区块一张截图。
+    """
+
+    name = None
+    # 截图缓存键中的引擎标识，默认为 name
+    cache_name = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'cache_name' not in cls.__dict__:
+            cls.cache_name = cls.name
+
+    def render_blocks(self, blocks, font_file, scale_factor, timings=None):
+        """
+        渲染多个终端区块，返回与 blocks 顺序一致的 PNG 字节流列表
+
+        timings 为可选的分阶段耗时字典（秒），由引擎累加各自的阶段。
+        """
+        raise NotImplementedError
+
+
+class PlaywrightEngine(ScreenshotEngine):
+    """Chromium 引擎：生成 HTML 并在浏览器池中截图"""
+
+    name = 'playwright'
+
+    def render_blocks(self, blocks, font_file, scale_factor, timings=None):
+        # 样式表和字体由请求拦截提供，HTML 只包含终端文本
+        font_src = font_url(font_file)
+
+        if len(blocks) == 1:
+            # 单个区块：按内容尺寸调整视口后整页截图
+            html_content = _wrap_html_document(terminal_lines_html(blocks[0]), font_src=font_src)
+            return [get_browser_pool().render(
+                lambda page: capture_terminal_png(page, html_content, timings),
+                scale_factor=scale_factor,
+                timings=timings
+            )]
+
+        # 同一页面加载所有区块，页面加载和字体解码只发生一次
+        html_content = generate_blocks_html(blocks, font_src=font_src)
+        return get_browser_pool().render(
+            lambda page: capture_terminal_batch_png(page, html_content, timings),
+            scale_factor=scale_factor,
+            timings=timings
         )
-        page = context.new_page()
-        
-        # 加载 HTML 内容
-        page.set_content(html_content)
-        
-        # 等待内容渲染和字体加载
-        page.wait_for_timeout(500)
-        
-        # 等待页面内容完全加载
-        page.wait_for_load_state('networkidle')
-        
-        # 获取页面实际内容尺寸
-        content_size = page.evaluate("""
-            () => {
-                const terminal = document.querySelector('.terminal');
-                if (terminal) {
-                    return {
-                        width: terminal.scrollWidth,
-                        height: terminal.scrollHeight
-                    };
-                }
-                const body = document.body;
-                const html = document.documentElement;
-                return {
-                    width: Math.max(
-                        body.scrollWidth, body.offsetWidth,
-                        html.clientWidth, html.scrollWidth, html.offsetWidth
-                    ),
-                    height: Math.max(
-                        body.scrollHeight, body.offsetHeight,
-                        html.clientHeight, html.scrollHeight, html.offsetHeight
-                    )
-                };
-            }
-        """)
-        
-        # 根据实际内容尺寸调整视口（添加2px边距用于padding）
-        viewport_width = content_size['width'] + 2  # 1px padding * 2
-        viewport_height = content_size['height'] + 2  # 1px padding * 2
-        
-        page.set_viewport_size({
-            "width": viewport_width,
-            "height": viewport_height
-        })
-        
-        # 重新等待内容渲染
-        page.wait_for_timeout(200)
-        
-        # 截图到内存（返回字节流）
-        screenshot_bytes = page.screenshot(
-            full_page=True,
-            type='png'
+
+
+class AsyncPlaywrightEngine(ScreenshotEngine):
+    """
+    Chromium 异步引擎：在异步浏览器池的一个浏览器中多页面并行截图
+
+    每个区块在独立页面中加载完整 HTML 并截图，同时渲染的页面数受 ASYNC_BROWSER_MAX_PAGES 限制，单个进程即可让多个 CPU 核心同时栅格化。
+    提供异步接口 render_blocks_async 和同步包装 render_blocks。
+    """
+
+    name = 'playwright_async'
+    # 与 playwright 引擎的渲染结果相同，共用截图缓存
+    cache_name = PlaywrightEngine.name
+
+    async def render_blocks_async(self, blocks, font_file, scale_factor, timings=None):
+        """异步渲染多个终端区块，返回与 blocks 顺序一致的 PNG 字节流列表（可在任意事件循环中 await）"""
+        pool = get_async_browser_pool()
+
+        async def render_block(lines):
+            # 每个页面加载一个区块的完整 HTML，按内容尺寸整页截图
+            html_content = _wrap_html_document(
+                terminal_lines_html(lines), font_src=font_url(font_file)
+            )
+            return await pool.render(
+                lambda page: capture_terminal_png_async(page, html_content, timings),
+                scale_factor=scale_factor,
+                timings=timings
+            )
+
+        return list(await asyncio.gather(*(render_block(lines) for lines in blocks)))
+
+    def render_blocks(self, blocks, font_file, scale_factor, timings=None):
+        # 在浏览器池的事件循环中执行，调用方线程阻塞等待
+        return get_async_browser_pool().run_sync(self.render_blocks_async(blocks, font_file, scale_factor, timings))
+
+
+class PillowEngine(ScreenshotEngine):
+    """
+    位图引擎：用 Pillow/FreeType 直接绘制终端截图，无需浏览器
+
+    复刻 get_css_styles 在 Chromium 中的版式：16px 字号、1em 行高的 .line，
+    .terminal 在 white-space: pre 下各行之间的换行符占半行高（line-height: 0.5），
+    1px 内边距，外加单命令截图的 2px 右/下边距。
+    按等宽列逐字绘制以使用未经 hinting 取整的字宽；字体中缺失的字形（如中文）
+    无法正确显示，这类内容建议使用 playwright 引擎。
+
+    逐字调用 draw.text 每次都要经过 FreeType 排版和光栅化，大输出时绘制耗时占大头。
+    FreeType 以 26.6 定点数（1/64 像素）定位字形，因此字形蒙版按
+    (字体, 字号, 字符, 起点的 1/64 像素小数部分) 缓存后逐字贴图，结果与 draw.text 逐像素一致。
+    """
+
+    name = 'pillow'
+
+    FONT_SIZE = 16
+    LINE_HEIGHT = 16
+    LINE_GAP = 8
+    PADDING = 1
+    MARGIN = 2
+    BACKGROUND = '#000000'
+    COLORS = {
+        None: '#ffffff',
+        'prompt': '#ffffff',
+        'command': '#ffffff',
+        'output': '#ffffff',
+        'error': '#ff0000',
+    }
+
+    # PNG 只是中间结果（保存前由 optimize_screenshot 重新编码），使用最快的压缩级别
+    PNG_COMPRESS_LEVEL = 1
+    # 字形蒙版缓存的条目上限（超出后清空重建）
+    GLYPH_CACHE_SIZE = 16384
+
+    def __init__(self):
+        # 延迟导入，仅在启用该引擎时依赖 Pillow
+        from PIL import Image, ImageColor, ImageDraw, ImageFont
+        self._image = Image
+        self._color = ImageColor
+        self._draw = ImageDraw
+        self._font_module = ImageFont
+        self._fonts = {}
+        self._advances = {}
+        self._glyphs = {}
+
+    def _get_font(self, font_file, size):
+        """按 (字体, 字号) 缓存 FreeType 字体"""
+        key = (font_file, size)
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._font_module.truetype(str(_resolve_font_path(font_file)), size)
+            self._fonts[key] = font
+        return font
+
+    def _get_advance(self, font_file):
+        """字体的字宽（em 比例），在大字号下测量以避免 hinting 取整误差"""
+        advance = self._advances.get(font_file)
+        if advance is None:
+            advance = self._get_font(font_file, 1000).getlength('M') / 1000
+            self._advances[font_file] = advance
+        return advance
+
+    def _get_glyph(self, font_key, font, char, x, y):
+        """
+        获取字符在 (x, y) 处的字形蒙版（缓存）
+
+        Returns:
+            tuple: (蒙版图像, 左上角坐标)
+        """
+        # 与 draw.text 相同：整数部分作为贴图位置，小数部分交给 FreeType 按 1/64 像素定位
+        left, top = int(x), int(y)
+        start_x, start_y = round((x - left) * 64), round((y - top) * 64)
+        if start_x == 64:
+            left, start_x = left + 1, 0
+        if start_y == 64:
+            top, start_y = top + 1, 0
+
+        key = (font_key, char, start_x, start_y)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            mask, offset = font.getmask2(char, 'L', anchor='ls', start=(start_x / 64, start_y / 64))
+            glyph = (self._image.frombytes('L', mask.size, bytes(mask)), offset)
+            if len(self._glyphs) >= self.GLYPH_CACHE_SIZE:
+                self._glyphs.clear()
+            self._glyphs[key] = glyph
+        mask, (offset_x, offset_y) = glyph
+        return mask, (left + offset_x, top + offset_y)
+
+    def render_blocks(self, blocks, font_file, scale_factor, timings=None):
+        return [self._render_lines(lines, font_file, scale_factor, timings) for lines in blocks]
+
+    def _render_lines(self, lines, font_file, scale_factor, timings=None):
+        from io import BytesIO
+
+        stage_started = time.perf_counter()
+        font_size = round(self.FONT_SIZE * scale_factor)
+        font = self._get_font(font_file, font_size)
+        char_width = self._get_advance(font_file) * self.FONT_SIZE
+        ascent, descent = font.getmetrics()
+        # 行内文字垂直居中（与 CSS line-height 的半行距一致）
+        baseline_offset = (self.LINE_HEIGHT * scale_factor - (ascent + descent)) / 2 + ascent
+
+        # white-space: pre 下制表符按 8 列对齐
+        lines = [
+            [(css_class, text.expandtabs(8)) for css_class, text in segments]
+            for segments in lines
+        ]
+        columns = max((sum(len(text) for _, text in segments) for segments in lines), default=0)
+
+        # 先按 CSS 像素取整（与浏览器视口尺寸一致），再乘以设备像素比
+        css_width = round(columns * char_width) + self.PADDING * 2 + self.MARGIN
+        css_height = (self.PADDING * 2 + self.LINE_GAP + self.MARGIN
+                      + len(lines) * (self.LINE_HEIGHT + self.LINE_GAP))
+        # 只有灰度颜色时（没有错误输出）绘制灰度图，PNG 编码的数据量只有 RGB 的三分之一
+        fills = {self.COLORS.get(css_class, '#ffffff') for segments in lines for css_class, _ in segments}
+        grayscale = all(len(set(self._color.getrgb(color))) == 1 for color in fills | {self.BACKGROUND})
+        image = self._image.new(
+            'L' if grayscale else 'RGB',
+            (round(css_width * scale_factor), round(css_height * scale_factor)),
+            self.BACKGROUND
         )
-        
-        # 关闭浏览器
-        browser.close()
+        draw = self._draw.Draw(image)
+
+        for index, segments in enumerate(lines):
+            top = self.PADDING + self.LINE_GAP + index * (self.LINE_HEIGHT + self.LINE_GAP)
+            y = top * scale_factor + baseline_offset
+            column = 0
+            for css_class, text in segments:
+                fill = self.COLORS.get(css_class, '#ffffff')
+                for char in text:
+                    if not char.isspace():
+                        x = (self.PADDING + column * char_width) * scale_factor
+                        mask, position = self._get_glyph((font_file, font_size), font, char, x, y)
+                        draw.bitmap(position, mask, fill=fill)
+                    column += 1
+
+        stage_started = _record_timing(timings, 'draw', stage_started)
+
+        buffer = BytesIO()
+        image.save(buffer, format='PNG', compress_level=self.PNG_COMPRESS_LEVEL)
+        _record_timing(timings, 'png_encode', stage_started)
+        return buffer.getvalue()
+
+
+# 可用的截图引擎
+SCREENSHOT_ENGINES = {
+    PlaywrightEngine.name: PlaywrightEngine,
+    AsyncPlaywrightEngine.name: AsyncPlaywrightEngine,
+    PillowEngine.name: PillowEngine,
+}
+
+_engine_instances = {}
+
+
+def get_screenshot_engine(name=None):
+    """
+    获取截图引擎实例（每个进程每种引擎一个）
+
+    Args:
+        name: 引擎名称，默认使用配置 SCREENSHOT_ENGINE
+    """
+    name = name or SCREENSHOT_ENGINE
+    engine = _engine_instances.get(name)
+    if engine is None:
+        if name not in SCREENSHOT_ENGINES:
+            raise ValueError(f"未知的截图引擎: {name}，可选: {', '.join(SCREENSHOT_ENGINES)}")
+        engine = SCREENSHOT_ENGINES[name]()
+        _engine_instances[name] = engine
+    return engine
+
+
+def generate_screenshot_bytes(env, command, output, return_code, font_file='OperatorMono-Medium.otf', scale_factor=3,
+                              engine=None):
+    """
+    生成终端截图并返回字节流
+    
+    Args:
+        env: 环境变量字典
+        command: 命令字符串
+        output: 命令输出字符串
+        return_code: 返回码
+        font_file: 字体文件名，默认为 'OperatorMono-Medium.otf'
+        scale_factor: 设备像素比，默认 3；为 'auto' 时按 choose_scale_factor 自适应选择
+        engine: 截图引擎名称，默认使用配置 SCREENSHOT_ENGINE
+    
+    Returns:
+        bytes: PNG 图片的字节流
     
-    return screenshot_bytes
+    Raises:
+        FileNotFoundError: 如果字体文件不存在
+    """
+    lines = build_terminal_lines(env, command, output, return_code)
+    if scale_factor == 'auto':
+        scale_factor = choose_scale_factor(lines)
+    return get_screenshot_engine(engine).render_blocks([lines], font_file, scale_factor)[0]
+
+
+async def generate_screenshot_bytes_async(env, command, output, return_code, font_file='OperatorMono-Medium.otf',
+                                          scale_factor=3):
+    """
+    generate_screenshot_bytes 的异步版本（playwright_async 引擎，可在任意事件循环中 await）
+
+    Returns:
+        bytes: PNG 图片的字节流
+    """
+    lines = build_terminal_lines(env, command, output, return_code)
+    engine = get_screenshot_engine(AsyncPlaywrightEngine.name)
+    return (await engine.render_blocks_async([lines], font_file, scale_factor))[0]
+
+
+def iter_tile_bytes(tiles, font_file='OperatorMono-Medium.otf', scale_factor=3, engine=None,
+                    max_page_pixels=SCREENSHOT_PAGE_MAX_PIXELS, timings=None):
+    """
+    按顺序渲染截图分片（split_terminal_tiles 的结果，可来自多个命令）
+
+    分片按顺序分组渲染，每组（一个页面）的估算像素总数不超过 max_page_pixels，
+    单个分片的大小又受分片预算限制；逐组产出结果，调用方可边渲染边保存，
+    因此峰值内存与输出总长度无关。
+
+    Args:
+        tiles: 分片列表，每个分片是行列表
+        font_file: 字体文件名
+        scale_factor: 设备像素比
+        engine: 截图引擎名称，默认使用配置 SCREENSHOT_ENGINE
+        max_page_pixels: 单次渲染的像素总数上限
+        timings: 可选的分阶段耗时字典（秒），累加所有分组的各阶段耗时
+
+    Yields:
+        bytes: 与 tiles 顺序一致的 PNG 字节流
+    """
+    screenshot_engine = get_screenshot_engine(engine)
+    group, group_pixels = [], 0
+    for lines in tiles:
+        width, height = estimate_block_size(lines, scale_factor)
+        if group and group_pixels + width * height > max_page_pixels:
+            yield from screenshot_engine.render_blocks(group, font_file, scale_factor, timings)
+            group, group_pixels = [], 0
+        group.append(lines)
+        group_pixels += width * height
+    if group:
+        yield from screenshot_engine.render_blocks(group, font_file, scale_factor, timings)
 
 
 def generate_screenshot(json_file='test.json', output_dir='output', font_file='OperatorMono-Medium.otf'):
@@ -466,65 +1222,9 @@ def generate_screenshot(json_file='test.json', output_dir='output', font_file='O
             output_filename = f"{command_index:02d}_{safe_command}.png"
             output_file = output_path / output_filename
             
-            # 加载 HTML 内容
-            page.set_content(html_content)
-            
-            # 等待内容渲染和字体加载
-            page.wait_for_timeout(500)
-            
-            # 等待页面内容完全加载
-            page.wait_for_load_state('networkidle')
-            
-            # 获取页面实际内容尺寸
-            content_size = page.evaluate("""
-                () => {
-                    const terminal = document.querySelector('.terminal');
-                    if (terminal) {
-                        return {
-                            width: terminal.scrollWidth,
-                            height: terminal.scrollHeight
-                        };
-                    }
-                    const body = document.body;
-                    const html = document.documentElement;
-                    return {
-                        width: Math.max(
-                            body.scrollWidth, body.offsetWidth,
-                            html.clientWidth, html.scrollWidth, html.offsetWidth
-                        ),
-                        height: Math.max(
-                            body.scrollHeight, body.offsetHeight,
-                            html.clientHeight, html.scrollHeight, html.offsetHeight
-                        )
-                    };
-                }
-            """)
-            
-            # 根据实际内容尺寸调整视口（添加2px边距用于padding）
-            # 注意：由于 device_scale_factor=2，实际截图分辨率会是视口尺寸的 2 倍
-            viewport_width = content_size['width'] + 2  # 1px padding * 2
-            viewport_height = content_size['height'] + 2  # 1px padding * 2
-            
-            page.set_viewport_size({
-                "width": viewport_width,
-                "height": viewport_height
-            })
-            
-            # 重新等待内容渲染
-            page.wait_for_timeout(200)
-            
-            # 截图（使用 full_page=True 自动截取整个页面内容）
-            page.screenshot(
-                path=str(output_file),
-                full_page=True,
-                # type="jpeg",
-                # quality=100
-            )
-            
-            # 获取实际截图尺寸（由于 device_scale_factor=2，实际尺寸是视口的 2 倍）
-            actual_width = viewport_width * 2
-            actual_height = viewport_height * 2
-            logger.debug(f"终端截图已保存到: {output_file} (视口: {viewport_width}x{viewport_height}, 实际分辨率: {actual_width}x{actual_height})")
+            # 渲染并截图（按内容尺寸自动调整视口）
+            output_file.write_bytes(capture_terminal_png(page, html_content))
+            logger.debug(f"终端截图已保存到: {output_file}")
             command_index += 1
 
         # 关闭浏览器
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+独立截图工作者
+与 API 服务共用 inspections.db，消费 command_executions 中的待处理截图任务，
+可同时运行多个实例（任务通过原子领取和租约分配，不会重复处理）
+
+用法:
+    python -m backend.worker                  # 在仓库根目录
+    python worker.py --processes 4            # 在 backend 目录
+API 服务需设置 SCREENSHOT_EMBEDDED_WORKER=0，避免同时启动内置工作者。
+收到 SIGTERM/SIGINT 后处理完当前任务再退出，再次收到信号时立即退出。
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+from pathlib import Path
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from models.database import init_database
+from services.screenshot_task_service import ScreenshotTaskService
+from services.screenshot_worker_pool import ScreenshotWorkerPool
+from services import screenshot_notifier
+from utils.browser_pool import shutdown_browser_pool
+from utils.async_browser_pool import shutdown_async_browser_pool
+from utils.logger import setup_logging, get_logger
+from config import (
+    DATABASE_PATH, SCREENSHOT_WORKER_PROCESSES, SCREENSHOT_WORKER_BATCH_SIZE,
+    SCREENSHOT_WORKER_POLL_INTERVAL, SCREENSHOT_WORKER_STATS_INTERVAL
+)
+
+logger = get_logger('worker')
+
+
+def run_inline(batch_size, poll_interval, stop_event, wakeup_event):
+    """在当前进程中循环处理任务（--processes 0）"""
+    while not stop_event.is_set():
+        wakeup_event.clear()
+        try:
+            processed = ScreenshotTaskService.process_all_pending(
+                batch_size=batch_size,
+                should_stop=stop_event.is_set
+            )
+            if processed > 0:
+                logger.info(f"处理了 {processed} 个截图任务")
+        except Exception as e:
+            logger.exception(f"截图处理错误: {e}")
+        wakeup_event.wait(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='独立截图工作者')
+    parser.add_argument('--processes', type=int, default=SCREENSHOT_WORKER_PROCESSES,
+                        help='工作进程数，0 表示在当前进程中处理（默认使用配置 SCREENSHOT_WORKER_PROCESSES）')
+    parser.add_argument('--batch-size', type=int, default=SCREENSHOT_WORKER_BATCH_SIZE, help='每次拉取的任务数')
+    parser.add_argument('--poll-interval', type=float, default=SCREENSHOT_WORKER_POLL_INTERVAL,
+                        help='兜底轮询间隔（秒），API 入队时会立即唤醒')
+    parser.add_argument('--drain-timeout', type=float, default=60,
+                        help='收到退出信号后等待当前任务完成的时间（秒），超时强制终止')
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    init_database()
+    logger.info(f"截图工作者已启动 (pid={os.getpid()})，数据库: {DATABASE_PATH.resolve()}")
+
+    stop_event = threading.Event()
+
+    def signal_handler(signum, frame):
+        if stop_event.is_set():
+            logger.warning(f"再次收到信号 {signum}，立即退出")
+            # 未完成的任务租约到期后由其他工作者重新领取
+            os._exit(1)
+        logger.info(f"收到信号 {signum}，处理完当前任务后退出...")
+        stop_event.set()
+        wakeup_event.set()
+        if pool is None:
+            # 进程池模式由 pool.stop 控制等待时间；单进程模式超时后直接退出
+            timer = threading.Timer(args.drain_timeout, os._exit, (1,))
+            timer.daemon = True
+            timer.start()
+
+    pool = None
+    wakeup_event = screenshot_notifier.subscribe()
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    if args.processes > 0:
+        # 先 fork 工作进程，再启动监听线程
+        pool = ScreenshotWorkerPool(
+            processes=args.processes,
+            batch_size=args.batch_size,
+            poll_interval=args.poll_interval,
+            stats_interval=SCREENSHOT_WORKER_STATS_INTERVAL
+        )
+        pool.start()
+    listener = screenshot_notifier.start_listener()
+
+    try:
+        if pool:
+            stop_event.wait()
+            pool.stop(args.drain_timeout)
+        else:
+            run_inline(max(1, args.batch_size), args.poll_interval, stop_event, wakeup_event)
+    finally:
+        screenshot_notifier.stop_listener(listener)
+        shutdown_browser_pool()
+        shutdown_async_browser_pool()
+        logger.info("截图工作者已退出")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
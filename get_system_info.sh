@@ -278,6 +278,34 @@ generate_output() {
 }
 
 # Upload data to server
+# Request body encodings the server accepts (advertised by /health in the Accept-Encoding header)
+server_accept_encoding() {
+    curl -s -o /dev/null -D - --max-time 10 "${SERVER_URL}/health" 2>/dev/null \
+        | tr -d '\r' \
+        | awk -F': ' 'tolower($1) == "accept-encoding" { print tolower($2) }'
+}
+
+# Pick the best encoding supported by both the server and this host (empty: send uncompressed)
+choose_upload_encoding() {
+    local accepted
+    accepted=$(server_accept_encoding || true)
+
+    if [[ "$accepted" == *zstd* ]] && command -v zstd >/dev/null 2>&1; then
+        echo "zstd"
+    elif [[ "$accepted" == *gzip* ]] && command -v gzip >/dev/null 2>&1; then
+        echo "gzip"
+    fi
+}
+
+compress_payload() {
+    local encoding="$1"
+
+    case "$encoding" in
+        zstd) zstd -q -c ;;
+        gzip) gzip -c ;;
+    esac
+}
+
 upload_to_server() {
     local json_data="$1"
     local api_url="${SERVER_URL}/api/v1/inspections"
@@ -286,11 +314,22 @@ upload_to_server() {
 
     local response
     local http_code
+    local encoding
+    encoding=$(choose_upload_encoding)
 
     # Use curl to upload, capture response and http code
-    response=$(curl -s -w "\n%{http_code}" -X POST "$api_url" \
-        -H "Content-Type: application/json" \
-        -d "$json_data" 2>&1)
+    if [[ -n "$encoding" ]]; then
+        echo "# Compressing payload with $encoding" >&2
+        response=$(printf '%s' "$json_data" | compress_payload "$encoding" \
+            | curl -s -w "\n%{http_code}" -X POST "$api_url" \
+                -H "Content-Type: application/json" \
+                -H "Content-Encoding: $encoding" \
+                --data-binary @- 2>&1)
+    else
+        response=$(curl -s -w "\n%{http_code}" -X POST "$api_url" \
+            -H "Content-Type: application/json" \
+            -d "$json_data" 2>&1)
+    fi
 
     http_code=$(echo "$response" | tail -n1)
     response=$(echo "$response" | sed '$d')